@@ -1,8 +1,31 @@
-from flask import Flask, request, jsonify
-from flask_migrate import Migrate
+if __name__ == '__main__':
+    # Development server: load .env before config reads the environment
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import functools
+
+import click
+from flask import Flask, g, request, jsonify, stream_with_context, url_for
 from config import Config
-from model import db, Product
-import re
+from model import db, Offer, Product, PricingVersion
+from offers import MAX_OFFER_QUANTITY, OfferEngine, offer_codes, offer_to_dict, validate_offer
+from pricing import PricingCache, CartError, cart_codes, offer_columns, parse_offer, price_cart, product_price
+import pricing_vector
+from metrics import Metrics
+from cart_store import Cart, CartStore, delete_persisted, load_persisted, new_cart_id, persisted_revision, save_persisted
+from reprice_job import reprice_command
+from quote_cache import QuoteCache, RedisQuoteBackend, normalize_cart, quote_key
+from pricing_history import (
+    change_to_dict, changes_since, first_version, offer_change, pricing_as_of, product_change, record_changes
+)
+from pricing_import import NDJSON_MIMETYPE, CSV_MIMETYPE, read_csv, read_json, read_ndjson, replace_products, validate_row
+import json_codec
+import idempotency
+from write_coalescer import WriteCoalescer
+from replicas import ReplicaPool, replica_binds
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.pool import StaticPool
 from flask import current_app
 import logging
 
@@ -10,71 +33,292 @@ def create_app(config_class=Config):
     # Create Flask app using factory pattern
     app = Flask(__name__)
     app.config.from_object(config_class)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', _engine_options(app.config))
+    replica_uris = app.config['SQLALCHEMY_REPLICA_URIS']
+    if replica_uris:
+        app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {}, **replica_binds(replica_uris))
+    if app.config['JSON_ORJSON_ENABLED'] and json_codec.available():
+        app.json = json_codec.OrjsonProvider(app)
 
-    # Initialize the database and migration tool
+    # Initialize the database; Flask-Migrate (and Alembic) load only when a `flask db` command runs
     db.init_app(app)
-    migrate = Migrate(app, db)
+    app.cli.add_command(_MigrateCommands(app))
+
+    # Read-only routes (see reads_from_replica) are spread over the replicas; everything else uses the primary
+    replica_pool = None
+    if replica_uris:
+        for key in replica_binds(replica_uris):
+            # No models are bound to a replica; without this, create_all() would try to create
+            # tables on it, and fail in any other app made from the same `db` without replicas
+            db.metadatas.pop(key, None)
+        with app.app_context():
+            replica_pool = ReplicaPool(
+                {key: db.engines[key] for key in replica_binds(replica_uris)},
+                check_interval=app.config['REPLICA_CHECK_INTERVAL'],
+                retry_interval=app.config['REPLICA_RETRY_INTERVAL']
+            )
+        app.extensions['replica_pool'] = replica_pool
+
+    # Each worker process keeps its own snapshot of the pricing table (or maps the shared snapshot file)
+    pricing_cache = PricingCache(
+        check_interval=app.config['PRICING_CACHE_CHECK_INTERVAL'],
+        directory=app.config['PRICING_SNAPSHOT_DIR'],
+        quantity_table_size=app.config['PRICING_QUANTITY_TABLE_SIZE'],
+        quantity_table_products=app.config['PRICING_QUANTITY_TABLE_PRODUCTS']
+    )
+    app.extensions['pricing_cache'] = pricing_cache
+
+    # Set up logging; LOG_LEVEL=DEBUG is for development only
+    if app.config['LOG_CONFIGURE_ROOT']:
+        logging.basicConfig(level=app.config['LOG_LEVEL'])
+    app.logger.setLevel(app.config['LOG_LEVEL'])
+
+    # Memoized quotes keyed by normalized cart and pricing version
+    backend = RedisQuoteBackend(app.config['QUOTE_CACHE_REDIS_URL']) if app.config['QUOTE_CACHE_REDIS_URL'] else None
+    quote_cache = QuoteCache(
+        max_entries=app.config['QUOTE_CACHE_MAX_ENTRIES'],
+        max_bytes=app.config['QUOTE_CACHE_MAX_BYTES'],
+        ttl=app.config['QUOTE_CACHE_TTL'],
+        backend=backend
+    )
+    app.extensions['quote_cache'] = quote_cache
+
+    # Cart sessions priced incrementally, one line per update
+    cart_store = CartStore(idle_timeout=app.config['CART_IDLE_TIMEOUT'], max_carts=app.config['CART_MAX_SESSIONS'])
+    app.extensions['cart_store'] = cart_store
+
+    # Concurrent single-SKU PATCHes share one transaction and one pricing version bump
+    patch_coalescer = WriteCoalescer(
+        lambda patches: _apply_product_patches(patches),
+        window=app.config['PRICING_PATCH_WINDOW'],
+        max_batch=app.config['PRICING_PATCH_BATCH_SIZE']
+    )
+    app.extensions['patch_coalescer'] = patch_coalescer
+
+    # Offline batch re-pricing: `flask reprice orders.ndjson results.ndjson`
+    app.cli.add_command(reprice_command)
+
+    # Latency, query-count and cart-size metrics exposed on /metrics
+    metrics = None
+    if app.config['METRICS_ENABLED']:
+        metrics = Metrics()
+        with app.app_context():
+            # Primary and replica engines alike
+            metrics.init_app(app, db.engines.values())
+        app.extensions['metrics'] = metrics
+
+    @app.before_request
+    def replay_idempotent_write():
+        # A write retried with the same Idempotency-Key gets the first response instead of running again
+        key = request.headers.get(idempotency.HEADER)
+        if key is None or request.method not in ('POST', 'PUT', 'PATCH', 'DELETE'):
+            return None
+        if not key or len(key) > idempotency.MAX_KEY_LENGTH:
+            return jsonify({'error': f'{idempotency.HEADER} must be 1 to {idempotency.MAX_KEY_LENGTH} characters.'}), 400
+        # Streamed uploads are not buffered just to hash them; their length stands in for the body,
+        # so a chunked one (no length) cannot be told apart from another upload
+        streamed = request.mimetype in (NDJSON_MIMETYPE, CSV_MIMETYPE)
+        if streamed and request.content_length is None:
+            return jsonify({'error': f'Uploads with an {idempotency.HEADER} must send Content-Length.'}), 411
+        body = str(request.content_length).encode() if streamed else request.get_data()
+        fingerprint = idempotency.fingerprint(request.method, request.full_path, body)
+        stored = idempotency.claim(key, fingerprint, app.config['IDEMPOTENCY_KEY_TTL'], app.config['IDEMPOTENCY_PENDING_TIMEOUT'])
+        if stored is None:
+            g.idempotency_key = key
+            return None
+        if stored.fingerprint != fingerprint:
+            return jsonify({'error': f'{idempotency.HEADER} {key} was already used for a different request.'}), 422
+        if stored.status is None:
+            return jsonify({'error': f'A request with {idempotency.HEADER} {key} is still in progress.'}), 409
+        response = app.response_class(stored.body, status=stored.status, content_type=stored.content_type)
+        if stored.etag:
+            response.headers['ETag'] = stored.etag
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+    @app.after_request
+    def record_idempotent_write(response):
+        key = g.pop('idempotency_key', None)
+        if key is None:
+            return response
+        try:
+            # Failed requests release the key, so the client can retry them with it
+            if response.status_code < 400:
+                idempotency.record(key, response)
+            else:
+                idempotency.release(key)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            current_app.logger.warning("Could not store the response for %s %s: %s", idempotency.HEADER, key, e)
+        return response
 
-    # Set up logging
-    logging.basicConfig(level=logging.DEBUG)
-    app.logger.setLevel(logging.DEBUG)
+    @app.after_request
+    def add_pricing_version(response):
+        # Sent back as Min-Pricing-Version, it keeps the client's reads on replicas that have its write
+        version = g.pop('pricing_version', None)
+        if version is not None:
+            response.headers.setdefault('Pricing-Version', str(version))
+        return response
+
+    def reads_from_replica(view):
+        # Marks a route that never writes; with replicas configured it runs on the next healthy one
+        # that has replayed the client's Min-Pricing-Version, otherwise on the primary
+        @functools.wraps(view)
+        def route(*args, **kwargs):
+            min_version = request.headers.get('Min-Pricing-Version', type=int)
+            g.min_pricing_version = min_version
+            if replica_pool is not None:
+                g.read_replica = replica_pool.choose(min_version)
+            return view(*args, **kwargs)
+        return route
 
     # Define routes within the app factory
     @app.route('/api/pricing', methods=['POST'])
     def replace_pricing_table():
-        data = request.json
-        if not isinstance(data, list):
-            return jsonify({"error": "Invalid data format. Expecting a list of products."}), 400
-        Product.query.delete()
-        for product_data in data:
-            code = product_data.get('code')
-            unit_price = product_data.get('unit_price')
-            special_price = product_data.get('special_price')
-            if not code or not unit_price:
-                return jsonify({"error": f"Missing code or unit price for product: {product_data}"}), 400
-            new_product = Product(code=code, unit_price=unit_price, special_price=special_price)
-            db.session.add(new_product)
-        db.session.commit()
-        return jsonify({"message": "Pricing table replaced successfully"}), 201
+        if request.mimetype == NDJSON_MIMETYPE:
+            records = read_ndjson(request.stream)
+        elif request.mimetype == CSV_MIMETYPE:
+            records = read_csv(request.stream)
+        else:
+            data = request.json
+            if not isinstance(data, list):
+                return jsonify({"error": "Invalid data format. Expecting a list of products."}), 400
+            records = read_json(data)
+        # Bumped first: the diff against the old table is logged at the new version before the swap
+        version = PricingVersion.bump()
+        precondition_failed = _table_precondition_failed(version)
+        if precondition_failed:
+            return precondition_failed
+        try:
+            count = replace_products(records, batch_size=app.config['PRICING_IMPORT_BATCH_SIZE'], version=version)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({"error": str(e)}), 400
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({"error": "Duplicate product codes in pricing table."}), 400
+        _commit_pricing_change(version=version)
+        return jsonify({"message": "Pricing table replaced successfully", "count": count}), 201, {'ETag': f'"pricing-{version}"'}
 
     @app.route('/api/pricing', methods=['PUT'])
     def update_pricing_table():
         data = request.json
         if not isinstance(data, list):
             return jsonify({"error": "Invalid data format. Expecting a list of products."}), 400
-        for product_data in data:
-            code = product_data.get('code')
-            unit_price = product_data.get('unit_price')
-            special_price = product_data.get('special_price')
-            if not code or not unit_price:
-                return jsonify({"error": f"Missing code or unit price for product: {product_data}"}), 400
-            product = Product.query.filter_by(code=code).first()
-            if product:
-                product.unit_price = unit_price
-                product.special_price = special_price
-            else:
-                new_product = Product(code=code, unit_price=unit_price, special_price=special_price)
-                db.session.add(new_product)
-        db.session.commit()
-        return jsonify({"message": "Pricing table updated successfully"}), 200
+        # Validate the whole payload before writing anything; a later duplicate code wins
+        rows = {}
+        try:
+            for line_number, product_data in read_json(data):
+                row = validate_row(line_number, product_data)
+                rows[row['code']] = row
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        version = PricingVersion.bump()
+        precondition_failed = _table_precondition_failed(version)
+        if precondition_failed:
+            return precondition_failed
+        Product.upsert_many([dict(row, version=version) for row in rows.values()], chunk_size=app.config['PRICING_UPSERT_CHUNK_SIZE'])
+        _commit_pricing_change([product_change(row['code'], row['unit_price'], row['special_price']) for row in rows.values()],
+                               version=version)
+        return jsonify({"message": "Pricing table updated successfully"}), 200, {'ETag': f'"pricing-{version}"'}
 
     @app.route('/api/pricing', methods=['GET'])
+    @reads_from_replica
     def get_pricing_table():
-        products = Product.query.all()
-        return jsonify([product.to_dict() for product in products])
+        snapshot = _snapshot() if app.config['PRICING_CACHE_ENABLED'] else None
+        # The pricing version identifies the table contents, so polling clients get a cheap 304
+        etag = f"pricing-{snapshot.version if snapshot else PricingVersion.current()}"
+        if request.if_none_match.contains(etag):
+            return '', 304, {'ETag': f'"{etag}"'}
 
-    @app.route('/api/pricing/<code>', methods=['PATCH'])
-    def update_product_partially(code):
-        product = Product.query.filter_by(code=code).first()
+        after = request.args.get('after')
+        limit = None
+        if 'limit' in request.args:
+            limit = request.args.get('limit', type=int)
+            if limit is None or limit < 1:
+                return jsonify({"error": "limit must be a positive integer."}), 400
+            limit = min(limit, app.config['PRICING_PAGE_MAX_LIMIT'])
+        changed_since = None
+        if 'changed_since' in request.args:
+            changed_since = request.args.get('changed_since', type=int)
+            if changed_since is None or changed_since < 0:
+                return jsonify({"error": "changed_since must be a non-negative integer."}), 400
+            # Snapshots do not keep row versions; the products.version index finds the rows instead
+            snapshot = None
+
+        if request.args.get('stream', 'false').lower() == 'true':
+            rows = snapshot.stream(after) if snapshot else _stream_products(after, changed_since)
+            response = app.response_class(stream_with_context(_json_array_chunks(rows)), mimetype='application/json')
+        elif after is None and limit is None and changed_since is None:
+            products = snapshot.products.values() if snapshot else Product.query.all()
+            response = jsonify([product.to_dict() for product in products])
+        else:
+            rows, has_more = snapshot.page(after, limit) if snapshot else _query_page(after, limit, changed_since)
+            response = jsonify([product.to_dict() for product in rows])
+            if has_more and rows:
+                next_url = url_for('get_pricing_table', after=rows[-1].code, limit=limit, changed_since=changed_since)
+                response.headers['Link'] = f'<{next_url}>; rel="next"'
+        response.set_etag(etag)
+        return response
+
+    @app.route('/api/pricing/changes', methods=['GET'])
+    @reads_from_replica
+    def get_pricing_changes():
+        # Without a default, a malformed value is None rather than silently the default (the whole log)
+        since = request.args.get('since', type=int) if 'since' in request.args else 0
+        limit = request.args.get('limit', type=int) if 'limit' in request.args else app.config['PRICING_PAGE_MAX_LIMIT']
+        if since is None or limit is None or since < 0 or limit < 1:
+            return jsonify({"error": "since must be a non-negative integer and limit a positive integer."}), 400
+        changes, has_more = changes_since(since, min(limit, app.config['PRICING_PAGE_MAX_LIMIT']))
+        return jsonify({
+            'changes': [change_to_dict(change) for change in changes],
+            # Pass back as ?since= to continue; unchanged when there is nothing new
+            'next_since': changes[-1].seq if changes else since,
+            'has_more': has_more
+        })
+
+    @app.route('/api/pricing/cache', methods=['GET'])
+    def get_pricing_cache_stats():
+        return jsonify(pricing_cache.stats())
+
+    @app.route('/api/pricing/<code>', methods=['GET'])
+    @reads_from_replica
+    def get_product(code):
+        # Read from the database: the ETag is the row's version, which PATCH takes in If-Match
+        product = db.session.get(Product, code)
         if not product:
             return jsonify({"error": f"Product with code {code} not found"}), 404
+        etag = f"product-{product.version}"
+        if request.if_none_match.contains(etag):
+            return '', 304, {'ETag': f'"{etag}"'}
+        return jsonify(product.to_dict()), 200, {'ETag': f'"{etag}"'}
+
+    @app.route('/api/pricing/<code>', methods=['PATCH'])
+    def update_product_partially(code):
         data = request.json
+        if not isinstance(data, dict):
+            return jsonify({"error": "Invalid data format. Expecting an object with unit_price and/or special_price."}), 400
+        fields = {}
         if 'unit_price' in data:
-            product.unit_price = data['unit_price']
+            if type(data['unit_price']) is not int or data['unit_price'] <= 0:
+                return jsonify({"error": f"Invalid unit price for product: {code}"}), 400
+            fields['unit_price'] = data['unit_price']
         if 'special_price' in data:
-            product.special_price = data['special_price']
-        db.session.commit()
-        return jsonify({"message": f"Product {code} updated successfully"}), 200
+            try:
+                offer = parse_offer(data['special_price'], MAX_OFFER_QUANTITY)
+            except ValueError as e:
+                return jsonify({"error": f"{e} Product: {code}"}), 400
+            fields['special_price'] = data['special_price']
+            fields.update(offer_columns(offer))
+        status, row = patch_coalescer.submit((code, fields, _if_match_versions('product')))
+        if status == 404:
+            return jsonify({"error": f"Product with code {code} not found"}), 404
+        headers = {'ETag': f'"product-{row["version"]}"'}
+        if status == 412:
+            return jsonify({"error": f"Product {code} was modified since it was read."}), 412, headers
+        # Coalesced PATCHes commit in the batch leader's thread, so the version is set here for each of them
+        headers['Pricing-Version'] = str(row['version'])
+        return jsonify({"message": f"Product {code} updated successfully"}), 200, headers
 
     @app.route('/api/pricing', methods=['DELETE'])
     def delete_products():
@@ -82,6 +326,10 @@ def create_app(config_class=Config):
         if not isinstance(data, list):
             return jsonify({"error": "Invalid input format. Expected a list of product codes."}), 400
 
+        version = PricingVersion.bump()
+        precondition_failed = _table_precondition_failed(version)
+        if precondition_failed:
+            return precondition_failed
         deleted_products = []
         for code in data:
             product = Product.query.filter_by(code=code).first()
@@ -89,57 +337,547 @@ def create_app(config_class=Config):
                 db.session.delete(product)
                 deleted_products.append(code)
             else:
-                current_app.logger.warning(f"Product with code {code} not found.")
+                current_app.logger.warning("Product with code %s not found.", code)
         
         if deleted_products:
-            db.session.commit()
+            _commit_pricing_change([product_change(code, op='delete') for code in deleted_products], version=version)
             return jsonify({"message": "Products deleted successfully", "deleted_products": deleted_products}), 200
         else:
+            db.session.rollback()
             return jsonify({"error": "No products found to delete."}), 404
 
+    @app.route('/api/offers', methods=['GET'])
+    @reads_from_replica
+    def get_offers():
+        return jsonify([offer_to_dict(offer) for offer in Offer.query.order_by(Offer.id)])
+
+    @app.route('/api/offers', methods=['POST'])
+    def create_offers():
+        data = request.json
+        if not isinstance(data, list):
+            return jsonify({"error": "Invalid data format. Expecting a list of offers."}), 400
+        # Validate the whole payload before writing anything
+        try:
+            rows = [validate_offer(offer_data) for offer_data in data]
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        response = _check_offer_codes(rows)
+        if response:
+            return response
+        offers = [Offer(**row) for row in rows]
+        db.session.add_all(offers)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({"error": "Offer ids conflict with existing offers. Please retry."}), 409
+        _commit_pricing_change([offer_change(offer.id, row) for offer, row in zip(offers, rows)])
+        return jsonify({"message": "Offers created successfully", "ids": [offer.id for offer in offers]}), 201
+
+    @app.route('/api/offers/<int:offer_id>', methods=['PUT'])
+    def replace_offer(offer_id):
+        try:
+            row = validate_offer(request.json)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        response = _check_offer_codes([row])
+        if response:
+            return response
+        # Replace only: ids are taken from the offers sequence, which an explicit id would not advance
+        offer = db.session.get(Offer, offer_id)
+        if offer is None:
+            return jsonify({"error": f"Offer {offer_id} not found."}), 404
+        for column, value in row.items():
+            setattr(offer, column, value)
+        _commit_pricing_change([offer_change(offer_id, row)])
+        return jsonify({"message": f"Offer {offer_id} saved successfully"}), 200
+
+    @app.route('/api/offers/<int:offer_id>', methods=['DELETE'])
+    def delete_offer(offer_id):
+        offer = db.session.get(Offer, offer_id)
+        if offer is None:
+            return jsonify({"error": f"Offer {offer_id} not found."}), 404
+        db.session.delete(offer)
+        _commit_pricing_change([offer_change(offer_id)])
+        return jsonify({"message": f"Offer {offer_id} deleted successfully"}), 200
+
+    def _check_offer_codes(rows):
+        codes = list(dict.fromkeys(code for row in rows for code in offer_codes(row)))
+        found = {code for (code,) in db.session.execute(db.select(Product.code).where(Product.code.in_(codes)))}
+        missing_codes = [code for code in codes if code not in found]
+        if missing_codes:
+            return jsonify({"error": f"Products with codes {', '.join(missing_codes)} not found.", "missing_codes": missing_codes}), 404
+        return None
+
     @app.route('/api/subtotal', methods=['POST'])
+    @reads_from_replica
     def calculate_subtotal():
         try:
             items = request.json
-            total = 0
-            if not isinstance(items, list):
-                return jsonify({'error': 'Invalid input format. Expected a list of items.'}), 400
-            for item in items:
-                code = item.get('code')
-                quantity = item.get('quantity')
-                if not code or not quantity:
-                    return jsonify({'error': f'Missing code or quantity for item: {item}'}), 400
-                product = Product.query.filter_by(code=code).first()
-                if not product:
-                    current_app.logger.error(f"Product with code {code} not found.")
-                    return jsonify({'error': f'Product with code {code} not found.'}), 404
-                item_total = _calculate_item_total(product.unit_price, product.special_price, quantity)
-                if item_total == -1:
-                    return jsonify({'error': f'Error calculating total for item {code}.'}), 400
-                total += item_total
-            return jsonify({'subtotal': total})
+            if metrics and isinstance(items, list):
+                metrics.observe_cart(len(items))
+            # Resolve every distinct code up front instead of querying once per cart line
+            codes = cart_codes(items)
+            as_of = _as_of_version()
+            products, offers, quantity_tables = _load_pricing(codes, as_of)
+            # Carts that an offer applies to are solved by the offer engine; the rest may be vectorized
+            engine = None if as_of is not None or offers.applies_to(codes) else _vector_engine(len(items))
+            if engine and engine.fits([items]):
+                subtotal = engine.price_cart(items, codes)
+            else:
+                subtotal = price_cart(items, codes, products, offers, quantity_tables)
+            return jsonify({'subtotal': subtotal} if as_of is None else {'subtotal': subtotal, 'version': as_of})
+        except CartError as e:
+            if e.missing_codes:
+                current_app.logger.error("Products with codes %s not found.", e.missing_codes)
+            return jsonify(e.to_dict()), e.status
         except Exception as e:
             current_app.logger.error(f"Error calculating subtotal: {str(e)}")
             return jsonify({'error': 'Internal server error. Please try again later.'}), 500
 
-    def _calculate_item_total(unit_price, special_price, quantity):
+    @app.route('/api/subtotal/batch', methods=['POST'])
+    @reads_from_replica
+    def calculate_subtotal_batch():
         try:
-            if special_price:
-                match = re.match(r'(\d+) for (\d+)', special_price)
-                if match:
-                    count = int(match.group(1))
-                    special_price_value = int(match.group(2))
-                    total_special = (quantity // count) * special_price_value
-                    total_regular = (quantity % count) * unit_price
-                    return total_special + total_regular
-            return unit_price * quantity
+            carts = request.json
+            if not isinstance(carts, dict):
+                return jsonify({'error': 'Invalid input format. Expected an object mapping cart ids to lists of items.'}), 400
+            if len(carts) > app.config['SUBTOTAL_BATCH_MAX_CARTS']:
+                return jsonify({'error': f"Too many carts. At most {app.config['SUBTOTAL_BATCH_MAX_CARTS']} per batch."}), 400
+            try:
+                as_of = _as_of_version()
+            except CartError as e:
+                return jsonify(e.to_dict()), e.status
+            subtotals = {}
+            errors = {}
+            cart_codes_by_id = {}
+            for cart_id, items in carts.items():
+                if metrics and isinstance(items, list):
+                    metrics.observe_cart(len(items))
+                try:
+                    cart_codes_by_id[cart_id] = cart_codes(items)
+                except CartError as e:
+                    errors[cart_id] = e.to_dict()
+            # One lookup for the union of codes; every cart is priced against the same products
+            all_codes = list(dict.fromkeys(code for codes in cart_codes_by_id.values() for code in codes))
+            products, offers, quantity_tables = _load_pricing(all_codes, as_of)
+            plain_carts = {cart_id: codes for cart_id, codes in cart_codes_by_id.items() if not offers.applies_to(codes)}
+            engine = _vector_engine(sum(len(carts[cart_id]) for cart_id in plain_carts)) if as_of is None else None
+            if engine and not engine.fits(carts[cart_id] for cart_id in plain_carts):
+                engine = None
+            if engine:
+                subtotals, vector_errors = engine.price_carts(
+                    {cart_id: (carts[cart_id], codes) for cart_id, codes in plain_carts.items()}
+                )
+                errors.update(vector_errors)
+            for cart_id, codes in cart_codes_by_id.items():
+                if engine and cart_id in plain_carts:
+                    continue
+                try:
+                    subtotals[cart_id] = price_cart(carts[cart_id], codes, products, offers, quantity_tables)
+                except CartError as e:
+                    errors[cart_id] = e.to_dict()
+            body = {'subtotals': subtotals, 'errors': errors}
+            if as_of is not None:
+                body['version'] = as_of
+            return jsonify(body)
         except Exception as e:
-            current_app.logger.error(f"Error calculating item total: {str(e)}")
-            return -1
+            current_app.logger.error(f"Error calculating batch subtotal: {str(e)}")
+            return jsonify({'error': 'Internal server error. Please try again later.'}), 500
+
+    @app.route('/api/quote', methods=['POST'])
+    @reads_from_replica
+    def get_quote():
+        try:
+            items = request.json
+            codes = cart_codes(items)
+            lines = normalize_cart(items)
+            snapshot = _snapshot() if app.config['PRICING_CACHE_ENABLED'] else None
+            version = snapshot.version if snapshot else PricingVersion.current()
+            key = quote_key(lines, version)
+            quote = quote_cache.get(key)
+            if quote is not None:
+                return jsonify(dict(quote, cached=True))
+            # Merged like every other pricing path (pricing.merge_lines), so a quote equals the uncached subtotal
+            merged_items = [{'code': code, 'quantity': quantity} for code, quantity in lines]
+            if snapshot:
+                products, offers, quantity_tables = snapshot.products, snapshot.offers, snapshot.quantity_tables
+            else:
+                products, offers, quantity_tables = _load_pricing(codes)
+            quote = {'subtotal': price_cart(merged_items, codes, products, offers, quantity_tables), 'version': version}
+            # Without a snapshot the version and the prices are separate reads; a write between them
+            # could have priced the cart at a newer version, which must not be cached under this one
+            if snapshot or PricingVersion.current() == version:
+                quote_cache.set(key, quote)
+            return jsonify(dict(quote, cached=False))
+        except CartError as e:
+            return jsonify(e.to_dict()), e.status
+        except Exception as e:
+            current_app.logger.error(f"Error calculating quote: {str(e)}")
+            return jsonify({'error': 'Internal server error. Please try again later.'}), 500
+
+    @app.route('/api/quote/cache', methods=['GET'])
+    def get_quote_cache_stats():
+        return jsonify(quote_cache.stats())
+
+    @app.route('/api/carts', methods=['POST'])
+    def create_cart():
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Invalid input format. Expected an object with optional cart_id and items.'}), 400
+        cart_id = data.get('cart_id') or new_cart_id()
+        if not isinstance(cart_id, str) or len(cart_id) > 32:
+            return jsonify({'error': 'cart_id must be a string of at most 32 characters.'}), 400
+        items = data.get('items', [])
+        try:
+            cart_codes(items)
+        except CartError as e:
+            return jsonify(e.to_dict()), e.status
+        with cart_store.lock_for(cart_id):
+            if cart_store.get(cart_id) or (app.config['CART_PERSISTENCE_ENABLED'] and persisted_revision(cart_id) is not None):
+                return jsonify({'error': f'Cart {cart_id} already exists.'}), 409
+            cart = Cart(cart_id, version=None)
+            for item in items:
+                code = item['code']
+                response = _apply_cart_line(cart, code, cart.quantities.get(code, 0) + item['quantity'])
+                if response:
+                    return response
+            _save_cart(cart)
+        return jsonify(cart.to_dict()), 201
+
+    @app.route('/api/carts/<cart_id>', methods=['GET'])
+    def get_cart(cart_id):
+        with cart_store.lock_for(cart_id):
+            cart = _open_cart(cart_id)
+            if cart is None:
+                return jsonify({'error': f'Cart {cart_id} not found.'}), 404
+            removed_codes = _refresh_cart(cart, [])[2]
+            if removed_codes:
+                _save_cart(cart)
+        return jsonify(_cart_body(cart, removed_codes))
+
+    @app.route('/api/carts/<cart_id>', methods=['DELETE'])
+    def delete_cart(cart_id):
+        with cart_store.lock_for(cart_id):
+            found = cart_store.delete(cart_id)
+            if app.config['CART_PERSISTENCE_ENABLED']:
+                found = persisted_revision(cart_id) is not None
+                delete_persisted(cart_id)
+        if not found:
+            return jsonify({'error': f'Cart {cart_id} not found.'}), 404
+        return jsonify({'message': f'Cart {cart_id} deleted successfully'}), 200
+
+    @app.route('/api/carts/<cart_id>/items', methods=['POST'])
+    def add_cart_item(cart_id):
+        item = request.json
+        try:
+            cart_codes([item])
+        except CartError as e:
+            return jsonify(e.to_dict()), e.status
+        return _update_cart(cart_id, item['code'], lambda current: current + item['quantity'])
+
+    @app.route('/api/carts/<cart_id>/items/<code>', methods=['PUT'])
+    def set_cart_item(cart_id, code):
+        data = request.json
+        quantity = data.get('quantity') if isinstance(data, dict) else None
+        if not isinstance(quantity, int) or quantity < 0:
+            return jsonify({'error': f'Invalid quantity for item: {data}'}), 400
+        return _update_cart(cart_id, code, lambda current: quantity)
+
+    @app.route('/api/carts/<cart_id>/items/<code>', methods=['DELETE'])
+    def remove_cart_item(cart_id, code):
+        return _update_cart(cart_id, code, lambda current: 0)
+
+    def _update_cart(cart_id, code, new_quantity):
+        with cart_store.lock_for(cart_id):
+            cart = _open_cart(cart_id)
+            if cart is None:
+                return jsonify({'error': f'Cart {cart_id} not found.'}), 404
+            removed_codes = []
+            response = _apply_cart_line(cart, code, new_quantity(cart.quantities.get(code, 0)), removed_codes)
+            if response:
+                return response
+            if not _save_cart(cart):
+                return jsonify({'error': f'Cart {cart_id} was modified concurrently. Please retry.'}), 409
+        return jsonify(_cart_body(cart, removed_codes))
+
+    def _apply_cart_line(cart, code, quantity, removed_codes=None):
+        # O(1) per update: only the touched line is priced unless the pricing version moved
+        products, offers, removed = _refresh_cart(cart, [code])
+        if removed_codes is not None:
+            removed_codes.extend(removed)
+        if quantity > 0 and code not in products:
+            return jsonify({'error': f'Products with codes {code} not found.', 'missing_codes': [code]}), 404
+        cart.set_quantity(code, quantity, products.get(code), offers)
+        return None
+
+    def _refresh_cart(cart, codes):
+        if app.config['PRICING_CACHE_ENABLED']:
+            snapshot = _snapshot()
+            products, offers, version = snapshot.products, snapshot.offers, snapshot.version
+        else:
+            version = PricingVersion.current()
+            offer_rows = Offer.query.all()
+            # Bundles are solved over the whole cart, so they need every line's product, like a re-price
+            whole_cart = cart.version != version or any(row.kind == 'bundle' for row in offer_rows)
+            products = _load_products(list(dict.fromkeys(codes + list(cart.quantities))) if whole_cart else codes)
+            offers = OfferEngine(offer_rows, products)
+        removed_codes = cart.reprice(products, version, offers) if cart.version != version else []
+        return products, offers, removed_codes
+
+    def _open_cart(cart_id):
+        cart = cart_store.get(cart_id)
+        if not app.config['CART_PERSISTENCE_ENABLED']:
+            return cart
+        # The database copy is authoritative; reload when another worker has changed it
+        revision = persisted_revision(cart_id)
+        if revision is None:
+            if cart is not None:
+                cart_store.delete(cart_id)
+            return None
+        if cart is None or cart.revision != revision:
+            revision, quantities = load_persisted(cart_id)
+            cart = Cart(cart_id, version=None, revision=revision)
+            cart.quantities = quantities
+            cart_store.put(cart)
+        return cart
+
+    def _save_cart(cart):
+        cart_store.put(cart)
+        if app.config['CART_PERSISTENCE_ENABLED'] and not save_persisted(cart):
+            cart_store.delete(cart.cart_id)
+            return False
+        return True
+
+    def _cart_body(cart, removed_codes):
+        body = cart.to_dict()
+        if removed_codes:
+            body['removed_codes'] = removed_codes
+        return body
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        if metrics is None:
+            return jsonify({"error": "Metrics are disabled."}), 404
+        stats = pricing_cache.stats()
+        samples = [
+            (f'pricing_cache_{name}_total', 'counter', f'Pricing cache {name} in this worker.', stats[name])
+            for name in ('hits', 'misses', 'reloads', 'revalidations')
+        ]
+        samples.append(('pricing_cache_products', 'gauge', 'Products in the cached pricing snapshot.', stats['products']))
+        samples.append(('pricing_cache_bytes', 'gauge', 'Size of the packed pricing snapshot.', stats['bytes']))
+        quote_stats = quote_cache.stats()
+        samples.extend(
+            (f'quote_cache_{name}_total', 'counter', f'Quote cache {name.replace("_", " ")} in this worker.', quote_stats[name])
+            for name in ('hits', 'shared_hits', 'misses', 'evictions', 'expirations')
+        )
+        samples.extend(
+            (f'quote_cache_{name}', 'gauge', f'Quote cache {name} held by this worker.', quote_stats[name])
+            for name in ('entries', 'bytes')
+        )
+        cart_stats = cart_store.stats()
+        samples.append(('cart_sessions', 'gauge', 'Cart sessions held by this worker.', cart_stats['carts']))
+        samples.append(('cart_session_evictions_total', 'counter', 'Idle cart sessions evicted by this worker.', cart_stats['evictions']))
+        patch_stats = patch_coalescer.stats()
+        samples.append(('pricing_patch_batches_total', 'counter', 'Transactions that applied product PATCHes.', patch_stats['batches']))
+        samples.append(('pricing_patch_writes_total', 'counter', 'Product PATCHes applied, coalesced into those transactions.', patch_stats['writes']))
+        if replica_pool is not None:
+            replica_stats = replica_pool.stats()
+            samples.append(('read_replica_primary_reads_total', 'counter', 'Read-only requests sent to the primary because no replica was usable.', replica_stats['primary_reads']))
+            samples.append(('read_replica_reads_total', 'counter', 'Read-only requests sent to a replica.', sum(r['reads'] for r in replica_stats['replicas'].values())))
+            samples.append(('read_replicas_healthy', 'gauge', 'Replicas this worker is sending reads to.', sum(r['healthy'] for r in replica_stats['replicas'].values())))
+        return app.response_class(metrics.render(samples), mimetype='text/plain; version=0.0.4')
+
+    def _commit_pricing_change(changes=(), version=None):
+        # Every pricing write bumps the shared version so other workers reload their snapshot,
+        # and appends what it changed to the pricing change log at that version
+        if version is None:
+            version = PricingVersion.bump()
+        record_changes(version, changes)
+        db.session.commit()
+        pricing_cache.invalidate()
+        g.pricing_version = version
+
+    def _apply_product_patches(patches):
+        # One transaction and one version bump per coalesced batch; the version is taken first,
+        # so every pricing writer locks pricing_version before any product rows
+        version = PricingVersion.bump()
+        results = Product.patch_many(patches, version)
+        changed = {row['code']: row for status, row in results if status == 200}
+        if changed:
+            _commit_pricing_change(
+                [product_change(code, row['unit_price'], row['special_price']) for code, row in changed.items()], version=version
+            )
+        else:
+            db.session.rollback()
+        return results
+
+    def _if_match_versions(resource):
+        # Versions named by "<resource>-<version>" ETags in If-Match; None when there is no precondition
+        if not request.if_match or request.if_match.star_tag:
+            return None
+        versions = set()
+        for tag in request.if_match.as_set():
+            name, _, version = tag.rpartition('-')
+            if name == resource and version.isdigit():
+                versions.add(int(version))
+        return versions
+
+    def _table_precondition_failed(version):
+        # If-Match on whole-table writes names the version of GET /api/pricing the client read;
+        # `version` was just bumped, so the table is unchanged since then if it is one more
+        expected = _if_match_versions('pricing')
+        if expected is None or version - 1 in expected:
+            return None
+        db.session.rollback()
+        return jsonify({"error": "Pricing table was modified since it was read."}), 412, {'ETag': f'"pricing-{version - 1}"'}
+
+    def _query_page(after, limit, changed_since=None):
+        query = Product.query.order_by(Product.code)
+        if after is not None:
+            query = query.filter(Product.code > after)
+        if changed_since is not None:
+            query = query.filter(Product.version > changed_since)
+        if limit is None:
+            return query.all(), False
+        rows = query.limit(limit + 1).all()
+        return rows[:limit], len(rows) > limit
+
+    def _stream_products(after, changed_since=None):
+        # yield_per streams through a server-side cursor instead of loading every row
+        stmt = db.select(Product).order_by(Product.code)
+        if after is not None:
+            stmt = stmt.where(Product.code > after)
+        if changed_since is not None:
+            stmt = stmt.where(Product.version > changed_since)
+        stmt = stmt.execution_options(yield_per=app.config['PRICING_STREAM_BATCH_SIZE'])
+        return db.session.execute(stmt).scalars()
+
+    def _json_array_chunks(products):
+        batch_size = app.config['PRICING_STREAM_BATCH_SIZE']
+        yield '['
+        batch = []
+        separator = ''
+        for product in products:
+            batch.append(product.to_dict())
+            if len(batch) >= batch_size:
+                yield separator + app.json.dumps(batch)[1:-1]
+                separator = ','
+                batch = []
+        if batch:
+            yield separator + app.json.dumps(batch)[1:-1]
+        yield ']'
+
+    def _snapshot():
+        # Read-your-writes: a snapshot older than the client's Min-Pricing-Version is revalidated first
+        return pricing_cache.snapshot(g.get('min_pricing_version'))
+
+    def _vector_engine(line_count):
+        # Large carts and batches are priced with numpy when it is installed; the scalar path stays the reference
+        if (not app.config['PRICING_CACHE_ENABLED'] or line_count < app.config['PRICING_VECTOR_MIN_LINES']
+                or not pricing_vector.available()):
+            return None
+        return pricing_vector.VectorPricing.for_snapshot(_snapshot())
+
+    def _as_of_version():
+        # ?as_of=<version> prices against the change log instead of the current table
+        if 'as_of' not in request.args:
+            return None
+        as_of = request.args.get('as_of', type=int)
+        if as_of is None or as_of < 0:
+            raise CartError('as_of must be a non-negative pricing version.')
+        if as_of > PricingVersion.current():
+            raise CartError(f'Pricing version {as_of} does not exist yet.', 404)
+        oldest = first_version()
+        if oldest is None:
+            raise CartError('No pricing history has been recorded yet.', 410)
+        if as_of < oldest:
+            raise CartError(f'Pricing history before version {oldest} is not available.', 410)
+        return as_of
+
+    def _load_pricing(codes, as_of=None):
+        # Products, offers and quantity tables from one snapshot, or looked up for `codes` without the cache
+        if as_of is not None:
+            products, offers = pricing_as_of(as_of, codes, chunk_size=app.config['PRODUCT_LOOKUP_CHUNK_SIZE'])
+            return products, offers, None
+        if app.config['PRICING_CACHE_ENABLED']:
+            snapshot = _snapshot()
+            return snapshot.products, snapshot.offers, snapshot.quantity_tables
+        products = _load_products(codes)
+        return products, OfferEngine(Offer.query.all(), products), None
+
+    def _load_products(codes):
+        if app.config['PRICING_CACHE_ENABLED']:
+            return _snapshot().products
+        # One IN (...) query per chunk keeps us under the bound-parameter limits of SQLite/Postgres
+        chunk_size = current_app.config['PRODUCT_LOOKUP_CHUNK_SIZE']
+        products = {}
+        for start in range(0, len(codes), chunk_size):
+            chunk = codes[start:start + chunk_size]
+            for product in Product.query.filter(Product.code.in_(chunk)).all():
+                products[product.code] = product_price(product)
+        return products
+
+    if app.config['PRICING_PRELOAD'] and app.config['PRICING_CACHE_ENABLED']:
+        _preload_pricing(app, pricing_cache)
 
     return app
 
 
+class _MigrateCommands(click.Group):
+    """`flask db` group that imports Flask-Migrate on first use instead of at app start."""
+
+    def __init__(self, app):
+        super().__init__('db', help='Perform database migrations.')
+        self._app = app
+
+    def _commands(self):
+        from flask_migrate import Migrate
+        from flask_migrate.cli import db as db_cli_group
+        if 'migrate' not in self._app.extensions:
+            Migrate(self._app, db)
+        return db_cli_group
+
+    def list_commands(self, ctx):
+        return self._commands().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._commands().get_command(ctx, name)
+
+
+def _preload_pricing(app, pricing_cache):
+    with app.app_context():
+        try:
+            snapshot = pricing_cache.snapshot()
+        except SQLAlchemyError as e:
+            # e.g. before the first migration; workers load the snapshot on their first request instead
+            app.logger.warning("Pricing snapshot not preloaded: %s", e)
+            return
+        finally:
+            db.session.remove()
+        if pricing_vector.available():
+            pricing_vector.VectorPricing.for_snapshot(snapshot)
+        # Pooled connections must not be inherited by forked gunicorn workers (an
+        # in-memory SQLite database lives in its single connection, so keep that one)
+        for engine in db.engines.values():
+            if not isinstance(engine.pool, StaticPool):
+                engine.dispose()
+    app.logger.info("Preloaded pricing snapshot version %s (%d products)", snapshot.version, len(snapshot.products))
+
+
+def _engine_options(config):
+    uri = config.get('SQLALCHEMY_DATABASE_URI') or ''
+    if uri.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING']
+    }
+
+
 if __name__ == '__main__':
     app = create_app()
     app.run(debug=True, host="0.0.0.0")
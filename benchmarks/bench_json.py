@@ -0,0 +1,68 @@
+"""Parse + validate cost of 10k-row request bodies, and response encoding, with the stdlib and orjson (no HTTP or database).
+
+    python benchmarks/bench_json.py
+    python benchmarks/bench_json.py --rows 100000
+
+Cart bodies go through cart_codes and pricing uploads through validate_row,
+as in POST /api/subtotal and PUT /api/pricing. The encode rows time a
+GET /api/pricing sized response through each Flask JSON provider.
+"""
+import argparse
+import json
+import random
+
+from common import timed
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import json_codec
+from pricing import cart_codes
+from pricing_import import read_json, validate_row
+
+
+def cart_body(rows, rng):
+    return json.dumps([{'code': f'P{rng.randrange(rows)}', 'quantity': rng.randint(1, 20)} for _ in range(rows)]).encode()
+
+
+def pricing_body(rows, rng):
+    return json.dumps([
+        {'code': f'P{i}', 'unit_price': rng.randint(10, 500), 'special_price': f'3 for {rng.randint(20, 1000)}' if i % 3 == 0 else None}
+        for i in range(rows)
+    ]).encode()
+
+
+def validate_pricing(products):
+    return [validate_row(line_number, product_data) for line_number, product_data in read_json(products)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    if not json_codec.available():
+        parser.exit(1, 'orjson is not installed\n')
+
+    rng = random.Random(42)
+    median = args.repeat // 2
+    print(f"{'payload':<10} {'decoder':<8} {'decode ms':>10} {'validate ms':>12} {'total ms':>9}")
+    for name, body, validate in [('cart', cart_body(args.rows, rng), cart_codes),
+                                 ('pricing', pricing_body(args.rows, rng), validate_pricing)]:
+        for decoder, loads in [('stdlib', json.loads), ('orjson', json_codec.loads)]:
+            decode = timed(lambda: loads(body), args.repeat)[median]
+            data = loads(body)
+            check = timed(lambda: validate(data), args.repeat)[median]
+            print(f"{name:<10} {decoder:<8} {decode * 1000:>10.2f} {check * 1000:>12.2f} {(decode + check) * 1000:>9.2f}")
+
+    products = validate_pricing(json.loads(pricing_body(args.rows, rng)))
+    print(f"\n{'provider':<10} {'encode ms':>10}")
+    for name, provider in [('stdlib', DefaultJSONProvider), ('orjson', json_codec.OrjsonProvider)]:
+        app = Flask(__name__)
+        app.json = provider(app)
+        with app.app_context():
+            encode = timed(lambda: app.json.response(products), args.repeat)[median]
+        print(f"{name:<10} {encode * 1000:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Offer engine against the per-line special-price path on carts of 1k to 100k lines (no HTTP or database).
+
+    python benchmarks/bench_offers.py
+    python benchmarks/bench_offers.py --offer-share 0.5 --bundles 500
+
+Every third product gets multi-buy or buy-X-get-Y tiers and `--bundles` random
+pairs of products are sold together. The "huge qty" column prices the same
+lines with quantities around a million, which tier tables answer in constant time.
+"""
+import argparse
+import json
+import random
+import time
+
+from common import timed
+from bench_vector import make_snapshot
+from offers import OfferRow
+from pricing import PricingSnapshot, cart_codes, price_cart
+
+LINE_COUNTS = [1000, 10000, 100000]
+
+
+def make_offers(snapshot, share, bundles, rng):
+    products = list(snapshot.products.values())
+    rows = []
+    for product in rng.sample(products, int(len(products) * share)):
+        if rng.random() < 0.5:
+            rows.append(OfferRow(len(rows) + 1, 'multi_buy', product.code, 5, None, product.unit_price * 4, None))
+            rows.append(OfferRow(len(rows) + 1, 'multi_buy', product.code, 12, None, product.unit_price * 9, None))
+        else:
+            rows.append(OfferRow(len(rows) + 1, 'buy_get', product.code, 2, 1, None, None))
+    for _ in range(bundles):
+        first, second = rng.sample(products, 2)
+        price = (first.unit_price + second.unit_price) * 4 // 5
+        rows.append(OfferRow(len(rows) + 1, 'bundle', None, None, None, price, json.dumps({first.code: 1, second.code: 1})))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--catalogue-size', type=int, default=10000)
+    parser.add_argument('--offer-share', type=float, default=1 / 3, help='Share of products with tier offers.')
+    parser.add_argument('--bundles', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sizes', type=int, nargs='+', default=LINE_COUNTS)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    plain = make_snapshot(args.catalogue_size, rng)
+    start = time.perf_counter()
+    snapshot = PricingSnapshot(1, plain.products, make_offers(plain, args.offer_share, args.bundles, rng))
+    print(f'compiled {len(snapshot.offers.rows)} offers in {(time.perf_counter() - start) * 1000:.1f} ms\n')
+
+    print(f"{'lines':>8} {'per-line ms':>12} {'offers ms':>10} {'huge qty ms':>12} {'bundles used':>13}")
+    for size in args.sizes:
+        items = [{'code': f'P{rng.randrange(args.catalogue_size)}', 'quantity': rng.randint(1, 20)} for _ in range(size)]
+        huge = [dict(item, quantity=item['quantity'] * 100003) for item in items]
+        codes = cart_codes(items)
+        legacy = timed(lambda: price_cart(items, codes, snapshot.products), args.repeat)[args.repeat // 2]
+        offers = timed(lambda: price_cart(items, codes, snapshot.products, snapshot.offers), args.repeat)[args.repeat // 2]
+        huge_time = timed(lambda: price_cart(huge, codes, snapshot.products, snapshot.offers), args.repeat)[args.repeat // 2]
+        quantities = {}
+        for item in items:
+            quantities[item['code']] = quantities.get(item['code'], 0) + item['quantity']
+        used = len(snapshot.offers.bundle_discount(quantities)[1])
+        print(f"{size:>8} {legacy * 1000:>12.2f} {offers * 1000:>10.2f} {huge_time * 1000:>12.2f} {used:>13}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Per-line pricing with and without quantity tables on hot-SKU carts (no HTTP or database).
+
+    python benchmarks/bench_quantity_tables.py
+    python benchmarks/bench_quantity_tables.py --hot-products 2000 --table-size 32
+
+Carts draw from `--hot-products` best sellers at small quantities, like most
+basket traffic. The last line is the cost of moving the tables to a new
+snapshot in which one product's price changed.
+"""
+import argparse
+import random
+import time
+
+from common import timed
+from bench_vector import make_snapshot
+from pricing import PricingSnapshot, QuantityTables, cart_codes, price_cart
+
+CART_SIZES = [10, 100, 1000]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--catalogue-size', type=int, default=100000)
+    parser.add_argument('--hot-products', type=int, default=500)
+    parser.add_argument('--table-size', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--sizes', type=int, nargs='+', default=CART_SIZES)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    snapshot = make_snapshot(args.catalogue_size, rng)
+    hot = [f'P{i}' for i in rng.sample(range(args.catalogue_size), args.hot_products)]
+    tables = QuantityTables(args.table_size, args.hot_products)
+
+    print(f"{'lines':>8} {'no tables us':>13} {'tables us':>10} {'speedup':>8}")
+    for size in args.sizes:
+        items = [{'code': rng.choice(hot), 'quantity': rng.randint(1, 5)} for _ in range(size)]
+        codes = cart_codes(items)
+        assert price_cart(items, codes, snapshot.products) == price_cart(items, codes, snapshot.products, None, tables)
+        plain = timed(lambda: price_cart(items, codes, snapshot.products), args.repeat)[args.repeat // 2]
+        tabled = timed(lambda: price_cart(items, codes, snapshot.products, None, tables), args.repeat)[args.repeat // 2]
+        print(f"{size:>8} {plain * 1e6:>13.1f} {tabled * 1e6:>10.1f} {plain / tabled:>7.1f}x")
+
+    changed = next(iter(tables.products))
+    products = [product._replace(unit_price=product.unit_price + 1) if product.code == changed else product
+                for product in snapshot.products.values()]
+    reloaded = PricingSnapshot(2, products)
+    start = time.perf_counter()
+    carried = tables.carry_over(reloaded.products)
+    print(f'\nreload: {len(tables.tables)} tables carried over, {carried.builds - tables.builds} rebuilt, '
+          f'in {(time.perf_counter() - start) * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
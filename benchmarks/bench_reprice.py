@@ -0,0 +1,52 @@
+"""Throughput of the offline re-pricing job by worker count (in process, no database).
+
+    python benchmarks/bench_reprice.py --orders 200000
+"""
+import argparse
+import io
+import json
+import os
+import random
+import time
+
+import common  # noqa: F401  (puts the repo root on sys.path)
+from bench_vector import make_snapshot
+from reprice_job import read_orders, reprice_orders
+
+
+def make_orders(count, catalogue_size, lines, rng):
+    buffer = io.BytesIO()
+    for order_id in range(count):
+        items = [{'code': f'P{rng.randrange(catalogue_size)}', 'quantity': rng.randint(1, 20)} for _ in range(lines)]
+        buffer.write(json.dumps({'order_id': order_id, 'items': items}).encode() + b'\n')
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--lines', type=int, default=10, help='Lines per order.')
+    parser.add_argument('--catalogue-size', type=int, default=10000)
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    snapshot = make_snapshot(args.catalogue_size, rng)
+    data = make_orders(args.orders, args.catalogue_size, args.lines, rng)
+
+    print(f"{'workers':>8} {'seconds':>8} {'orders/s':>10} {'speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        output = io.StringIO()
+        start = time.perf_counter()
+        counts = reprice_orders(snapshot, read_orders(io.BytesIO(data), 'ndjson'), output, workers, args.chunk_size)
+        elapsed = time.perf_counter() - start
+        assert counts == {'orders': args.orders, 'errors': 0}
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>8.2f} {args.orders / elapsed:>10.0f} {baseline / elapsed:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
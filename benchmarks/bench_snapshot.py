@@ -0,0 +1,61 @@
+"""Memory, load time and lookup cost of the packed pricing snapshot against a plain dict (no database).
+
+    python benchmarks/bench_snapshot.py --sizes 100000 1000000
+"""
+import argparse
+import gc
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from common import timed
+from bench_vector import make_snapshot
+from pricing import PackedProducts, ProductPrice
+
+SIZES = [10000, 100000, 1000000]
+
+
+def allocated(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    print(f"{'products':>9} {'dict B/SKU':>11} {'packed B/SKU':>13} {'build s':>8} {'mmap ms':>8} "
+          f"{'dict ns':>8} {'packed ns':>10}")
+    for size in args.sizes:
+        products = list(make_snapshot(size, rng).products.values())
+        # What the snapshot held before: one dict entry and one ProductPrice per SKU (with its own strings)
+        as_dict, dict_bytes = allocated(lambda: {p.code: ProductPrice(p.code.encode().decode(), p.unit_price, p.special_price, p.offer)
+                                                 for p in products})
+        start = time.perf_counter()
+        packed, packed_bytes = allocated(lambda: PackedProducts.build(1, products))
+        build = time.perf_counter() - start
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'pricing.snapshot')
+            packed.save(path)
+            open_time = timed(lambda: PackedProducts.open(path), args.repeat)[args.repeat // 2]
+
+        codes = [products[rng.randrange(size)].code for _ in range(args.lookups)]
+        dict_time = timed(lambda: [as_dict[code] for code in codes], args.repeat)[args.repeat // 2]
+        packed_time = timed(lambda: [packed[code] for code in codes], args.repeat)[args.repeat // 2]
+        print(f"{size:>9} {dict_bytes / size:>11.0f} {packed_bytes / size:>13.0f} {build:>8.2f} "
+              f"{open_time * 1000:>8.2f} {dict_time / args.lookups * 1e9:>8.0f} {packed_time / args.lookups * 1e9:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Scalar vs numpy pricing engine on carts of 1k to 1M lines (in process, no HTTP or database).
+
+    python benchmarks/bench_vector.py
+"""
+import argparse
+import random
+
+from common import timed
+from pricing import OfferRule, PricingSnapshot, ProductPrice, cart_codes, price_cart
+import pricing_vector
+
+LINE_COUNTS = [1000, 10000, 100000, 1000000]
+
+
+def make_snapshot(size, rng):
+    products = []
+    for i in range(size):
+        unit_price = rng.randint(10, 100)
+        offer = OfferRule(3, unit_price * 3 - 5) if i % 3 == 0 else None
+        products.append(ProductPrice(f'P{i}', unit_price, None, offer))
+    return PricingSnapshot(1, products)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--catalogue-size', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sizes', type=int, nargs='+', default=LINE_COUNTS)
+    args = parser.parse_args()
+    if not pricing_vector.available():
+        parser.exit(1, 'numpy is not installed\n')
+
+    rng = random.Random(42)
+    snapshot = make_snapshot(args.catalogue_size, rng)
+    vector = pricing_vector.VectorPricing.for_snapshot(snapshot)
+
+    print(f"{'lines':>8} {'scalar ms':>10} {'numpy ms':>10} {'speedup':>8} {'arith-only ms':>14}")
+    for size in args.sizes:
+        items = [{'code': f'P{rng.randrange(args.catalogue_size)}', 'quantity': rng.randint(1, 20)} for _ in range(size)]
+        codes = cart_codes(items)
+        assert vector.price_cart(items, codes) == price_cart(items, codes, snapshot.products)
+        scalar = timed(lambda: price_cart(items, codes, snapshot.products), args.repeat)[args.repeat // 2]
+        numpy_ = timed(lambda: vector.price_cart(items, codes), args.repeat)[args.repeat // 2]
+        # Cost of the arithmetic alone once the cart is already in array form
+        product_ids, quantities = vector._line_arrays([items], vector.product_ids(codes))
+        arith = timed(lambda: vector.line_totals(product_ids, quantities).sum(), args.repeat)[args.repeat // 2]
+        print(f"{size:>8} {scalar * 1000:>10.2f} {numpy_ * 1000:>10.2f} {scalar / numpy_:>7.1f}x {arith * 1000:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# add the root directory to the sys.path
+sys.path.append(ROOT)
+
+from sqlalchemy import event
+from app import create_app
+from config import Config
+from model import db, PricingChange, Product
+
+
+def make_app(database_url=None, **overrides):
+    # Default to a throwaway SQLite file so runs never touch a real database
+    if database_url is None:
+        fd, path = tempfile.mkstemp(suffix='.db', prefix='bench-')
+        os.close(fd)
+        database_url = f'sqlite:///{path}'
+    settings = {'SQLALCHEMY_DATABASE_URI': database_url, 'TESTING': True}
+    settings.update(overrides)
+    app = create_app(type('BenchConfig', (Config,), settings))
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app
+
+
+def seed_catalogue(app, size):
+    # Every third product carries an "N for M" offer
+    rows = []
+    for i in range(size):
+        unit_price = 10 + i % 90
+        special_price = f'3 for {unit_price * 3 - 5}' if i % 3 == 0 else None
+        rows.append({'code': f'P{i}', 'unit_price': unit_price, 'special_price': special_price})
+    with app.app_context():
+        db.session.execute(Product.__table__.delete())
+        db.session.execute(Product.__table__.insert(), [
+            dict(row, offer_qty=3 if row['special_price'] else None,
+                 offer_price=row['unit_price'] * 3 - 5 if row['special_price'] else None)
+            for row in rows
+        ])
+        # Start the change log at version 0, as the pricing_changes migration does for existing tables
+        db.session.execute(PricingChange.__table__.delete())
+        db.session.execute(PricingChange.__table__.insert(), [dict(row, version=0, op='upsert') for row in rows])
+        db.session.commit()
+    return [row['code'] for row in rows]
+
+
+def make_cart(codes, lines):
+    return [{'code': codes[i % len(codes)], 'quantity': 1 + i % 7} for i in range(lines)]
+
+
+@contextmanager
+def count_queries(app):
+    # Counts statements issued on the app's engine while the block runs
+    counter = {'queries': 0}
+
+    def before_cursor_execute(*args):
+        counter['queries'] += 1
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(database_url, worker_class, workers, threads, port, extra_env=None):
+    env = dict(os.environ, SQLALCHEMY_DATABASE_URI=database_url, **(extra_env or {}))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:create_app()', '--bind', f'127.0.0.1:{port}',
+         '--worker-class', worker_class, '--workers', str(workers), '--threads', str(threads),
+         '--log-level', 'warning'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/api/pricing/cache')
+            if connection.getresponse().status == 200:
+                return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError(f'gunicorn ({worker_class}) did not start on port {port}')
+
+
+def fill_path(path, before_response):
+    # Paths like /api/offers/{ids[0]} name a resource the `before` request created
+    return path.format(**json.loads(before_response)) if '{' in path else path
+
+
+def encode_body(body):
+    if body is None or isinstance(body, (bytes, str)):
+        return body
+    return json.dumps(body)
+
+
+def run_load(port, method, path, body, concurrency, duration, content_type='application/json', before=None):
+    # `before`, if given, is an untimed (method, path, body) request sent ahead of each timed one;
+    # its JSON response fills in `path` (see fill_path)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    payload = encode_body(body)
+    headers = {'Content-Type': content_type}
+    deadline = time.monotonic() + duration
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        samples = []
+        failures = 0
+        while time.monotonic() < deadline:
+            try:
+                target = path
+                if before is not None:
+                    connection.request(before[0], before[1], body=encode_body(before[2]),
+                                       headers={'Content-Type': 'application/json'})
+                    target = fill_path(path, connection.getresponse().read())
+                start = time.perf_counter()
+                connection.request(method, target, body=payload, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 400:
+                    failures += 1
+            except (OSError, http.client.HTTPException):
+                failures += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            samples.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(samples)
+            errors.append(failures)
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'rps': len(latencies) / duration,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000
+    }
+
+
+def percentile(samples, pct):
+    if not samples:
+        return float('nan')
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
@@ -0,0 +1,164 @@
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from model import db, CartSession
+from pricing import item_total
+
+
+class Cart:
+    """Cart session with per-line totals, so changing one line re-prices only that line."""
+
+    __slots__ = ('cart_id', 'quantities', 'line_totals', 'subtotal', 'bundle_discount', 'version', 'revision', 'last_access')
+
+    def __init__(self, cart_id, version, revision=0):
+        self.cart_id = cart_id
+        self.quantities = {}
+        self.line_totals = {}
+        self.subtotal = 0
+        # Saving from cross-product bundles; `subtotal` is the sum of line totals before it
+        self.bundle_discount = 0
+        self.version = version
+        self.revision = revision
+        self.last_access = time.monotonic()
+
+    def set_quantity(self, code, quantity, product=None, offers=None):
+        """Set one line; `product` is required unless quantity is 0 (remove).
+
+        With an OfferEngine, the line is priced by its tier table, and bundles are
+        re-solved only when the code is part of one.
+        """
+        self.subtotal -= self.line_totals.pop(code, 0)
+        self.quantities.pop(code, None)
+        if quantity > 0:
+            line_total = offers.line_total(product, quantity) if offers else item_total(product, quantity)
+            self.quantities[code] = quantity
+            self.line_totals[code] = line_total
+            self.subtotal += line_total
+        if offers and code in offers.bundles_by_code:
+            self.bundle_discount = offers.bundle_discount(self.quantities)[0]
+
+    def reprice(self, products, version, offers=None):
+        """Re-price every line after a pricing change; returns codes dropped because their product is gone."""
+        removed_codes = [code for code in self.quantities if code not in products]
+        quantities = {code: quantity for code, quantity in self.quantities.items() if code in products}
+        self.quantities = {}
+        self.line_totals = {}
+        self.subtotal = 0
+        for code, quantity in quantities.items():
+            self.set_quantity(code, quantity, products[code], offers)
+        self.bundle_discount = offers.bundle_discount(self.quantities)[0] if offers else 0
+        self.version = version
+        return removed_codes
+
+    def to_dict(self):
+        body = {
+            'cart_id': self.cart_id,
+            'items': [
+                {'code': code, 'quantity': quantity, 'total': self.line_totals[code]}
+                for code, quantity in self.quantities.items()
+            ],
+            'subtotal': self.subtotal - self.bundle_discount,
+            'version': self.version
+        }
+        if self.bundle_discount:
+            body['bundle_discount'] = self.bundle_discount
+        return body
+
+
+class CartStore:
+    """In-process cart sessions, evicted after `idle_timeout` seconds without access.
+
+    Carts are kept in least-recently-used order, so idle carts are always at the
+    front and eviction only ever inspects the oldest entries.
+    """
+
+    LOCK_STRIPES = 64
+
+    def __init__(self, idle_timeout=1800, max_carts=100000):
+        self.idle_timeout = idle_timeout
+        self.max_carts = max_carts
+        self._carts = OrderedDict()
+        self._lock = threading.Lock()
+        # Striped per-cart locks serialize updates to one cart without a lock object per cart
+        self._cart_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self.evictions = 0
+
+    def lock_for(self, cart_id):
+        return self._cart_locks[hash(cart_id) % self.LOCK_STRIPES]
+
+    def get(self, cart_id):
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            cart = self._carts.get(cart_id)
+            if cart is not None:
+                cart.last_access = now
+                self._carts.move_to_end(cart_id)
+            return cart
+
+    def put(self, cart):
+        now = time.monotonic()
+        with self._lock:
+            cart.last_access = now
+            self._carts[cart.cart_id] = cart
+            self._carts.move_to_end(cart.cart_id)
+            self._evict(now)
+
+    def delete(self, cart_id):
+        with self._lock:
+            return self._carts.pop(cart_id, None) is not None
+
+    def stats(self):
+        with self._lock:
+            return {'carts': len(self._carts), 'evictions': self.evictions}
+
+    def _evict(self, now):
+        while self._carts:
+            cart = next(iter(self._carts.values()))
+            if len(self._carts) <= self.max_carts and now - cart.last_access < self.idle_timeout:
+                break
+            self._carts.popitem(last=False)
+            self.evictions += 1
+
+
+def new_cart_id():
+    return uuid.uuid4().hex
+
+
+def persisted_revision(cart_id):
+    return db.session.execute(db.select(CartSession.revision).where(CartSession.cart_id == cart_id)).scalar()
+
+
+def load_persisted(cart_id):
+    """(revision, {code: quantity}) of a persisted cart, or None."""
+    row = db.session.get(CartSession, cart_id)
+    if row is None:
+        return None
+    return row.revision, json.loads(row.quantities)
+
+
+def save_persisted(cart):
+    """Write the cart back if nobody else changed it since we loaded it; returns False on conflict."""
+    quantities = json.dumps(cart.quantities, separators=(',', ':'))
+    if cart.revision == 0:
+        db.session.add(CartSession(cart_id=cart.cart_id, quantities=quantities, revision=1))
+    else:
+        result = db.session.execute(
+            db.update(CartSession)
+            .where(CartSession.cart_id == cart.cart_id, CartSession.revision == cart.revision)
+            .values(quantities=quantities, revision=CartSession.revision + 1, updated_at=db.func.now())
+        )
+        if result.rowcount == 0:
+            db.session.rollback()
+            return False
+    db.session.commit()
+    cart.revision += 1
+    return True
+
+
+def delete_persisted(cart_id):
+    db.session.execute(db.delete(CartSession).where(CartSession.cart_id == cart_id))
+    db.session.commit()
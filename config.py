@@ -1,10 +1,92 @@
 import os
-from dotenv import load_dotenv
 
-load_dotenv()  # This will load the .env file automatically
+# Settings are read from the environment when this module is imported. A .env file is
+# loaded by the entry points (`flask` CLI, `python app.py`, gunicorn.conf.py), not here.
 class Config:
     # General Flask Config
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    # Configure the root logger with logging.basicConfig; off in production, where only app.logger is set up
+    LOG_CONFIGURE_ROOT = os.getenv('LOG_CONFIGURE_ROOT', 'true').lower() == 'true'
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    # Decode request bodies and encode responses with orjson when it is installed
+    JSON_ORJSON_ENABLED = os.getenv('JSON_ORJSON_ENABLED', 'true').lower() == 'true'
 
     # Database configuration
     SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_DATABASE_URI')
+
+    # Read replicas for read-only routes (comma-separated URIs); writes always go to SQLALCHEMY_DATABASE_URI.
+    # Each replica's pricing version is read at most every REPLICA_CHECK_INTERVAL seconds, which is also
+    # its health check; a replica that fails it or drops a connection is skipped for REPLICA_RETRY_INTERVAL
+    SQLALCHEMY_REPLICA_URIS = [uri.strip() for uri in os.getenv('SQLALCHEMY_REPLICA_URIS', '').split(',') if uri.strip()]
+    REPLICA_CHECK_INTERVAL = float(os.getenv('REPLICA_CHECK_INTERVAL', 1.0))
+    REPLICA_RETRY_INTERVAL = float(os.getenv('REPLICA_RETRY_INTERVAL', 10.0))
+
+    # Connection pool, per worker process; size it to at least the gunicorn thread count.
+    # Ignored for SQLite, which uses SQLAlchemy's single-file pools.
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+
+    # Maximum number of product codes bound into a single IN (...) lookup
+    PRODUCT_LOOKUP_CHUNK_SIZE = int(os.getenv('PRODUCT_LOOKUP_CHUNK_SIZE', 500))
+
+    # Per-worker pricing table cache; the shared pricing version is re-checked at most once per interval (seconds)
+    PRICING_CACHE_ENABLED = os.getenv('PRICING_CACHE_ENABLED', 'true').lower() == 'true'
+    PRICING_CACHE_CHECK_INTERVAL = float(os.getenv('PRICING_CACHE_CHECK_INTERVAL', 1.0))
+    # Directory for memory-mapped pricing snapshot files, one per pricing version, shared by every
+    # worker on the host; unset keeps each worker's packed snapshot in its own memory
+    PRICING_SNAPSHOT_DIR = os.getenv('PRICING_SNAPSHOT_DIR')
+    # Load the pricing snapshot inside create_app instead of on the first request; with
+    # gunicorn --preload this happens once in the master and workers share it copy-on-write
+    PRICING_PRELOAD = os.getenv('PRICING_PRELOAD', 'false').lower() == 'true'
+
+    # Rows per INSERT ... ON CONFLICT statement when PUT /api/pricing upserts products
+    PRICING_UPSERT_CHUNK_SIZE = int(os.getenv('PRICING_UPSERT_CHUNK_SIZE', 1000))
+    # Rows buffered per staging-table load when POST /api/pricing replaces the table
+    PRICING_IMPORT_BATCH_SIZE = int(os.getenv('PRICING_IMPORT_BATCH_SIZE', 5000))
+    # GET /api/pricing: largest page size for ?limit=, rows per chunk/cursor fetch for ?stream=true
+    PRICING_PAGE_MAX_LIMIT = int(os.getenv('PRICING_PAGE_MAX_LIMIT', 1000))
+    PRICING_STREAM_BATCH_SIZE = int(os.getenv('PRICING_STREAM_BATCH_SIZE', 1000))
+    # PATCH /api/pricing/<code> writes that queue up behind a commit are applied together, up to
+    # PRICING_PATCH_BATCH_SIZE per transaction and pricing version (1 disables); the first waits
+    # PRICING_PATCH_WINDOW extra seconds to gather a burst
+    PRICING_PATCH_WINDOW = float(os.getenv('PRICING_PATCH_WINDOW', 0))
+    PRICING_PATCH_BATCH_SIZE = int(os.getenv('PRICING_PATCH_BATCH_SIZE', 200))
+    # Writes sent with an Idempotency-Key header are replayed for IDEMPOTENCY_KEY_TTL seconds; a key whose
+    # first request never finished (e.g. the worker died) can be reused after IDEMPOTENCY_PENDING_TIMEOUT
+    IDEMPOTENCY_KEY_TTL = float(os.getenv('IDEMPOTENCY_KEY_TTL', 86400))
+    IDEMPOTENCY_PENDING_TIMEOUT = float(os.getenv('IDEMPOTENCY_PENDING_TIMEOUT', 60))
+    # Largest number of carts accepted by one POST /api/subtotal/batch request
+    SUBTOTAL_BATCH_MAX_CARTS = int(os.getenv('SUBTOTAL_BATCH_MAX_CARTS', 1000))
+    # Precomputed line totals for quantities below PRICING_QUANTITY_TABLE_SIZE, built for up to
+    # PRICING_QUANTITY_TABLE_PRODUCTS products as each worker first prices them; size 0 disables them
+    PRICING_QUANTITY_TABLE_SIZE = int(os.getenv('PRICING_QUANTITY_TABLE_SIZE', 16))
+    PRICING_QUANTITY_TABLE_PRODUCTS = int(os.getenv('PRICING_QUANTITY_TABLE_PRODUCTS', 2000))
+    # Carts (or batches) with at least this many lines use the numpy engine when numpy is installed
+    PRICING_VECTOR_MIN_LINES = int(os.getenv('PRICING_VECTOR_MIN_LINES', 1000))
+    # POST /api/quote cache: LRU bounded by entries and bytes, entries expire after QUOTE_CACHE_TTL seconds.
+    # Set QUOTE_CACHE_REDIS_URL (needs the redis package) to share quotes between workers.
+    QUOTE_CACHE_MAX_ENTRIES = int(os.getenv('QUOTE_CACHE_MAX_ENTRIES', 10000))
+    QUOTE_CACHE_MAX_BYTES = int(os.getenv('QUOTE_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+    QUOTE_CACHE_TTL = float(os.getenv('QUOTE_CACHE_TTL', 300))
+    QUOTE_CACHE_REDIS_URL = os.getenv('QUOTE_CACHE_REDIS_URL')
+    # Cart sessions: evicted after CART_IDLE_TIMEOUT idle seconds; with CART_PERSISTENCE_ENABLED
+    # every update is also written to cart_sessions so any worker can serve the cart
+    CART_IDLE_TIMEOUT = float(os.getenv('CART_IDLE_TIMEOUT', 1800))
+    CART_MAX_SESSIONS = int(os.getenv('CART_MAX_SESSIONS', 100000))
+    CART_PERSISTENCE_ENABLED = os.getenv('CART_PERSISTENCE_ENABLED', 'false').lower() == 'true'
+    # `flask reprice`: pricing processes (0 = one per CPU) and orders sent to a process per task
+    REPRICE_WORKERS = int(os.getenv('REPRICE_WORKERS', 0))
+    REPRICE_CHUNK_SIZE = int(os.getenv('REPRICE_CHUNK_SIZE', 2000))
+
+class ProductionConfig(Config):
+    # Cold-start profile for gunicorn and autoscaled workers: `gunicorn 'app:create_app("config.ProductionConfig")'`
+    LOG_CONFIGURE_ROOT = os.getenv('LOG_CONFIGURE_ROOT', 'false').lower() == 'true'
+    PRICING_PRELOAD = os.getenv('PRICING_PRELOAD', 'true').lower() == 'true'
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
@@ -1,12 +1,76 @@
 CREATE TABLE products (
-  code VARCHAR(10) NOT NULL,
-  unit_price DECIMAL(10, 2) NOT NULL,
-  special_price VARCHAR(20)
+  code VARCHAR(10) PRIMARY KEY,
+  unit_price INTEGER NOT NULL,
+  special_price VARCHAR(50),
+  offer_qty INTEGER,
+  offer_price INTEGER,
+  version BIGINT NOT NULL DEFAULT 0,
+  CONSTRAINT ck_products_offer_columns CHECK ((offer_qty IS NULL) = (offer_price IS NULL)),
+  CONSTRAINT ck_products_offer_qty CHECK (offer_qty > 0)
 );
 
-INSERT INTO products (unit_price, special_price, code)
+CREATE INDEX ix_products_version ON products (version);
+
+INSERT INTO products (unit_price, special_price, offer_qty, offer_price, code)
 VALUES
-(50, '3 for 140', 'A'),
-(35, '2 for 60', 'B'),
-(25, NULL, 'C'),
-(12, NULL, 'D');
\ No newline at end of file
+(50, '3 for 140', 3, 140, 'A'),
+(35, '2 for 60', 2, 60, 'B'),
+(25, NULL, NULL, NULL, 'C'),
+(12, NULL, NULL, NULL, 'D');
+
+CREATE TABLE pricing_version (
+  id INTEGER PRIMARY KEY,
+  version BIGINT NOT NULL
+);
+
+INSERT INTO pricing_version (id, version) VALUES (1, 0);
+
+CREATE TABLE offers (
+  id SERIAL PRIMARY KEY,
+  kind VARCHAR(20) NOT NULL,
+  code VARCHAR(10),
+  quantity INTEGER,
+  free_quantity INTEGER,
+  price INTEGER,
+  items TEXT
+);
+
+CREATE INDEX ix_offers_code ON offers (code);
+
+CREATE TABLE pricing_changes (
+  seq BIGSERIAL PRIMARY KEY,
+  version BIGINT NOT NULL,
+  op VARCHAR(10) NOT NULL,
+  code VARCHAR(10),
+  unit_price INTEGER,
+  special_price VARCHAR(50),
+  offer_id INTEGER,
+  offer TEXT,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX ix_pricing_changes_code ON pricing_changes (code);
+CREATE INDEX ix_pricing_changes_offer_id ON pricing_changes (offer_id);
+CREATE INDEX ix_pricing_changes_version ON pricing_changes (version);
+
+INSERT INTO pricing_changes (version, op, code, unit_price, special_price)
+SELECT 0, 'upsert', code, unit_price, special_price FROM products ORDER BY code;
+
+CREATE TABLE idempotency_keys (
+  key VARCHAR(255) PRIMARY KEY,
+  fingerprint VARCHAR(64) NOT NULL,
+  status INTEGER,
+  body BYTEA,
+  content_type VARCHAR(100),
+  etag VARCHAR(100),
+  created_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX ix_idempotency_keys_created_at ON idempotency_keys (created_at);
+
+CREATE TABLE cart_sessions (
+  cart_id VARCHAR(32) PRIMARY KEY,
+  quantities TEXT NOT NULL,
+  revision INTEGER NOT NULL,
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
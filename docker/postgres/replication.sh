@@ -0,0 +1,4 @@
+#!/bin/bash
+# Lets db-replica (docker-compose.yml) stream from this server
+set -e
+echo "host replication all all md5" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,25 @@
+# Picked up automatically by `gunicorn 'app:create_app()'` (see Procfile).
+import gc
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+# Settings in .env apply to gunicorn runs too; config.py itself no longer loads it at import
+load_dotenv()
+
+# gthread workers serve several requests per process while one waits on Postgres;
+# set GUNICORN_WORKER_CLASS=sync for the old one-request-per-process behaviour.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+# Create the app (and, with PRICING_PRELOAD, the pricing snapshot) once in the master before forking
+preload_app = os.getenv('GUNICORN_PRELOAD', 'false').lower() == 'true'
+
+
+def when_ready(server):
+    # Objects loaded before the fork are moved out of the collector's generations, so
+    # garbage collection in the workers does not write to (and copy) the shared pages
+    if preload_app:
+        gc.freeze()
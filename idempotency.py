@@ -0,0 +1,89 @@
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.exc import IntegrityError
+
+from model import db, IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+# Expired keys are deleted by the first claim after this many seconds, per worker
+PURGE_INTERVAL = 60.0
+
+_last_purge = 0.0
+
+
+def fingerprint(method, path, body):
+    """Identifies the request a key was first used with; `body` is bytes, the Content-Length for streamed uploads."""
+    digest = hashlib.sha256(f'{method} {path}\n'.encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def claim(key, request_fingerprint, ttl, pending_timeout):
+    """Claim `key` for this request, committing the claim in its own transaction.
+
+    Returns None when the request should run, otherwise the IdempotencyKey already
+    stored for it: finished (replay its response), still running (status None) or
+    made with a different request (fingerprint differs). Keys expire after `ttl`
+    seconds. A claim left unfinished for `pending_timeout` seconds, e.g. by a
+    worker that died mid-request, is taken over.
+    """
+    now = _utcnow()
+    _purge_expired(now, ttl)
+    row = db.session.get(IdempotencyKey, key)
+    if row is None:
+        db.session.add(IdempotencyKey(key=key, fingerprint=request_fingerprint, created_at=now))
+        try:
+            db.session.commit()
+            return None
+        except IntegrityError:
+            # Another worker claimed it first
+            db.session.rollback()
+            row = db.session.get(IdempotencyKey, key)
+    expired = row.created_at <= now - timedelta(seconds=ttl)
+    abandoned = row.status is None and row.created_at <= now - timedelta(seconds=pending_timeout)
+    if expired or abandoned:
+        # Conditional on created_at, so only one of several concurrent retries takes it over
+        taken = db.session.execute(
+            db.update(IdempotencyKey)
+            .where(IdempotencyKey.key == key, IdempotencyKey.created_at == row.created_at)
+            .values(fingerprint=request_fingerprint, status=None, body=None, content_type=None, etag=None, created_at=now)
+        ).rowcount
+        db.session.commit()
+        if taken:
+            return None
+        row = db.session.get(IdempotencyKey, key)
+    return row
+
+
+def record(key, response):
+    """Store the response of a claimed request so retries replay it."""
+    db.session.execute(
+        db.update(IdempotencyKey).where(IdempotencyKey.key == key)
+        .values(status=response.status_code, body=response.get_data(), content_type=response.content_type,
+                etag=response.headers.get('ETag'))
+    )
+    db.session.commit()
+
+
+def release(key):
+    """Drop the claim of a request that failed, so it can be retried with the same key."""
+    db.session.rollback()
+    db.session.execute(db.delete(IdempotencyKey).where(IdempotencyKey.key == key))
+    db.session.commit()
+
+
+def _purge_expired(now, ttl):
+    global _last_purge
+    if time.monotonic() - _last_purge < PURGE_INTERVAL:
+        return
+    _last_purge = time.monotonic()
+    db.session.execute(db.delete(IdempotencyKey).where(IdempotencyKey.created_at <= now - timedelta(seconds=ttl)))
+    db.session.commit()
+
+
+def _utcnow():
+    # Naive UTC, like the DateTime columns
+    return datetime.now(timezone.utc).replace(tzinfo=None)
@@ -0,0 +1,58 @@
+"""Request and response JSON: orjson when it is installed, the standard library otherwise."""
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def available():
+    return orjson is not None
+
+
+def loads(data):
+    """Decode JSON text or bytes; raises json.JSONDecodeError (a ValueError) when invalid.
+
+    orjson decodes integers beyond 64 bits as floats, so such quantities and
+    prices fail validation instead of being accepted.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson.
+
+    Output matches the default provider (sorted keys, compact outside debug).
+    Values orjson cannot encode, such as Decimal or subtotals beyond 64 bits,
+    and calls with json.dumps keyword arguments go through the default provider.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._encode(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        if self.compact is False or (self.compact is None and self._app.debug):
+            # Indented output for debugging is not worth a fast path
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._encode(obj) + b'\n', mimetype=self.mimetype)
+
+    def _encode(self, obj):
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+        try:
+            return orjson.dumps(obj, option=option)
+        except orjson.JSONEncodeError:
+            # Compact like the orjson output it stands in for (and the default provider's responses outside debug)
+            return super().dumps(obj, separators=(',', ':')).encode()
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+CART_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000, 100000)
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per label combination."""
+
+    def __init__(self, name, description, buckets, labelnames=()):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # per-bucket counts, then sum and count
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series_items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in sorted(series_items):
+            label_text = ','.join(f'{name}="{value}"' for name, value in zip(self.labelnames, labels))
+            prefix = label_text + ',' if label_text else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            suffix = f'{{{label_text}}}' if label_text else ''
+            lines.append(f'{self.name}_sum{suffix} {series[-2]}')
+            lines.append(f'{self.name}_count{suffix} {series[-1]}')
+        return lines
+
+
+class Metrics:
+    """Request, database and cart-size metrics for one worker process."""
+
+    def __init__(self):
+        self.request_latency = Histogram(
+            'http_request_duration_seconds', 'Request latency by endpoint.',
+            LATENCY_BUCKETS, ('method', 'endpoint', 'status')
+        )
+        self.request_queries = Histogram(
+            'db_queries_per_request', 'SQL statements executed per request.',
+            QUERY_COUNT_BUCKETS, ('method', 'endpoint')
+        )
+        self.request_db_time = Histogram(
+            'db_time_per_request_seconds', 'Time spent in SQL statements per request.',
+            LATENCY_BUCKETS, ('method', 'endpoint')
+        )
+        self.cart_size = Histogram(
+            'cart_lines', 'Lines per priced cart.', CART_SIZE_BUCKETS, ('endpoint',)
+        )
+
+    def init_app(self, app, engines):
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def observe_cart(self, lines):
+        self.cart_size.observe(lines, request.url_rule.rule)
+
+    def render(self, samples=()):
+        """Prometheus text format; `samples` adds (name, type, description, value) single-value metrics."""
+        lines = []
+        for histogram in (self.request_latency, self.request_queries, self.request_db_time, self.cart_size):
+            lines.extend(histogram.render())
+        for name, metric_type, description, value in samples:
+            lines.extend([f'# HELP {name} {description}', f'# TYPE {name} {metric_type}', f'{name} {value}'])
+        return '\n'.join(lines) + '\n'
+
+    def _start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_db_time = 0.0
+
+    def _finish_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        self.request_latency.observe(time.perf_counter() - start, request.method, endpoint, str(response.status_code))
+        self.request_queries.observe(g.pop('metrics_queries', 0), request.method, endpoint)
+        self.request_db_time.observe(g.pop('metrics_db_time', 0.0), request.method, endpoint)
+        return response
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info['metrics_query_start'] = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop('metrics_query_start', None)
+        if start is not None and has_app_context() and 'metrics_queries' in g:
+            g.metrics_queries += 1
+            g.metrics_db_time += time.perf_counter() - start
@@ -0,0 +1,29 @@
+"""pricing_version table
+
+Revision ID: 3b1f2c9d8e4a
+Revises: 7e6657d44672
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b1f2c9d8e4a'
+down_revision = '7e6657d44672'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    pricing_version = op.create_table('pricing_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(pricing_version, [{'id': 1, 'version': 0}])
+
+
+def downgrade():
+    op.drop_table('pricing_version')
@@ -0,0 +1,28 @@
+"""products.code primary key
+
+Revision ID: 5d2a7e91c4b0
+Revises: 3b1f2c9d8e4a
+Create Date: 2026-10-18 10:02:17.551093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2a7e91c4b0'
+down_revision = '3b1f2c9d8e4a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 7e6657d44672 dropped the item_code primary key; restore it on code so
+    # upserts can target ON CONFLICT (code)
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.create_primary_key('products_pkey', ['code'])
+
+
+def downgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_constraint('products_pkey', type_='primary')
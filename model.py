@@ -1,6 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import bindparam, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import validates
 
-db = SQLAlchemy()
+from replicas import RoutingSession
+
+# Sessions route read-only requests to a read replica when SQLALCHEMY_REPLICA_URIS is set
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Product(db.Model):
     __tablename__ = 'products'
@@ -8,11 +14,35 @@ class Product(db.Model):
     code = db.Column(db.String(10), primary_key=True)
     unit_price = db.Column(db.Integer, nullable=False)
     special_price = db.Column(db.String(50), nullable=True)
+    # special_price "N for M" as offer_qty N and offer_price M, which is what pricing reads; both NULL without an offer
+    offer_qty = db.Column(db.Integer, nullable=True)
+    offer_price = db.Column(db.Integer, nullable=True)
+    # Pricing version of the row's last write; the product's ETag for If-Match, and indexed for "changed since" reads
+    version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0', index=True)
+
+    __table_args__ = (
+        db.CheckConstraint('(offer_qty IS NULL) = (offer_price IS NULL)', name='ck_products_offer_columns'),
+        db.CheckConstraint('offer_qty > 0', name='ck_products_offer_qty'),
+    )
 
-    def __init__(self, code, unit_price, special_price=None):
+    def __init__(self, code, unit_price, special_price=None, version=0):
         self.code = code
         self.unit_price = unit_price
         self.special_price = special_price
+        self.version = version
+
+    @validates('special_price')
+    def _set_offer_columns(self, key, special_price):
+        # pricing imports this module, so its parser is imported on first use
+        from pricing import offer_columns, parse_offer
+        try:
+            offer = parse_offer(special_price)
+        except ValueError:
+            # Like compile_product: an invalid legacy string prices at the unit price
+            offer = None
+        for name, value in offer_columns(offer).items():
+            setattr(self, name, value)
+        return special_price
 
     def to_dict(self):
         return {
@@ -20,3 +50,130 @@ class Product(db.Model):
             'unit_price': self.unit_price,
             'special_price': self.special_price
         }
+
+    @classmethod
+    def upsert_many(cls, rows, chunk_size=1000):
+        # Set-based INSERT ... ON CONFLICT (code) DO UPDATE, one statement per chunk of rows
+        dialect = db.session.get_bind().dialect.name
+        insert = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}.get(dialect)
+        if insert is None:
+            for row in rows:
+                db.session.merge(cls(row['code'], row['unit_price'], row['special_price'], row['version']))
+            return
+        for start in range(0, len(rows), chunk_size):
+            stmt = insert(cls.__table__).values(rows[start:start + chunk_size])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[cls.code],
+                set_={'unit_price': stmt.excluded.unit_price, 'special_price': stmt.excluded.special_price,
+                      'offer_qty': stmt.excluded.offer_qty, 'offer_price': stmt.excluded.offer_price,
+                      'version': stmt.excluded.version}
+            )
+            db.session.execute(stmt)
+
+    @classmethod
+    def patch_many(cls, patches, version):
+        """Apply (code, fields, expected_versions) patches in order, stamping changed rows with `version`.
+
+        A special_price in `fields` comes with its offer_qty and offer_price.
+
+        The rows are read FOR UPDATE and written back in one executemany, so concurrent
+        writers cannot interleave. Returns (status, row) per patch: 200 and the new row,
+        404 for an unknown code, or 412 and the current row when expected_versions is
+        not None and does not contain the row's version.
+        """
+        table = cls.__table__
+        codes = list(dict.fromkeys(code for code, _, _ in patches))
+        rows = {row.code: row._asdict() for row in db.session.execute(
+            db.select(table.c.code, table.c.unit_price, table.c.special_price, table.c.offer_qty, table.c.offer_price,
+                      table.c.version)
+            .where(table.c.code.in_(codes)).with_for_update()
+        )}
+        results = []
+        changed = {}
+        for code, fields, expected_versions in patches:
+            row = rows.get(code)
+            if row is None:
+                results.append((404, None))
+            elif expected_versions is not None and row['version'] not in expected_versions:
+                results.append((412, dict(row)))
+            else:
+                row.update(fields, version=version)
+                changed[code] = row
+                results.append((200, dict(row)))
+        if changed:
+            stmt = update(table).where(table.c.code == bindparam('row_code'))
+            db.session.execute(stmt, [
+                {'row_code': code, 'unit_price': row['unit_price'], 'special_price': row['special_price'],
+                 'offer_qty': row['offer_qty'], 'offer_price': row['offer_price'], 'version': version}
+                for code, row in changed.items()
+            ])
+        return results
+
+class Offer(db.Model):
+    # Multi-buy tier, buy-X-get-Y or cross-product bundle (see offers.validate_offer); bundle items are JSON {code: quantity}
+    __tablename__ = 'offers'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    code = db.Column(db.String(10), nullable=True, index=True)
+    quantity = db.Column(db.Integer, nullable=True)
+    free_quantity = db.Column(db.Integer, nullable=True)
+    price = db.Column(db.Integer, nullable=True)
+    items = db.Column(db.Text, nullable=True)
+
+class PricingVersion(db.Model):
+    # Single-row table holding a counter that every pricing write increments
+    __tablename__ = 'pricing_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @classmethod
+    def current(cls):
+        version = db.session.execute(db.select(cls.version).where(cls.id == 1)).scalar()
+        return version or 0
+
+    @classmethod
+    def bump(cls):
+        # Runs inside the caller's transaction so the new version commits with the change; returns the new version
+        version = db.session.execute(update(cls).where(cls.id == 1).values(version=cls.version + 1).returning(cls.version)).scalar()
+        if version is None:
+            db.session.add(cls(id=1, version=1))
+            version = 1
+        return version
+
+class PricingChange(db.Model):
+    # Append-only log of pricing writes: one row per product (code) or offer (offer_id) with its new state.
+    # seq orders the log; version is the pricing version the write committed at. offer is the offer's columns as JSON
+    __tablename__ = 'pricing_changes'
+
+    seq = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, index=True)
+    op = db.Column(db.String(10), nullable=False)
+    code = db.Column(db.String(10), nullable=True, index=True)
+    unit_price = db.Column(db.Integer, nullable=True)
+    special_price = db.Column(db.String(50), nullable=True)
+    offer_id = db.Column(db.Integer, nullable=True, index=True)
+    offer = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+class IdempotencyKey(db.Model):
+    # Response to a write sent with an Idempotency-Key header; status is NULL while the first request runs
+    __tablename__ = 'idempotency_keys'
+
+    key = db.Column(db.String(255), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.Integer, nullable=True)
+    body = db.Column(db.LargeBinary, nullable=True)
+    content_type = db.Column(db.String(100), nullable=True)
+    etag = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class CartSession(db.Model):
+    # Optional persisted copy of an in-memory cart session; quantities is a JSON {code: quantity} object
+    __tablename__ = 'cart_sessions'
+
+    cart_id = db.Column(db.String(32), primary_key=True)
+    quantities = db.Column(db.Text, nullable=False)
+    revision = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
@@ -0,0 +1,281 @@
+import json
+from array import array
+from collections import namedtuple
+from fractions import Fraction
+from math import lcm, prod
+
+from model import Offer, Product
+
+OFFER_KINDS = ('multi_buy', 'buy_get', 'bundle')
+
+# Plain-tuple form of an offers row, so a compiled engine can be rebuilt in another process
+OfferRow = namedtuple('OfferRow', ['id', 'kind', 'code', 'quantity', 'free_quantity', 'price', 'items'])
+
+# Cross-product bundle: `items` is a tuple of (code, quantity) that together cost `price`
+Bundle = namedtuple('Bundle', ['offer_id', 'items', 'price'])
+
+# Largest units in one multi-buy or buy-X-get-Y tier (and in a written special price). A TierTable has
+# up to best_count * largest tier entries, so this keeps it at most MAX_OFFER_QUANTITY ** 2
+MAX_OFFER_QUANTITY = 100
+# Bundle counts tried per pass are bounded by the tier periods of its products; periods are capped here
+MAX_BUNDLE_PERIOD = 720
+# Bundle count combinations searched exhaustively; larger carts fall back to coordinate descent
+MAX_BUNDLE_SEARCH = 4096
+# Passes of coordinate descent over bundles that share products
+MAX_BUNDLE_ROUNDS = 4
+
+
+def validate_offer(data):
+    """Column values for an offer payload; raises ValueError if it is not a valid offer.
+
+    multi_buy: {"code", "quantity", "price"}, "quantity units cost price" (one row per tier)
+    buy_get:   {"code", "quantity", "free_quantity"}, buy quantity and get free_quantity free
+    bundle:    {"items": {code: quantity}, "price"}, the listed units together cost price
+    """
+    if not isinstance(data, dict) or data.get('kind') not in OFFER_KINDS:
+        raise ValueError(f"Invalid offer {data}. Expected an object with kind one of {', '.join(OFFER_KINDS)}.")
+    kind = data['kind']
+    row = {'kind': kind, 'code': None, 'quantity': None, 'free_quantity': None, 'price': None, 'items': None}
+    if kind == 'bundle':
+        items = data.get('items')
+        if (not isinstance(items, dict) or not items
+                or not all(isinstance(code, str) and len(code) <= Product.code.type.length and _positive(quantity)
+                           for code, quantity in items.items())
+                or sum(items.values()) < 2):
+            raise ValueError(f"Invalid bundle items {items!r}. Expected {{code: quantity}} covering at least 2 units.")
+        row['items'] = json.dumps(dict(sorted(items.items())), separators=(',', ':'))
+    else:
+        if not isinstance(data.get('code'), str) or not data['code']:
+            raise ValueError(f"Missing product code for offer: {data}")
+        if len(data['code']) > Offer.code.type.length:
+            raise ValueError(f"Invalid product code for offer: {data}. Expected at most {Offer.code.type.length} characters.")
+        row['code'] = data['code']
+        if not _positive(data.get('quantity')) or data['quantity'] > MAX_OFFER_QUANTITY:
+            raise ValueError(f"Invalid quantity for offer: {data}. Expected 1 to {MAX_OFFER_QUANTITY}.")
+        row['quantity'] = data['quantity']
+    if kind == 'buy_get':
+        if not _positive(data.get('free_quantity')) or data['quantity'] + data['free_quantity'] > MAX_OFFER_QUANTITY:
+            raise ValueError(f"Invalid free_quantity for offer: {data}. "
+                             f"Expected quantity and free_quantity to total at most {MAX_OFFER_QUANTITY}.")
+        row['free_quantity'] = data['free_quantity']
+    else:
+        price = data.get('price')
+        if not isinstance(price, int) or isinstance(price, bool) or price < 0:
+            raise ValueError(f"Invalid price for offer: {data}")
+        row['price'] = price
+    return row
+
+
+def offer_codes(row):
+    """Product codes an offer row refers to."""
+    return list(json.loads(row['items'])) if row['kind'] == 'bundle' else [row['code']]
+
+
+def offer_to_dict(offer):
+    body = {'id': offer.id, 'kind': offer.kind}
+    if offer.kind == 'bundle':
+        body['items'] = json.loads(offer.items)
+    else:
+        body['code'] = offer.code
+        body['quantity'] = offer.quantity
+    if offer.kind == 'buy_get':
+        body['free_quantity'] = offer.free_quantity
+    else:
+        body['price'] = offer.price
+    return body
+
+
+def _positive(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+class TierTable:
+    """Cheapest price of exactly q units of one product, given its multi-buy tiers.
+
+    Costs are solved by dynamic programming up to `limit` units. Past that, some
+    optimal basket always contains the tier with the lowest price per unit
+    (any best_count pieces of other tiers contain a subset whose units are a
+    multiple of best_count, which the best tier prices no higher), so
+    cost(q) = cost(q - k * best_count) + k * best_price and every lookup is O(1).
+    """
+
+    __slots__ = ('best_count', 'best_price', 'limit', 'costs')
+
+    def __init__(self, unit_price, tiers):
+        # Larger tiers can only come from rows written before MAX_OFFER_QUANTITY; they are left out
+        # rather than letting one row make every worker's snapshot reload unbounded
+        tiers = sorted({tier for tier in tiers if tier[0] <= MAX_OFFER_QUANTITY} | {(1, unit_price)})
+        self.best_count, self.best_price = min(tiers, key=lambda tier: (Fraction(tier[1], tier[0]), tier[0]))
+        self.limit = self.best_count * max(count for count, _ in tiers)
+        costs = array('q', [0])
+        for quantity in range(1, self.limit + 1):
+            costs.append(min(costs[quantity - count] + price for count, price in tiers if count <= quantity))
+        self.costs = costs
+
+    def total(self, quantity):
+        if quantity <= self.limit:
+            return self.costs[quantity]
+        repeats = -(-(quantity - self.limit) // self.best_count)
+        return self.costs[quantity - repeats * self.best_count] + repeats * self.best_price
+
+
+class OfferEngine:
+    """Offers compiled against one set of products.
+
+    Products with multi-buy or buy-X-get-Y offers (their special_price counts as
+    one more tier) get a TierTable. Bundles are chosen per cart. The count of one
+    bundle is optimised exactly with the others fixed, over a candidate set
+    bounded by the tier periods of its products; every combination of the other
+    bundles' counts is tried while there are at most MAX_BUNDLE_SEARCH of them,
+    and beyond that passes of coordinate descent repeat until nothing improves.
+    """
+
+    def __init__(self, offers, products):
+        # Kept so the engine can be rebuilt elsewhere, e.g. in re-pricing pool processes
+        self.rows = list(offers)
+        tiers = {}
+        bundles = []
+        for offer in self.rows:
+            if offer.kind == 'bundle':
+                items = tuple(json.loads(offer.items).items())
+                if all(code in products for code, _ in items):
+                    bundles.append(Bundle(offer.id, items, offer.price))
+            elif offer.code in products:
+                unit_price = products[offer.code].unit_price
+                tier = (offer.quantity, offer.price) if offer.kind == 'multi_buy' else (
+                    offer.quantity + offer.free_quantity, offer.quantity * unit_price)
+                tiers.setdefault(offer.code, []).append(tier)
+        self.bundles = bundles
+        self.bundles_by_code = {}
+        for bundle in bundles:
+            for code, _ in bundle.items:
+                self.bundles_by_code.setdefault(code, []).append(bundle)
+                tiers.setdefault(code, [])
+        self.tables = {}
+        for code, product_tiers in tiers.items():
+            product = products[code]
+            if product.offer is not None:
+                product_tiers.append((product.offer.count, product.offer.price))
+            self.tables[code] = TierTable(product.unit_price, product_tiers)
+
+    def __bool__(self):
+        return bool(self.tables)
+
+    def applies_to(self, codes):
+        tables = self.tables
+        return any(code in tables for code in codes)
+
+    def line_total(self, product, quantity):
+        table = self.tables.get(product.code)
+        if table is not None:
+            return table.total(quantity)
+        if product.offer is None:
+            return product.unit_price * quantity
+        bundles, remainder = divmod(quantity, product.offer.count)
+        return bundles * product.offer.price + remainder * product.unit_price
+
+    def cart_total(self, quantities, products):
+        """Subtotal of {code: quantity} with tiers and the best bundles applied."""
+        total = sum(self.line_total(products[code], quantity) for code, quantity in quantities.items())
+        return total - self.bundle_discount(quantities)[0]
+
+    def bundle_discount(self, quantities):
+        """(saving over per-line prices, {bundle offer id: times applied}) for a cart's quantities."""
+        candidates = list({
+            bundle.offer_id: bundle for code in quantities for bundle in self.bundles_by_code.get(code, ())
+            if all(quantities.get(item_code, 0) >= quantity for item_code, quantity in bundle.items)
+        }.values())
+        if not candidates:
+            return 0, {}
+        saving = 0
+        applied = {}
+        # Bundles that share no product are independent, so each group is solved on its own
+        for group in _groups(candidates):
+            remaining = {code: quantities[code] for bundle in group for code, _ in bundle.items}
+            before = self._remaining_cost(remaining)
+            search_size = prod(self._max_count(bundle, remaining) + 1 for bundle in group[:-1])
+            if search_size <= MAX_BUNDLE_SEARCH:
+                after, counts = self._search(group, remaining)
+            else:
+                after, counts = self._descend(group, remaining)
+            saving += before - after
+            applied.update((bundle.offer_id, count) for bundle, count in zip(group, counts) if count)
+        return saving, applied
+
+    def _search(self, bundles, remaining):
+        # (lowest cost, counts) over every combination of counts; the last bundle is solved by _best_count
+        bundle, rest = bundles[0], bundles[1:]
+        best = None
+        for count in ([self._best_count(bundle, remaining)] if not rest else range(self._max_count(bundle, remaining) + 1)):
+            _take(bundle, count, remaining)
+            cost, counts = self._search(rest, remaining) if rest else (self._remaining_cost(remaining), [])
+            _take(bundle, -count, remaining)
+            cost += count * bundle.price
+            if best is None or cost < best[0]:
+                best = (cost, [count] + counts)
+        return best
+
+    def _descend(self, candidates, remaining):
+        remaining = dict(remaining)
+        counts = [0] * len(candidates)
+        for _ in range(MAX_BUNDLE_ROUNDS):
+            changed = False
+            for index, bundle in enumerate(candidates):
+                _take(bundle, -counts[index], remaining)
+                best = self._best_count(bundle, remaining)
+                _take(bundle, best, remaining)
+                if best != counts[index]:
+                    counts[index] = best
+                    changed = True
+            if not changed:
+                break
+        cost = self._remaining_cost(remaining) + sum(count * bundle.price for bundle, count in zip(candidates, counts))
+        return cost, counts
+
+    def _remaining_cost(self, remaining):
+        tables = self.tables
+        return sum(tables[code].total(quantity) for code, quantity in remaining.items())
+
+    @staticmethod
+    def _max_count(bundle, remaining):
+        return min(remaining[code] // quantity for code, quantity in bundle.items)
+
+    def _best_count(self, bundle, remaining):
+        # cost(k) = k * price + sum of tier costs of what is left. While every product keeps at
+        # least its table limit, cost(k + period) - cost(k) is constant, so on that range each
+        # residue class mod period has its minimum at one of its ends.
+        tables = self.tables
+        max_count = self._max_count(bundle, remaining)
+        linear_until = min((remaining[code] - tables[code].limit) // quantity for code, quantity in bundle.items)
+        period = min(lcm(*(tables[code].best_count for code, _ in bundle.items)), MAX_BUNDLE_PERIOD)
+        candidates = set(range(min(period, max_count + 1)))
+        candidates.update(range(max(0, linear_until - period + 1), max_count + 1))
+
+        def cost(count):
+            return count * bundle.price + sum(
+                tables[code].total(remaining[code] - count * quantity) for code, quantity in bundle.items
+            )
+
+        return min(sorted(candidates), key=cost)
+
+
+def _take(bundle, count, remaining):
+    for code, quantity in bundle.items:
+        remaining[code] -= count * quantity
+
+
+def _groups(bundles):
+    # Connected components of bundles linked by a shared product code
+    groups = []
+    group_of_code = {}
+    for bundle in bundles:
+        linked = {id(group_of_code[code]): group_of_code[code] for code, _ in bundle.items if code in group_of_code}
+        group = [bundle]
+        for other in linked.values():
+            group.extend(other)
+            groups.remove(other)
+        groups.append(group)
+        for member in group:
+            for code, _ in member.items:
+                group_of_code[code] = group
+    return groups
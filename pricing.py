@@ -0,0 +1,542 @@
+import bisect
+import glob
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+from collections import namedtuple
+from collections.abc import Mapping, Sequence, ValuesView
+
+from model import Offer, Product, PricingVersion
+from offers import OfferEngine, OfferRow
+
+OFFER_PATTERN = re.compile(r'\s*(\d+) for (\d+)\s*')
+
+# Compiled form of a "N for M" special price: `count` units cost `price`
+OfferRule = namedtuple('OfferRule', ['count', 'price'])
+
+class ProductPrice(namedtuple('ProductPrice', ['code', 'unit_price', 'special_price', 'offer'])):
+    """Immutable per-product pricing row; `offer` is the compiled special_price."""
+
+    __slots__ = ()
+
+    def to_dict(self):
+        return {'code': self.code, 'unit_price': self.unit_price, 'special_price': self.special_price}
+
+
+def parse_offer(special_price, max_count=None):
+    """Compile a "N for M" special price into an OfferRule; None/empty means no offer.
+
+    Raises ValueError for anything else, so bad offers are rejected when written.
+    Writes pass `max_count`; rows already stored are read without it.
+    """
+    if not special_price:
+        return None
+    match = OFFER_PATTERN.fullmatch(special_price) if isinstance(special_price, str) else None
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f'Invalid special price {special_price!r}. Expected the format "N for M", e.g. "3 for 140".')
+    if max_count is not None and int(match.group(1)) > max_count:
+        raise ValueError(f'Invalid special price {special_price!r}. N can be at most {max_count}.')
+    return OfferRule(int(match.group(1)), int(match.group(2)))
+
+
+def offer_columns(offer):
+    """products.offer_qty and offer_price for a compiled special price (None for no offer)."""
+    if offer is None:
+        return {'offer_qty': None, 'offer_price': None}
+    return {'offer_qty': offer.count, 'offer_price': offer.price}
+
+
+def product_price(row):
+    """ProductPrice of a products row from its typed offer columns, without parsing special_price."""
+    offer = None if row.offer_qty is None else OfferRule(row.offer_qty, row.offer_price)
+    return ProductPrice(row.code, row.unit_price, row.special_price, offer)
+
+
+def compile_product(row):
+    # For rows that only have special_price, e.g. pricing change log entries
+    try:
+        offer = parse_offer(row.special_price)
+    except ValueError:
+        # Rows written before offers were validated keep the old behaviour: unit price only
+        logging.getLogger(__name__).warning("Ignoring invalid special price for product %s: %r", row.code, row.special_price)
+        offer = None
+    return ProductPrice(row.code, row.unit_price, row.special_price, offer)
+
+
+def item_total(product, quantity):
+    offer = product.offer
+    if offer is None:
+        return product.unit_price * quantity
+    bundles, remainder = divmod(quantity, offer.count)
+    return bundles * offer.price + remainder * product.unit_price
+
+
+class CartError(Exception):
+    """A cart that cannot be priced; `status` is the HTTP status to report."""
+
+    def __init__(self, message, status=400, missing_codes=None):
+        super().__init__(message)
+        self.status = status
+        self.missing_codes = missing_codes
+
+    def to_dict(self):
+        body = {'error': str(self)}
+        if self.missing_codes:
+            body['missing_codes'] = self.missing_codes
+        return body
+
+
+def cart_codes(items):
+    """Validate a cart's items and return its distinct product codes in first-seen order."""
+    if not isinstance(items, list):
+        raise CartError('Invalid input format. Expected a list of items.')
+    codes = {}
+    for item in items:
+        # One pass over well-formed lines; anything unusual gets the full checks below
+        try:
+            code, quantity = item['code'], item['quantity']
+        except (TypeError, KeyError, IndexError):
+            code = quantity = None
+        if type(code) is not str or type(quantity) is not int or not code or quantity <= 0:
+            _check_cart_item(item)
+        codes[code] = None
+    return list(codes)
+
+
+def _check_cart_item(item):
+    if not isinstance(item, dict) or not item.get('code') or not item.get('quantity'):
+        raise CartError(f'Missing code or quantity for item: {item}')
+    if not isinstance(item['code'], str):
+        raise CartError(f'Invalid code for item: {item}')
+    if not isinstance(item['quantity'], int) or item['quantity'] < 0:
+        raise CartError(f'Invalid quantity for item: {item}')
+
+
+def merge_lines(items, codes):
+    """A validated cart with each product's repeated lines merged into one, in first-seen order.
+
+    Every pricing path prices a product's total quantity, so how a basket is split
+    into lines never changes its subtotal; carts without repeats are returned as they are.
+    """
+    if len(codes) == len(items):
+        return items
+    quantities = dict.fromkeys(codes, 0)
+    for item in items:
+        quantities[item['code']] += item['quantity']
+    return [{'code': code, 'quantity': quantity} for code, quantity in quantities.items()]
+
+
+def price_cart(items, codes, products, offers=None, quantity_tables=None):
+    """Subtotal of a validated cart against a code -> ProductPrice mapping and optional OfferEngine.
+
+    With `quantity_tables`, lines of tabled products are a single lookup.
+    """
+    tables = quantity_tables.tables if quantity_tables is not None else {}
+    missing_codes = [code for code in codes if code not in tables and code not in products]
+    if missing_codes:
+        raise CartError(f"Products with codes {', '.join(missing_codes)} not found.", 404, missing_codes)
+    items = merge_lines(items, codes)
+    if offers and offers.applies_to(codes):
+        return offers.cart_total({item['code']: item['quantity'] for item in items}, products)
+    total = 0
+    for item in items:
+        code, quantity = item['code'], item['quantity']
+        table = tables.get(code)
+        if table is not None and quantity < len(table):
+            total += table[quantity]
+            continue
+        product = products[code]
+        total += item_total(product, quantity)
+        if table is None and quantity_tables is not None:
+            quantity_tables.add(product)
+    return total
+
+
+class QuantityTables:
+    """Line totals for quantities 0..size-1 of up to `max_products` products.
+
+    A product's table is built the first time it is priced, so the best sellers
+    get one early. When the snapshot is reloaded the tables move to the new one;
+    only products whose price changed are built again, and deleted ones dropped.
+    Products with offer tiers are priced by their TierTable instead.
+    """
+
+    __slots__ = ('size', 'max_products', 'tables', 'products', 'builds')
+
+    def __init__(self, size, max_products):
+        self.size = size
+        self.max_products = max_products
+        self.tables = {}
+        self.products = {}
+        self.builds = 0
+
+    def add(self, product):
+        if len(self.tables) >= self.max_products or self.size <= 0:
+            return
+        self.tables[product.code] = tuple(item_total(product, quantity) for quantity in range(self.size))
+        self.products[product.code] = product
+        self.builds += 1
+
+    def carry_over(self, products):
+        """Tables for a reloaded snapshot's `products`, keeping those of unchanged products."""
+        carried = QuantityTables(self.size, self.max_products)
+        carried.builds = self.builds
+        # Request threads keep adding tables (add() takes no lock) while the cache reloads, so iterate a copy;
+        # add() fills `tables` before `products`, so every code in the copy has its table
+        for code, product in list(self.products.items()):
+            current = products.get(code)
+            if current == product:
+                carried.tables[code] = self.tables[code]
+                carried.products[code] = product
+            elif current is not None:
+                carried.add(current)
+        return carried
+
+
+# Packed snapshot header: magic, pricing version, product count, code width, hash slots, special_price bytes
+PACKED_HEADER = struct.Struct('=8sqqqqq')
+PACKED_MAGIC = b'PRICES02'
+SNAPSHOT_FILE_PATTERN = 'pricing-{version}.snapshot'
+
+
+class _PackedCodes(Sequence):
+    # Sorted NUL-padded codes as a sequence of bytes, so bisect can search them in place
+
+    __slots__ = ('_buffer', '_start', '_width', '_count')
+
+    def __init__(self, buffer, start, width, count):
+        self._buffer = buffer
+        self._start = start
+        self._width = width
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        start = self._start + index * self._width
+        return bytes(self._buffer[start:start + self._width])
+
+
+class _PackedValues(ValuesView):
+
+    def __iter__(self):
+        products = self._mapping
+        return (products.product_at(index) for index in range(len(products)))
+
+
+class PackedProducts(Mapping):
+    """Read-only code -> ProductPrice mapping over one packed buffer (bytes, mmap or shared memory).
+
+    Codes are sorted and NUL-padded to a fixed width, with an open-addressing
+    hash table (crc32, so it is the same in every process) of row numbers for
+    O(1) lookup. Unit price, offer count and offer price are int64 columns, with
+    no offer stored as "1 for unit_price"; special_price strings are an offsets
+    column into one string blob. ProductPrice tuples are only built on lookup,
+    so a product costs a few dozen bytes however large the catalogue is.
+    """
+
+    def __init__(self, buffer):
+        magic, self.version, count, width, slot_count, _ = PACKED_HEADER.unpack_from(buffer)
+        if magic != PACKED_MAGIC:
+            raise ValueError('Not a packed pricing snapshot.')
+        self.buffer = buffer
+        self.code_width = width
+        self._count = count
+        offset = PACKED_HEADER.size
+        self.codes = _PackedCodes(buffer, offset, width, count)
+        self._codes_start = offset
+        self._view = memoryview(buffer)
+        self.code_bytes = self._view[offset:offset + count * width]
+        offset += _aligned(count * width)
+        # Slots hold row + 1, 0 is empty; the slot count is a power of two
+        self._slots = self._view[offset:offset + 4 * slot_count].cast('i')
+        self._slot_mask = slot_count - 1
+        offset += _aligned(4 * slot_count)
+        self.unit_price, offset = self._column(offset, count)
+        self.offer_count, offset = self._column(offset, count)
+        self.offer_price, offset = self._column(offset, count)
+        self._special_offsets, offset = self._column(offset, count + 1)
+        self._special_start = offset
+
+    @classmethod
+    def build(cls, version, products):
+        by_code = {product.code.encode(): product for product in products}
+        codes = sorted(by_code)
+        rows = [by_code[code] for code in codes]
+        width = max(map(len, codes), default=1)
+        specials = [(product.special_price or '').encode() for product in rows]
+        special_offsets = array('q', [0])
+        for special in specials:
+            special_offsets.append(special_offsets[-1] + len(special))
+        # At most half full, so probe sequences stay short
+        slot_count = 1 << max(1, (2 * len(codes)).bit_length())
+        slots = array('i', bytes(4 * slot_count))
+        mask = slot_count - 1
+        for row, code in enumerate(codes, start=1):
+            slot = zlib.crc32(code.ljust(width, b'\0')) & mask
+            while slots[slot]:
+                slot = (slot + 1) & mask
+            slots[slot] = row
+        return cls(b''.join([
+            PACKED_HEADER.pack(PACKED_MAGIC, version, len(rows), width, slot_count, special_offsets[-1]),
+            b''.join(code.ljust(width, b'\0') for code in codes).ljust(_aligned(len(rows) * width), b'\0'),
+            slots.tobytes().ljust(_aligned(4 * slot_count), b'\0'),
+            array('q', [product.unit_price for product in rows]).tobytes(),
+            array('q', [product.offer.count if product.offer else 1 for product in rows]).tobytes(),
+            array('q', [product.offer.price if product.offer else product.unit_price for product in rows]).tobytes(),
+            special_offsets.tobytes(),
+            b''.join(specials)
+        ]))
+
+    @classmethod
+    def open(cls, path):
+        # The mapping is read-only and backed by the page cache, so every worker shares one copy
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def save(self, path):
+        # Written under a temporary name and renamed, so readers never map a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.buffer)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def find(self, code):
+        """Row index of `code`, or -1."""
+        if not isinstance(code, str):
+            return -1
+        key = code.encode()
+        if len(key) > self.code_width:
+            return -1
+        width = self.code_width
+        key = key.ljust(width, b'\0')
+        buffer, codes_start, slots, mask = self.buffer, self._codes_start, self._slots, self._slot_mask
+        slot = zlib.crc32(key) & mask
+        while True:
+            row = slots[slot]
+            if not row:
+                return -1
+            start = codes_start + (row - 1) * width
+            if buffer[start:start + width] == key:
+                return row - 1
+            slot = (slot + 1) & mask
+
+    def bisect_right(self, code):
+        """Row index of the first product whose code sorts after `code`."""
+        return bisect.bisect_right(self.codes, code.encode().ljust(self.code_width, b'\0'))
+
+    def product_at(self, index):
+        buffer = self.buffer
+        code_start = self._codes_start + index * self.code_width
+        unit_price = self.unit_price[index]
+        offer_count = self.offer_count[index]
+        offer_price = self.offer_price[index]
+        special_start = self._special_start + self._special_offsets[index]
+        special_stop = self._special_start + self._special_offsets[index + 1]
+        return ProductPrice(
+            bytes(buffer[code_start:code_start + self.code_width]).rstrip(b'\0').decode(),
+            unit_price,
+            bytes(buffer[special_start:special_stop]).decode() if special_stop > special_start else None,
+            None if offer_count == 1 and offer_price == unit_price else OfferRule(offer_count, offer_price)
+        )
+
+    def release(self):
+        # Views must be released before a shared memory or mmap buffer can be closed
+        for view in (self.code_bytes, self._slots, self.unit_price, self.offer_count, self.offer_price, self._special_offsets, self._view):
+            view.release()
+
+    def __getitem__(self, code):
+        index = self.find(code)
+        if index < 0:
+            raise KeyError(code)
+        return self.product_at(index)
+
+    def __contains__(self, code):
+        return self.find(code) >= 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return (code.rstrip(b'\0').decode() for code in self.codes)
+
+    def values(self):
+        return _PackedValues(self)
+
+    def _column(self, offset, length):
+        return self._view[offset:offset + 8 * length].cast('q'), offset + 8 * length
+
+
+def _aligned(size):
+    return (size + 7) // 8 * 8
+
+
+def snapshot_path(directory, version):
+    return os.path.join(directory, SNAPSHOT_FILE_PATTERN.format(version=version))
+
+
+class PricingSnapshot:
+    """Read-only copy of the whole pricing table at one pricing version."""
+
+    __slots__ = ('version', 'products', 'offers', 'vector', 'quantity_tables')
+
+    def __init__(self, version, products, offers=()):
+        self.version = version
+        # Already packed products (e.g. mapped from a snapshot file) are used as they are
+        self.products = products if isinstance(products, PackedProducts) else PackedProducts.build(version, products)
+        self.offers = OfferEngine(offers, self.products)
+        # Array form for the vectorized engine, built lazily by pricing_vector
+        self.vector = None
+        # Set by PricingCache, which carries them across reloads
+        self.quantity_tables = None
+
+    @classmethod
+    def load(cls, version, directory=None):
+        """Snapshot at `version`; with `directory`, mapped from the snapshot file shared by the host's workers.
+
+        The first worker to need a version builds the file; older versions are
+        removed then (workers still mapping them keep their pages until they reload).
+        """
+        # Offers are few, so they are read from the table even when the products are mapped from a file
+        offers = load_offer_rows()
+        if directory is not None:
+            path = snapshot_path(directory, version)
+            try:
+                return cls(version, PackedProducts.open(path), offers)
+            except FileNotFoundError:
+                pass
+        rows = Product.query.with_entities(
+            Product.code, Product.unit_price, Product.special_price, Product.offer_qty, Product.offer_price
+        )
+        products = PackedProducts.build(version, (product_price(row) for row in rows))
+        if directory is None:
+            return cls(version, products, offers)
+        products.save(path)
+        _remove_snapshot_files(directory, older_than=version)
+        return cls(version, PackedProducts.open(path), offers)
+
+    def to_list(self):
+        return [product.to_dict() for product in self.products.values()]
+
+    def page(self, after=None, limit=None):
+        """Products ordered by code, starting after `after`; also returns whether more follow."""
+        products = self.products
+        start = products.bisect_right(after) if after is not None else 0
+        stop = len(products) if limit is None else min(start + limit, len(products))
+        return [products.product_at(index) for index in range(start, stop)], stop < len(products)
+
+    def stream(self, after=None):
+        """Products ordered by code after `after`, each built only when the consumer reaches it."""
+        products = self.products
+        start = products.bisect_right(after) if after is not None else 0
+        return (products.product_at(index) for index in range(start, len(products)))
+
+
+def load_offer_rows():
+    columns = [getattr(Offer, name) for name in OfferRow._fields]
+    return [OfferRow(*row) for row in Offer.query.with_entities(*columns).order_by(Offer.id)]
+
+
+def _remove_snapshot_files(directory, older_than):
+    for path in glob.glob(os.path.join(directory, SNAPSHOT_FILE_PATTERN.format(version='*'))):
+        version = os.path.basename(path)[len('pricing-'):-len('.snapshot')]
+        if version.isdigit() and int(version) < older_than:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # another worker removed it first
+
+
+class PricingCache:
+    """Per-process read-through cache of the pricing table.
+
+    Readers get the current snapshot without touching the database. At most once
+    every `check_interval` seconds the cache reads the single-row pricing_version
+    table and reloads the snapshot only if another process has bumped it. With
+    `directory`, snapshots are memory-mapped files shared by the host's workers.
+    With `quantity_table_size`, each snapshot gets QuantityTables for hot products.
+    """
+
+    def __init__(self, check_interval=1.0, directory=None, quantity_table_size=0, quantity_table_products=0):
+        self.check_interval = check_interval
+        self.directory = directory
+        self.quantity_table_size = quantity_table_size
+        self.quantity_table_products = quantity_table_products
+        self._snapshot = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.revalidations = 0
+
+    def snapshot(self, min_version=None):
+        """Current snapshot; one older than `min_version` is revalidated before the check interval is up."""
+        snapshot = self._snapshot
+        fresh = snapshot is not None and (min_version is None or snapshot.version >= min_version)
+        if fresh and time.monotonic() < self._next_check:
+            self.hits += 1
+            return snapshot
+        with self._lock:
+            now = time.monotonic()
+            # Another thread may have reloaded while we waited for the lock, though maybe not to `min_version`
+            reloaded = self._snapshot is not snapshot
+            snapshot = self._snapshot
+            fresh = snapshot is not None and (min_version is None or snapshot.version >= min_version)
+            if fresh and now < self._next_check:
+                if reloaded:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                return snapshot
+            version = PricingVersion.current()
+            self.revalidations += 1
+            # Reads may run on a replica that lags the one the snapshot came from; never go back a version
+            if snapshot is not None and snapshot.version >= version:
+                self.hits += 1
+            else:
+                self.misses += 1
+                # The version is read before the rows, so a concurrent write can only cause an extra reload
+                previous, snapshot = snapshot, PricingSnapshot.load(version, self.directory)
+                if self.quantity_table_size > 0:
+                    snapshot.quantity_tables = (
+                        previous.quantity_tables.carry_over(snapshot.products) if previous is not None
+                        else QuantityTables(self.quantity_table_size, self.quantity_table_products)
+                    )
+                self._snapshot = snapshot
+                self.reloads += 1
+            self._next_check = now + self.check_interval
+            return snapshot
+
+    def invalidate(self):
+        # Called after a local write commits; forces a version check on the next read
+        self._next_check = 0.0
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'reloads': self.reloads,
+            'revalidations': self.revalidations,
+            'version': snapshot.version if snapshot is not None else None,
+            'products': len(snapshot.products) if snapshot is not None else 0,
+            'offers': len(snapshot.offers.rows) if snapshot is not None else 0,
+            'quantity_tables': len(snapshot.quantity_tables.tables) if snapshot is not None and snapshot.quantity_tables else 0,
+            'bytes': len(snapshot.products.buffer) if snapshot is not None else 0,
+            'mapped': snapshot is not None and isinstance(snapshot.products.buffer, mmap.mmap)
+        }
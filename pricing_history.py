@@ -0,0 +1,101 @@
+import json
+
+from sqlalchemy import func, insert, literal, or_, select
+
+from model import db, PricingChange, Product
+from offers import OfferEngine, OfferRow, offer_to_dict
+from pricing import compile_product
+
+UPSERT = 'upsert'
+DELETE = 'delete'
+
+
+def product_change(code, unit_price=None, special_price=None, op=UPSERT):
+    return {'op': op, 'code': code, 'unit_price': unit_price, 'special_price': special_price, 'offer_id': None, 'offer': None}
+
+
+def offer_change(offer_id, row=None):
+    """Change for an offer saved with column values `row`, or deleted when `row` is None."""
+    offer = json.dumps({name: row[name] for name in OfferRow._fields[1:]}, separators=(',', ':')) if row else None
+    return {'op': UPSERT if row else DELETE, 'code': None, 'unit_price': None, 'special_price': None,
+            'offer_id': offer_id, 'offer': offer}
+
+
+def record_changes(version, changes):
+    """Append changes committed at `version`; call after PricingVersion.bump() in the same transaction.
+
+    The bump holds the pricing_version row lock until commit, so log entries are
+    written in version order and a reader never sees a later seq commit before an earlier one.
+    """
+    if changes:
+        db.session.execute(insert(PricingChange.__table__), [dict(change, version=version) for change in changes])
+
+
+def record_replacement(connection, version, staging_table):
+    """Log the difference between the products table and a staged replacement, before it is swapped in."""
+    changes = PricingChange.__table__
+    products = Product.__table__
+    connection.execute(insert(changes).from_select(
+        ['version', 'op', 'code'],
+        select(literal(version), literal(DELETE), products.c.code)
+        # NOT IN lets both SQLite and Postgres hash the unindexed staging codes once
+        .where(products.c.code.not_in(select(staging_table.c.code)))
+    ))
+    connection.execute(insert(changes).from_select(
+        ['version', 'op', 'code', 'unit_price', 'special_price'],
+        select(literal(version), literal(UPSERT), staging_table.c.code, staging_table.c.unit_price, staging_table.c.special_price)
+        .select_from(staging_table.outerjoin(products, products.c.code == staging_table.c.code))
+        .where(or_(
+            products.c.code.is_(None),
+            products.c.unit_price != staging_table.c.unit_price,
+            products.c.special_price.is_distinct_from(staging_table.c.special_price)
+        ))
+    ))
+
+
+def changes_since(since, limit):
+    """Changes with seq > `since` in log order; also returns whether more follow."""
+    rows = (PricingChange.query.filter(PricingChange.seq > since)
+            .order_by(PricingChange.seq).limit(limit + 1).all())
+    return rows[:limit], len(rows) > limit
+
+
+def change_to_dict(change):
+    body = {'seq': change.seq, 'version': change.version, 'op': change.op}
+    if change.code is not None:
+        body['code'] = change.code
+        if change.op == UPSERT:
+            body['unit_price'] = change.unit_price
+            body['special_price'] = change.special_price
+    else:
+        body['offer_id'] = change.offer_id
+        if change.op == UPSERT:
+            body['offer'] = offer_to_dict(_offer_row(change))
+    return body
+
+
+def first_version():
+    """Oldest pricing version the log can rebuild, or None if it is empty."""
+    return db.session.execute(select(func.min(PricingChange.version))).scalar()
+
+
+def pricing_as_of(version, codes, chunk_size=1000):
+    """(products, OfferEngine) for `codes` as they were at pricing `version`, rebuilt from the change log."""
+    products = {}
+    for start in range(0, len(codes), chunk_size):
+        latest = _latest_changes(version, PricingChange.code.in_(codes[start:start + chunk_size]), PricingChange.code)
+        products.update((change.code, compile_product(change)) for change in latest if change.op == UPSERT)
+    offers = [_offer_row(change) for change in _latest_changes(version, PricingChange.offer_id.isnot(None), PricingChange.offer_id)
+              if change.op == UPSERT]
+    return products, OfferEngine(offers, products)
+
+
+def _latest_changes(version, condition, key):
+    # Last change per key at or before `version`
+    latest = (select(func.max(PricingChange.seq).label('seq'))
+              .where(condition, PricingChange.version <= version).group_by(key).subquery())
+    return db.session.execute(select(PricingChange).join(latest, PricingChange.seq == latest.c.seq)).scalars()
+
+
+def _offer_row(change):
+    return OfferRow(change.offer_id, **json.loads(change.offer))
@@ -0,0 +1,170 @@
+import csv
+import functools
+import io
+import json
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, insert, literal, select
+
+import json_codec
+from model import db, Product
+from offers import MAX_OFFER_QUANTITY
+from pricing import offer_columns, parse_offer
+from pricing_history import record_replacement
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+CSV_MIMETYPE = 'text/csv'
+CSV_FIELDS = ['code', 'unit_price', 'special_price']
+# Validated rows also carry the typed offer columns derived from special_price
+ROW_FIELDS = CSV_FIELDS + ['offer_qty', 'offer_price']
+# Longer codes would fail (or be truncated) on insert
+MAX_CODE_LENGTH = Product.code.type.length
+
+# Per-connection temporary table; uploads are loaded here before being swapped into products
+staging_table = Table(
+    'products_staging', MetaData(),
+    Column('code', String(10)),
+    Column('unit_price', Integer),
+    Column('special_price', String(50)),
+    Column('offer_qty', Integer),
+    Column('offer_price', Integer),
+    prefixes=['TEMPORARY']
+)
+
+
+class _RawReader(io.RawIOBase):
+    # gunicorn's wsgi.input only offers read(), which io.TextIOWrapper cannot wrap directly
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _text_stream(stream, **kwargs):
+    return io.TextIOWrapper(io.BufferedReader(_RawReader(stream)), encoding='utf-8', **kwargs)
+
+
+def read_ndjson(stream):
+    text = _text_stream(stream)
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json_codec.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON on line {line_number}: {e}")
+
+
+def read_csv(stream):
+    text = _text_stream(stream, newline='')
+    reader = csv.DictReader(text)
+    if reader.fieldnames is None or not {'code', 'unit_price'} <= set(reader.fieldnames):
+        raise ValueError("CSV header must include code and unit_price columns.")
+    try:
+        for row in reader:
+            # DictReader counts the header, so line_num is already the file line of this row
+            yield reader.line_num, row
+    except csv.Error as e:
+        raise ValueError(f"Invalid CSV on line {reader.line_num}: {e}")
+
+
+def read_json(products):
+    for index, product_data in enumerate(products, start=1):
+        yield index, product_data
+
+
+def validate_row(line_number, product_data):
+    """Check one uploaded product and return it as a products row; raises ValueError."""
+    # One pass over well-formed JSON rows; CSV text and anything unusual get the full checks
+    try:
+        code, unit_price = product_data['code'], product_data['unit_price']
+        special_price = product_data.get('special_price') or None
+        if type(code) is str and 0 < len(code) <= MAX_CODE_LENGTH and type(unit_price) is int and unit_price > 0:
+            return {'code': code, 'unit_price': unit_price, 'special_price': special_price, **_offer_columns(special_price)}
+    except (TypeError, KeyError, AttributeError, ValueError):
+        pass
+    return _validate_row(line_number, product_data)
+
+
+@functools.lru_cache(maxsize=4096)
+def _offer_columns(special_price):
+    # Catalogues repeat a few special prices, so each distinct one is parsed once; the dict is shared, so callers copy it
+    return offer_columns(parse_offer(special_price, MAX_OFFER_QUANTITY))
+
+
+def _validate_row(line_number, product_data):
+    if not isinstance(product_data, dict):
+        raise ValueError(f"Invalid product on line {line_number}: {product_data}")
+    code = product_data.get('code')
+    unit_price = product_data.get('unit_price')
+    special_price = product_data.get('special_price') or None
+    if not code or not unit_price:
+        raise ValueError(f"Missing code or unit price for product: {product_data}")
+    if not isinstance(code, str) or len(code) > MAX_CODE_LENGTH:
+        raise ValueError(f"Invalid code for product: {product_data}. Expected at most {MAX_CODE_LENGTH} characters.")
+    # A positive integer, as PATCH requires; CSV sends it as digits. Floats are not truncated
+    if isinstance(unit_price, str) and unit_price.strip().isascii() and unit_price.strip().isdigit():
+        unit_price = int(unit_price)
+    if type(unit_price) is not int or unit_price <= 0:
+        raise ValueError(f"Invalid unit price for product: {product_data}")
+    try:
+        offer = parse_offer(special_price, MAX_OFFER_QUANTITY)
+    except ValueError as e:
+        raise ValueError(f"{e} Product: {code}")
+    return {'code': code, 'unit_price': unit_price, 'special_price': special_price, **offer_columns(offer)}
+
+
+def replace_products(records, batch_size=5000, version=None):
+    """Replace the whole pricing table with validated rows from `records`.
+
+    Rows are validated one at a time and loaded into a temporary staging table in
+    batches (Postgres COPY, batched INSERTs elsewhere), so memory use is bounded by
+    `batch_size`. The swap into products happens at the end of the caller's
+    transaction: concurrent readers keep seeing the old table until it commits.
+    With `version`, only the products that are added, changed or removed are
+    written to the pricing change log at that version, and every row is stamped with it.
+    Raises ValueError on the first invalid row; nothing is written in that case.
+    """
+    connection = db.session.connection()
+    # A failed earlier import on this pooled connection may have left the table behind
+    staging_table.drop(connection, checkfirst=True)
+    staging_table.create(connection)
+    load = _copy_batch if connection.dialect.name == 'postgresql' else _insert_batch
+    batch = []
+    for line_number, product_data in records:
+        batch.append(validate_row(line_number, product_data))
+        if len(batch) >= batch_size:
+            load(connection, batch)
+            batch = []
+    if batch:
+        load(connection, batch)
+    count = connection.execute(select(db.func.count()).select_from(staging_table)).scalar()
+    if version is not None:
+        record_replacement(connection, version, staging_table)
+    connection.execute(Product.__table__.delete())
+    connection.execute(insert(Product.__table__).from_select(
+        ROW_FIELDS + ['version'], select(*staging_table.c, literal(version or 0))
+    ))
+    staging_table.drop(connection)
+    return count
+
+
+def _insert_batch(connection, rows):
+    connection.execute(insert(staging_table), rows)
+
+
+def _copy_batch(connection, rows):
+    buffer = io.StringIO()
+    csv.DictWriter(buffer, ROW_FIELDS).writerows(rows)
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {staging_table.name} ({', '.join(ROW_FIELDS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
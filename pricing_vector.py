@@ -0,0 +1,110 @@
+from pricing import CartError, merge_lines
+
+# numpy is optional and takes ~100 ms to import, so it is only loaded the first time
+# a cart is large enough to need it; callers fall back to the scalar path in pricing.py
+np = None
+_numpy_checked = False
+
+# Line totals and subtotals are int64 on this path; carts that could exceed it are priced by the scalar path
+INT64_MAX = 2 ** 63 - 1
+
+
+def available():
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+        _numpy_checked = True
+    return np is not None
+
+
+class VectorPricing:
+    """Pricing table as NumPy views over the snapshot's packed columns.
+
+    PackedProducts stores a product without an offer as a "1 for unit_price"
+    offer, so every line total is `(q // n) * p + (q % n) * u` with no branching.
+    Codes are resolved with one searchsorted over the sorted code column.
+    """
+
+    def __init__(self, snapshot):
+        products = snapshot.products
+        self.version = snapshot.version
+        self.code_width = products.code_width
+        # Zero-copy: the arrays share the snapshot's buffer (and, when mapped, its file pages)
+        self.codes = np.frombuffer(products.code_bytes, dtype=f'S{products.code_width}')
+        self.unit_price = np.frombuffer(products.unit_price, dtype=np.int64)
+        self.offer_count = np.frombuffer(products.offer_count, dtype=np.int64)
+        self.offer_price = np.frombuffer(products.offer_price, dtype=np.int64)
+        # No line costs more per unit than this, whether or not its offer applies
+        self.max_price = int(max(self.unit_price.max(), self.offer_price.max())) if len(self.codes) else 0
+
+    @classmethod
+    def for_snapshot(cls, snapshot):
+        # Built at most once per snapshot and kept alongside it until the next reload
+        if snapshot.vector is None:
+            snapshot.vector = cls(snapshot)
+        return snapshot.vector
+
+    def fits(self, carts):
+        """Whether the line totals and subtotals of validated `carts` (lists of items) all fit in int64."""
+        units = sum(item['quantity'] for items in carts for item in items)
+        return units * self.max_price <= INT64_MAX
+
+    def line_totals(self, product_ids, quantities):
+        counts = self.offer_count[product_ids]
+        bundles, remainder = np.divmod(quantities, counts)
+        return bundles * self.offer_price[product_ids] + remainder * self.unit_price[product_ids]
+
+    def price_cart(self, items, codes):
+        """Vectorized equivalent of pricing.price_cart for one validated cart."""
+        index = self.product_ids(codes)
+        self._check_codes(codes, index)
+        product_ids, quantities = self._line_arrays([merge_lines(items, codes)], index)
+        return int(self.line_totals(product_ids, quantities).sum())
+
+    def price_carts(self, carts):
+        """Price validated carts ({cart_id: (items, codes)}) in one pass; returns (subtotals, errors)."""
+        subtotals = {}
+        errors = {}
+        priced = {}
+        index = self.product_ids(list(dict.fromkeys(code for _, codes in carts.values() for code in codes)))
+        for cart_id, (items, codes) in carts.items():
+            try:
+                self._check_codes(codes, index)
+            except CartError as e:
+                errors[cart_id] = e.to_dict()
+                continue
+            if items:
+                priced[cart_id] = merge_lines(items, codes)
+            else:
+                subtotals[cart_id] = 0
+        if priced:
+            product_ids, quantities = self._line_arrays(priced.values(), index)
+            # Lines are laid out cart after cart, so each cart is one contiguous segment
+            offsets = np.cumsum([0] + [len(items) for items in priced.values()][:-1])
+            totals = np.add.reduceat(self.line_totals(product_ids, quantities), offsets)
+            subtotals.update(zip(priced, totals.tolist()))
+        return subtotals, errors
+
+    def product_ids(self, codes):
+        """{code: product id} for those of the distinct `codes` that are in the table."""
+        keys = [(code, code.encode()) for code in codes if isinstance(code, str)]
+        keys = [(code, key) for code, key in keys if len(key) <= self.code_width]
+        if not keys or not len(self.codes):
+            return {}
+        wanted = np.array([key for _, key in keys], dtype=self.codes.dtype)
+        positions = np.minimum(np.searchsorted(self.codes, wanted), len(self.codes) - 1)
+        found = self.codes[positions] == wanted
+        return {code: position for (code, _), position, hit in zip(keys, positions.tolist(), found.tolist()) if hit}
+
+    def _check_codes(self, codes, index):
+        missing_codes = [code for code in codes if code not in index]
+        if missing_codes:
+            raise CartError(f"Products with codes {', '.join(missing_codes)} not found.", 404, missing_codes)
+
+    def _line_arrays(self, carts, index):
+        product_ids = np.fromiter((index[item['code']] for items in carts for item in items), dtype=np.int64)
+        quantities = np.fromiter((item['quantity'] for items in carts for item in items), dtype=np.int64)
+        return product_ids, quantities
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+# Rough per-entry bookkeeping cost (OrderedDict node, tuple, float) counted towards max_bytes
+ENTRY_OVERHEAD = 200
+
+
+def normalize_cart(items):
+    """Merge duplicate codes and sort, so equivalent baskets share one quote."""
+    quantities = {}
+    for item in items:
+        quantities[item['code']] = quantities.get(item['code'], 0) + item['quantity']
+    return sorted(quantities.items())
+
+
+def quote_key(lines, version):
+    canonical = json.dumps([version, lines], separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class QuoteCache:
+    """Bounded LRU of priced quotes with a TTL, optionally backed by a shared store.
+
+    Entries are evicted least-recently-used first when either `max_entries` or
+    `max_bytes` would be exceeded, and expire `ttl` seconds after being stored.
+    With a shared backend (Redis), local misses fall through to it so gunicorn
+    workers reuse each other's quotes.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=8 * 1024 * 1024, ttl=300, backend=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(value)
+                self._remove(key)
+                self.expirations += 1
+        if self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                self._store(key, value)
+                with self._lock:
+                    self.shared_hits += 1
+                return json.loads(value)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, quote):
+        value = json.dumps(quote, separators=(',', ':')).encode()
+        self._store(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value, self.ttl)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'shared': self.backend is not None
+            }
+
+    def _store(self, key, value):
+        size = len(key) + len(value) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while self._entries and (len(self._entries) >= self.max_entries or self._bytes + size > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._bytes += size
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(key) + len(value) + ENTRY_OVERHEAD
+
+
+class RedisQuoteBackend:
+    """Shared quote store; needs the optional `redis` package."""
+
+    def __init__(self, url, prefix='quote:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("QUOTE_CACHE_REDIS_URL is set but the redis package is not installed (pip install redis).")
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._errors = redis.RedisError
+
+    def get(self, key):
+        # An unreachable Redis degrades to per-worker caching rather than failing quotes
+        try:
+            return self._client.get(self._prefix + key)
+        except self._errors as e:
+            logging.getLogger(__name__).warning("Quote cache backend unavailable: %s", e)
+            return None
+
+    def set(self, key, value, ttl):
+        try:
+            self._client.set(self._prefix + key, value, ex=max(1, int(ttl)))
+        except self._errors as e:
+            logging.getLogger(__name__).warning("Quote cache backend unavailable: %s", e)
@@ -0,0 +1,113 @@
+import itertools
+import logging
+import time
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.dml import UpdateBase
+
+BIND_PREFIX = 'replica_'
+
+
+def replica_binds(uris):
+    """SQLALCHEMY_BINDS entries for the replica URIs, keyed replica_0, replica_1, ..."""
+    return {f'{BIND_PREFIX}{index}': uri for index, uri in enumerate(uris)}
+
+
+class RoutingSession(Session):
+    """Session that runs reads on the replica chosen for the request (g.read_replica).
+
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary, so a
+    write made by mistake on a read-only route is never lost on a replica.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase) and has_app_context():
+            key = g.get('read_replica')
+            if key is not None:
+                return self._db.engines[key]
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+class _Replica:
+    __slots__ = ('engine', 'version', 'checked_at', 'down_until', 'reads')
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.version = -1
+        self.checked_at = float('-inf')
+        self.down_until = 0.0
+        self.reads = 0
+
+
+class ReplicaPool:
+    """Round-robin choice among healthy replicas for one worker process.
+
+    A replica's pricing version is read at most every `check_interval` seconds,
+    which doubles as a health check. A replica that fails the check or drops a
+    connection is skipped for `retry_interval` seconds. choose(min_version) only
+    returns a replica that has replayed at least that pricing version, re-reading
+    a lagging one once before moving on, so a client that sends back the version
+    of its last write always reads that write.
+    """
+
+    def __init__(self, engines, check_interval=1.0, retry_interval=10.0):
+        self.check_interval = check_interval
+        self.retry_interval = retry_interval
+        self._replicas = {key: _Replica(engine) for key, engine in engines.items()}
+        self._keys = list(self._replicas)
+        self._turn = itertools.count()
+        self.primary_reads = 0
+        for key, replica in self._replicas.items():
+            event.listen(replica.engine, 'handle_error', lambda context, key=key: self._on_error(key, context))
+
+    def choose(self, min_version=None):
+        """Bind key of the replica to read from, or None to read from the primary."""
+        if self._keys:
+            start = next(self._turn)
+            for offset in range(len(self._keys)):
+                key = self._keys[(start + offset) % len(self._keys)]
+                if self._usable(self._replicas[key], min_version):
+                    self._replicas[key].reads += 1
+                    return key
+        self.primary_reads += 1
+        return None
+
+    def mark_down(self, key):
+        self._replicas[key].down_until = time.monotonic() + self.retry_interval
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'primary_reads': self.primary_reads,
+            'replicas': {
+                key: {'healthy': now >= replica.down_until, 'version': replica.version, 'reads': replica.reads}
+                for key, replica in self._replicas.items()
+            }
+        }
+
+    def _usable(self, replica, min_version):
+        now = time.monotonic()
+        if now < replica.down_until:
+            return False
+        behind = min_version is not None and replica.version < min_version
+        if behind or now - replica.checked_at >= self.check_interval:
+            self._check(replica, now)
+        return now >= replica.down_until and (min_version is None or replica.version >= min_version)
+
+    def _check(self, replica, now):
+        try:
+            with replica.engine.connect() as connection:
+                version = connection.execute(text('SELECT version FROM pricing_version WHERE id = 1')).scalar()
+        except SQLAlchemyError as e:
+            logging.getLogger(__name__).warning("Read replica %s unavailable: %s", replica.engine.url, e)
+            replica.down_until = now + self.retry_interval
+            return
+        replica.version = version or 0
+        replica.checked_at = now
+
+    def _on_error(self, key, context):
+        if context.is_disconnect:
+            self.mark_down(key)
@@ -0,0 +1,210 @@
+import csv
+import io
+import json
+import os
+import time
+from collections import deque
+from itertools import groupby, islice
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from model import PricingVersion
+from offers import OfferEngine
+from pricing import CartError, PackedProducts, PricingSnapshot, cart_codes, merge_lines, price_cart
+
+# Set in each pool process by _init_worker
+_table = None
+
+
+class SharedPricingTable:
+    """Packed pricing snapshot copied once into a shared memory block.
+
+    Worker processes attach to the block by name, so the table is written once
+    instead of being pickled with every task. Each process adds a code -> row
+    dict for constant-time lookups while it prices millions of lines. The few
+    offer rows travel with the pool's init arguments and are compiled per process.
+    """
+
+    def __init__(self, shm, offer_rows, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self.products = PackedProducts(shm.buf)
+        self.index = {code: product_id for product_id, code in enumerate(self.products)}
+        self.offers = OfferEngine(offer_rows, self.products)
+
+    @classmethod
+    def create(cls, snapshot):
+        # multiprocessing is imported here rather than at module level, which would slow down every app start
+        from multiprocessing import shared_memory
+        buffer = snapshot.products.buffer
+        shm = shared_memory.SharedMemory(create=True, size=len(buffer))
+        shm.buf[:len(buffer)] = buffer
+        return cls(shm, snapshot.offers.rows, owner=True)
+
+    @classmethod
+    def attach(cls, name, offer_rows):
+        from multiprocessing import shared_memory
+        return cls(shared_memory.SharedMemory(name=name), offer_rows)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def price_cart(self, items, codes):
+        missing_codes = [code for code in codes if code not in self.index]
+        if missing_codes:
+            raise CartError(f"Products with codes {', '.join(missing_codes)} not found.", 404, missing_codes)
+        if self.offers.applies_to(codes):
+            return price_cart(items, codes, self.products, self.offers)
+        products = self.products
+        total = 0
+        for item in merge_lines(items, codes):
+            product_id = self.index[item['code']]
+            # No offer is packed as "1 for unit_price", so one formula covers every product
+            bundles, remainder = divmod(item['quantity'], products.offer_count[product_id])
+            total += bundles * products.offer_price[product_id] + remainder * products.unit_price[product_id]
+        return total
+
+    def close(self):
+        self.products.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def read_orders(stream, input_format):
+    """Yield (line_number, order) from NDJSON ({"order_id", "items"}) or CSV (order_id,code,quantity) input.
+
+    NDJSON lines are yielded undecoded, so parsing happens in the pool processes
+    rather than in the single reader. CSV rows of one order must be consecutive
+    and are grouped into an order dict here.
+    """
+    if input_format == 'csv':
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline=''))
+        if reader.fieldnames is None or not {'order_id', 'code', 'quantity'} <= set(reader.fieldnames):
+            raise ValueError("CSV header must include order_id, code and quantity columns.")
+        for order_id, rows in groupby(reader, key=lambda row: row['order_id']):
+            line_number = reader.line_num
+            items = []
+            for row in rows:
+                quantity = row['quantity']
+                if row['code'] is None or quantity is None:
+                    # A short row; like a malformed NDJSON line, it stops the job
+                    raise ValueError(f"Invalid order on line {reader.line_num}: expected order_id, code and quantity.")
+                items.append({'code': row['code'], 'quantity': int(quantity) if quantity.isdigit() else quantity})
+            yield line_number, {'order_id': order_id, 'items': items}
+    else:
+        for line_number, line in enumerate(stream, start=1):
+            if line.strip():
+                yield line_number, line
+
+
+def price_chunk(orders):
+    """Price a chunk of orders in a pool process; returns (NDJSON output, error count).
+
+    Raises ValueError for an NDJSON line that is not an order object.
+    """
+    lines = []
+    errors = 0
+    for line_number, order in orders:
+        if isinstance(order, bytes):
+            try:
+                order = json.loads(order)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON on line {line_number}: {e}")
+        if not isinstance(order, dict) or 'order_id' not in order:
+            raise ValueError(f"Invalid order on line {line_number}: expected an object with order_id and items.")
+        order_id, items = order['order_id'], order.get('items')
+        try:
+            result = {'order_id': order_id, 'subtotal': _table.price_cart(items, cart_codes(items))}
+        except CartError as e:
+            result = dict(e.to_dict(), order_id=order_id)
+            errors += 1
+        lines.append(json.dumps(result, separators=(',', ':')))
+    return ''.join(line + '\n' for line in lines), errors
+
+
+def reprice_orders(snapshot, orders, output, workers=1, chunk_size=2000):
+    """Price every order from read_orders against `snapshot`, writing NDJSON results in input order.
+
+    Orders are read and results written as a stream; at most two chunks per
+    worker are in flight, so memory use does not grow with the input.
+    Returns {'orders', 'errors'} counts.
+    """
+    global _table
+    table = SharedPricingTable.create(snapshot)
+    counts = {'orders': 0, 'errors': 0}
+
+    def write(result):
+        text, errors = result
+        output.write(text)
+        counts['errors'] += errors
+
+    try:
+        chunks = iter(lambda: list(islice(orders, chunk_size)), [])
+        if workers <= 1:
+            _table = table
+            try:
+                for chunk in chunks:
+                    counts['orders'] += len(chunk)
+                    write(price_chunk(chunk))
+            finally:
+                _table = None
+            return counts
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(table.name, table.offers.rows)) as pool:
+            pending = deque()
+            for chunk in chunks:
+                counts['orders'] += len(chunk)
+                pending.append(pool.submit(price_chunk, chunk))
+                if len(pending) >= 2 * workers:
+                    write(pending.popleft().result())
+            while pending:
+                write(pending.popleft().result())
+        return counts
+    finally:
+        table.close()
+
+
+def _init_worker(name, offer_rows):
+    global _table
+    _table = SharedPricingTable.attach(name, offer_rows)
+
+
+@click.command('reprice')
+@click.argument('input_file', type=click.File('rb'))
+@click.argument('output_file', type=click.File('w'), default='-')
+@click.option('--format', 'input_format', type=click.Choice(['ndjson', 'csv']),
+              help='Input format; defaults to csv for .csv files and ndjson otherwise.')
+@click.option('--workers', type=int, help='Pricing processes (default REPRICE_WORKERS, 0 = one per CPU).')
+@click.option('--chunk-size', type=int, help='Orders per task (default REPRICE_CHUNK_SIZE).')
+@with_appcontext
+def reprice_command(input_file, output_file, input_format, workers, chunk_size):
+    """Price historical orders from INPUT_FILE against the current pricing table.
+
+    Writes one {"order_id", "subtotal"} (or {"order_id", "error"}) JSON line per
+    order to OUTPUT_FILE (stdout by default).
+    """
+    if input_format is None:
+        input_format = 'csv' if input_file.name.endswith('.csv') else 'ndjson'
+    if workers is None:
+        workers = current_app.config['REPRICE_WORKERS']
+    workers = workers or os.cpu_count() or 1
+    chunk_size = chunk_size or current_app.config['REPRICE_CHUNK_SIZE']
+
+    # The version is read before the rows, like PricingCache, so the reported version is never newer than the prices
+    version = PricingVersion.current()
+    snapshot = PricingSnapshot.load(version, current_app.config['PRICING_SNAPSHOT_DIR'])
+    start = time.perf_counter()
+    try:
+        counts = reprice_orders(snapshot, read_orders(input_file, input_format), output_file, workers, chunk_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    elapsed = time.perf_counter() - start
+    click.echo(
+        f"Priced {counts['orders']} orders ({counts['errors']} errors) at pricing version {version} "
+        f"with {workers} workers in {elapsed:.1f}s ({counts['orders'] / max(elapsed, 1e-9):.0f} orders/s).",
+        err=True
+    )
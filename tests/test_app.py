@@ -8,15 +8,24 @@ import unittest
 import HtmlTestRunner
 from unittest.mock import patch, MagicMock
 from app import create_app
-from model import Product, db
+from config import TestConfig
+from model import Product, PricingVersion, db
+
+class MockedQueryConfig(TestConfig):
+    # these tests mock `Product.query`, so bypass the pricing snapshot cache
+    PRICING_CACHE_ENABLED = False
 
 class ShoppingCartTestCase(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        cls.app = create_app()
+        cls.app = create_app(MockedQueryConfig)
         cls.app.testing = True
         cls.client = cls.app.test_client()
+        with cls.app.app_context():
+            db.create_all()
+            db.session.add(PricingVersion(id=1, version=0))
+            db.session.commit()
 
     def setUp(self):
         # set up app context
@@ -54,30 +63,31 @@ class ShoppingCartTestCase(unittest.TestCase):
         mock_product_A = MagicMock(spec=Product)
         mock_product_A.unit_price = 50
         mock_product_A.special_price = "3 for 140"
+        mock_product_A.offer_qty = 3
+        mock_product_A.offer_price = 140
 
         mock_product_B = MagicMock(spec=Product)
         mock_product_B.unit_price = 35
         mock_product_B.special_price = "2 for 60"
+        mock_product_B.offer_qty = 2
+        mock_product_B.offer_price = 60
 
         mock_product_C = MagicMock(spec=Product)
         mock_product_C.unit_price = 25
         mock_product_C.special_price = None
+        mock_product_C.offer_qty = None
+        mock_product_C.offer_price = None
 
         mock_product_D = MagicMock(spec=Product)
         mock_product_D.unit_price = 12
         mock_product_D.special_price = None
+        mock_product_D.offer_qty = None
+        mock_product_D.offer_price = None
 
-        # 模拟查询结果
-        def filter_by_code(code):
-            return {
-                'A': mock_product_A,
-                'B': mock_product_B,
-                'C': mock_product_C,
-                'D': mock_product_D
-            }.get(code, None)
-
-        # Mock `filter_by` 和 `first`
-        mock_query.filter_by.side_effect = lambda **kwargs: MagicMock(first=lambda: filter_by_code(kwargs['code']))
+        # mock the batched `filter(code IN ...)` lookup
+        for code, product in zip('ABCD', [mock_product_A, mock_product_B, mock_product_C, mock_product_D]):
+            product.code = code
+        mock_query.filter.return_value.all.return_value = [mock_product_A, mock_product_B, mock_product_C, mock_product_D]
 
         # test subtotal calculation
         response = self.client.post('/api/subtotal', json=[
@@ -100,30 +110,31 @@ class ShoppingCartTestCase(unittest.TestCase):
         mock_product_A = MagicMock(spec=Product)
         mock_product_A.unit_price = 40
         mock_product_A.special_price = "3 for 100"
+        mock_product_A.offer_qty = 3
+        mock_product_A.offer_price = 100
 
         mock_product_B = MagicMock(spec=Product)
         mock_product_B.unit_price = 60
         mock_product_B.special_price = "2 for 60"
+        mock_product_B.offer_qty = 2
+        mock_product_B.offer_price = 60
 
         mock_product_C = MagicMock(spec=Product)
         mock_product_C.unit_price = 77
         mock_product_C.special_price = None
+        mock_product_C.offer_qty = None
+        mock_product_C.offer_price = None
 
         mock_product_D = MagicMock(spec=Product)
         mock_product_D.unit_price = 66
         mock_product_D.special_price = None
+        mock_product_D.offer_qty = None
+        mock_product_D.offer_price = None
 
-        # mock query results
-        def filter_by_code(code):
-            return {
-                'A': mock_product_A,
-                'B': mock_product_B,
-                'C': mock_product_C,
-                'D': mock_product_D
-            }.get(code, None)
-
-        # Mock `filter_by` 和 `first`
-        mock_query.filter_by.side_effect = lambda **kwargs: MagicMock(first=lambda: filter_by_code(kwargs['code']))
+        # mock the batched `filter(code IN ...)` lookup
+        for code, product in zip('ABCD', [mock_product_A, mock_product_B, mock_product_C, mock_product_D]):
+            product.code = code
+        mock_query.filter.return_value.all.return_value = [mock_product_A, mock_product_B, mock_product_C, mock_product_D]
 
         # mock data to prevent database access
         response = self.client.post('/api/subtotal', json=[
@@ -142,18 +153,48 @@ class ShoppingCartTestCase(unittest.TestCase):
         self.assertEqual(data['subtotal'], expected_subtotal)
 
     @patch('model.Product.query')
-    @patch('model.db.session.commit')
-    @patch('model.db.session.add')
-    def test_put_pricing_table(self, mock_add, mock_commit, mock_query):
-        # Mock existing products
+    def test_subtotal_products_looked_up_once(self, mock_query):
         mock_product_A = MagicMock(spec=Product)
         mock_product_A.code = 'A'
-        mock_product_B = MagicMock(spec=Product)
-        mock_product_B.code = 'B'
+        mock_product_A.unit_price = 50
+        mock_product_A.special_price = "3 for 140"
+        mock_product_A.offer_qty = 3
+        mock_product_A.offer_price = 140
+        mock_query.filter.return_value.all.return_value = [mock_product_A]
+
+        response = self.client.post('/api/subtotal', json=[
+            {"code": "A", "quantity": 2},
+            {"code": "A", "quantity": 1}
+        ])
+
+        # duplicate codes resolve through a single lookup, and their lines are priced as one
+        self.assertEqual(response.get_json()['subtotal'], 140)
+        mock_query.filter.assert_called_once()
+        mock_query.filter_by.assert_not_called()
+
+    @patch('model.Product.query')
+    def test_subtotal_reports_all_missing_codes(self, mock_query):
+        mock_product_A = MagicMock(spec=Product)
+        mock_product_A.code = 'A'
+        mock_product_A.unit_price = 50
+        mock_product_A.special_price = None
+        mock_product_A.offer_qty = None
+        mock_product_A.offer_price = None
+        mock_query.filter.return_value.all.return_value = [mock_product_A]
 
-        # Mock query result for existing product A
-        mock_query.filter_by.side_effect = lambda code: MagicMock(first=lambda: mock_product_A if code == 'A' else None)
+        response = self.client.post('/api/subtotal', json=[
+            {"code": "X", "quantity": 1},
+            {"code": "A", "quantity": 1},
+            {"code": "Y", "quantity": 2}
+        ])
 
+        data = response.get_json()
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(data['missing_codes'], ['X', 'Y'])
+
+    @patch('model.Product.upsert_many')
+    @patch('model.db.session.commit')
+    def test_put_pricing_table(self, mock_commit, mock_upsert):
         # Send PUT request to update pricing table
         response = self.client.put('/api/pricing', json=[
             {"code": "A", "unit_price": 55, "special_price": "3 for 145"},
@@ -167,23 +208,20 @@ class ShoppingCartTestCase(unittest.TestCase):
         self.assertIn('message', data)
         self.assertEqual(data['message'], 'Pricing table updated successfully')
 
-        # Verify that session.add() was called once for product B (since it's new)
-        mock_add.assert_called_once()
+        # Verify that both products were written in one bulk upsert
+        mock_upsert.assert_called_once()
+        self.assertEqual([row['code'] for row in mock_upsert.call_args.args[0]], ['A', 'B'])
 
         # Verify that session.commit() was called
         mock_commit.assert_called_once()
 
-    @patch('model.Product.query')
+    @patch('model.Product.patch_many')
     @patch('model.db.session.commit')
-    def test_patch_product(self, mock_commit, mock_query):
-        # Mock existing product
-        mock_product = MagicMock(spec=Product)
-        mock_product.code = 'A'
-        mock_product.unit_price = 50
-        mock_product.special_price = '3 for 140'
-
-        # Mock query result for product A
-        mock_query.filter_by.side_effect = lambda code: MagicMock(first=lambda: mock_product)
+    def test_patch_product(self, mock_commit, mock_patch_many):
+        # Mock the patched row of product A
+        mock_patch_many.side_effect = lambda patches, version: [
+            (200, {'code': 'A', 'unit_price': 50, 'special_price': '3 for 150', 'version': version})
+        ]
 
         # Send PATCH request to update product A partially
         response = self.client.patch('/api/pricing/A', json={"special_price": "3 for 150"})
@@ -195,8 +233,8 @@ class ShoppingCartTestCase(unittest.TestCase):
         self.assertIn('message', data)
         self.assertEqual(data['message'], 'Product A updated successfully')
 
-        # Verify that product's special price was updated
-        self.assertEqual(mock_product.special_price, '3 for 150')
+        # Verify that only the special price, with its offer columns, was written
+        self.assertEqual(mock_patch_many.call_args.args[0], [('A', {'special_price': '3 for 150', 'offer_qty': 3, 'offer_price': 150}, None)])
 
         # Verify that session.commit() was called
         mock_commit.assert_called_once()
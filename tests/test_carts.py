@@ -0,0 +1,119 @@
+import sys
+import os
+
+# add the root directory to the sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import tempfile
+import unittest
+from unittest.mock import patch
+from app import create_app
+from cart_store import Cart, CartStore
+from config import TestConfig
+from model import Product, db
+import pricing
+
+class CartStoreTestCase(unittest.TestCase):
+
+    def test_idle_carts_evicted(self):
+        store = CartStore(idle_timeout=60)
+        with patch('cart_store.time.monotonic', return_value=100.0):
+            store.put(Cart('old', 0))
+        with patch('cart_store.time.monotonic', return_value=130.0):
+            store.put(Cart('new', 0))
+        with patch('cart_store.time.monotonic', return_value=170.0):
+            self.assertIsNone(store.get('old'))
+            self.assertIsNotNone(store.get('new'))
+        self.assertEqual(store.stats(), {'carts': 1, 'evictions': 1})
+
+    def test_max_carts(self):
+        store = CartStore(max_carts=2)
+        for cart_id in ('a', 'b', 'c'):
+            store.put(Cart(cart_id, 0))
+        self.assertIsNone(store.get('a'))
+        self.assertEqual(store.stats()['carts'], 2)
+
+class CartSessionTestCase(unittest.TestCase):
+
+    config = TestConfig
+
+    def setUp(self):
+        self.app = create_app(self.config)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add_all([Product('A', 50, '3 for 140'), Product('B', 35, '2 for 60'), Product('C', 25)])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_cart(self, items):
+        response = self.client.post('/api/carts', json={'items': items})
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()
+
+    def test_cart_lifecycle(self):
+        cart = self.create_cart([{"code": "A", "quantity": 2}, {"code": "A", "quantity": 1}])
+        self.assertEqual(cart['subtotal'], 140)
+        url = f"/api/carts/{cart['cart_id']}"
+
+        cart = self.client.post(f'{url}/items', json={"code": "B", "quantity": 2}).get_json()
+        self.assertEqual(cart['subtotal'], 200)
+        cart = self.client.put(f'{url}/items/A', json={"quantity": 4}).get_json()
+        self.assertEqual(cart['subtotal'], 190 + 60)
+        cart = self.client.delete(f'{url}/items/B').get_json()
+        self.assertEqual(cart['items'], [{'code': 'A', 'quantity': 4, 'total': 190}])
+        self.assertEqual(self.client.get(url).get_json()['subtotal'], 190)
+
+        self.assertEqual(self.client.put(f'{url}/items/Z', json={"quantity": 1}).status_code, 404)
+        self.assertEqual(self.client.delete(url).status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_update_prices_only_touched_line(self):
+        cart = self.create_cart([{"code": "A", "quantity": 3}, {"code": "B", "quantity": 1}, {"code": "C", "quantity": 5}])
+        with patch('cart_store.item_total', wraps=pricing.item_total) as priced:
+            self.client.put(f"/api/carts/{cart['cart_id']}/items/C", json={"quantity": 6})
+        self.assertEqual(priced.call_count, 1)
+
+    def test_pricing_change_reprices_cart(self):
+        cart = self.create_cart([{"code": "A", "quantity": 3}, {"code": "C", "quantity": 1}])
+        self.client.patch('/api/pricing/A', json={"special_price": "3 for 120"})
+        self.client.delete('/api/pricing', json=['C'])
+        body = self.client.get(f"/api/carts/{cart['cart_id']}").get_json()
+        self.assertEqual(body['subtotal'], 120)
+        self.assertEqual(body['removed_codes'], ['C'])
+
+    def test_duplicate_cart_id(self):
+        self.assertEqual(self.client.post('/api/carts', json={'cart_id': 'basket-1'}).status_code, 201)
+        self.assertEqual(self.client.post('/api/carts', json={'cart_id': 'basket-1'}).status_code, 409)
+
+class PersistentCartSessionTestCase(CartSessionTestCase):
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.config = type('PersistentCartConfig', (TestConfig,), {
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{self.db_path}',
+            'CART_PERSISTENCE_ENABLED': True
+        })
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        os.remove(self.db_path)
+
+    def test_cart_shared_between_workers(self):
+        cart = self.create_cart([{"code": "A", "quantity": 1}])
+        url = f"/api/carts/{cart['cart_id']}"
+        other_worker = create_app(self.config).test_client()
+
+        self.assertEqual(other_worker.post(f'{url}/items', json={"code": "A", "quantity": 2}).get_json()['subtotal'], 140)
+        # the first worker notices the newer revision and reloads
+        self.assertEqual(self.client.post(f'{url}/items', json={"code": "C", "quantity": 1}).get_json()['subtotal'], 165)
+
+if __name__ == '__main__':
+    unittest.main()
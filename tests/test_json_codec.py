@@ -0,0 +1,57 @@
+import sys
+import os
+
+# add the root directory to the sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+import json_codec
+from app import create_app
+from config import TestConfig
+from model import Product, db
+
+class JsonCodecTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add_all([Product('A', 50, '3 for 140'), Product('B', 35)])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @unittest.skipUnless(json_codec.available(), 'orjson is not installed')
+    def test_orjson_provider(self):
+        self.assertIsInstance(self.app.json, json_codec.OrjsonProvider)
+        # A subtotal beyond 64 bits is encoded by the standard library instead
+        response = self.client.post('/api/subtotal', json=[{"code": "B", "quantity": 2 ** 62}])
+        self.assertEqual(response.get_json(), {'subtotal': 35 * 2 ** 62})
+        self.assertEqual(response.data, f'{{"subtotal":{35 * 2 ** 62}}}\n'.encode())
+        response = self.client.post('/api/subtotal', data='[{"code": "B", "quantity": 100000000000000000000}]',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.put('/api/pricing', data='[{"code": ', content_type='application/json').status_code, 400)
+        self.assertEqual(self.app.json.dumps({2: 'b', 1: 'a'}), '{"1":"a","2":"b"}')
+
+    def test_request_schemas(self):
+        response = self.client.post('/api/subtotal', json=[{"code": "A", "quantity": 3}, {"code": 7, "quantity": 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid code', response.get_json()['error'])
+        self.assertEqual(self.client.post('/api/subtotal', json=[{"code": "A", "quantity": 0}]).status_code, 400)
+
+        response = self.client.put('/api/pricing', json=[{"code": "C", "unit_price": "12"}, {"code": "D", "unit_price": 9, "special_price": "2 for 15"}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(db.session.get(Product, 'C').unit_price, 12)
+        response = self.client.put('/api/pricing', json=[{"code": "E", "unit_price": "twelve"}])
+        self.assertEqual(response.status_code, 400)
+        response = self.client.put('/api/pricing', json=[{"code": "E", "unit_price": 10, "special_price": "2 for"}])
+        self.assertIn('Product: E', response.get_json()['error'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import sys
+import os
+
+# add the root directory to the sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from app import create_app
+from config import TestConfig
+from metrics import Histogram
+from model import Product, db
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(type('NoCacheConfig', (TestConfig,), {'PRICING_CACHE_ENABLED': False}))
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add(Product('A', 50, '3 for 140'))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_histogram_render(self):
+        histogram = Histogram('h', 'Test.', (1, 5), ('route',))
+        histogram.observe(0.5, '/a')
+        histogram.observe(3, '/a')
+        histogram.observe(9, '/a')
+        self.assertEqual(histogram.render(), [
+            '# HELP h Test.',
+            '# TYPE h histogram',
+            'h_bucket{route="/a",le="1"} 1',
+            'h_bucket{route="/a",le="5"} 2',
+            'h_bucket{route="/a",le="+Inf"} 3',
+            'h_sum{route="/a"} 12.5',
+            'h_count{route="/a"} 3'
+        ])
+
+    def test_metrics_endpoint(self):
+        self.client.post('/api/subtotal', json=[{"code": "A", "quantity": 3}, {"code": "A", "quantity": 1}])
+        body = self.client.get('/metrics').get_data(as_text=True)
+
+        self.assertIn('http_request_duration_seconds_count{method="POST",endpoint="/api/subtotal",status="200"} 1', body)
+        # one IN (...) lookup for the cart and one read of the offers table
+        self.assertIn('db_queries_per_request_bucket{method="POST",endpoint="/api/subtotal",le="2"} 1', body)
+        self.assertIn('cart_lines_bucket{endpoint="/api/subtotal",le="5"} 1', body)
+        self.assertIn('pricing_cache_hits_total 0', body)
+
+    def test_metrics_disabled(self):
+        app = create_app(type('NoMetricsConfig', (TestConfig,), {'METRICS_ENABLED': False}))
+        self.assertEqual(app.test_client().get('/metrics').status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
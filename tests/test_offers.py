@@ -0,0 +1,183 @@
+import sys
+import os
+
+# add the root directory to the sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import itertools
+import json
+import random
+import time
+import unittest
+from unittest.mock import patch
+from sqlalchemy.exc import IntegrityError
+from app import create_app
+from config import TestConfig
+from model import Product, db
+from offers import MAX_OFFER_QUANTITY, OfferEngine, OfferRow, TierTable, validate_offer
+from pricing import OfferRule, ProductPrice
+
+def brute_force_tiers(unit_price, tiers, quantity):
+    costs = [0] + [None] * quantity
+    for q in range(1, quantity + 1):
+        costs[q] = min(costs[q - count] + price for count, price in tiers + [(1, unit_price)] if count <= q)
+    return costs[quantity]
+
+class OfferEngineTestCase(unittest.TestCase):
+
+    def test_tier_table_matches_dynamic_programming(self):
+        rng = random.Random(7)
+        for _ in range(200):
+            unit_price = rng.randint(5, 60)
+            tiers = [(count, rng.randint(count * unit_price // 2, count * unit_price)) for count in rng.sample(range(2, 9), 2)]
+            table = TierTable(unit_price, tiers)
+            for quantity in range(0, 3 * table.limit + 10):
+                self.assertEqual(table.total(quantity), brute_force_tiers(unit_price, tiers, quantity))
+
+    def test_large_tiers_stay_bounded(self):
+        start = time.perf_counter()
+        table = TierTable(50, [(MAX_OFFER_QUANTITY, 1), (MAX_OFFER_QUANTITY - 1, 2)])
+        self.assertLessEqual(len(table.costs), MAX_OFFER_QUANTITY ** 2 + 1)
+        self.assertEqual(table.total(10 ** 6), 10 ** 6 // MAX_OFFER_QUANTITY)
+        # A tier stored before the cap is left out instead of growing the table to 10**8 entries
+        table = TierTable(50, [(10000, 1)])
+        self.assertEqual(table.total(3), 150)
+        self.assertLess(time.perf_counter() - start, 5)
+
+    def test_buy_get_and_special_price_tiers(self):
+        products = {'A': ProductPrice('A', 50, '3 for 140', OfferRule(3, 140))}
+        offers = [OfferRow(1, 'buy_get', 'A', 4, 2, None, None), OfferRow(2, 'multi_buy', 'Z', 2, None, 1, None)]
+        engine = OfferEngine(offers, products)
+        # 6 for 200 (buy 4 get 2 free) beats 3 for 140; 9 = 6 + 3
+        self.assertEqual(engine.line_total(products['A'], 9), 200 + 140)
+        self.assertEqual(engine.cart_total({'A': 2}, products), 100)
+        self.assertEqual(list(engine.tables), ['A'])
+
+    def test_bundles_match_brute_force(self):
+        products = {
+            'A': ProductPrice('A', 50, '3 for 140', OfferRule(3, 140)),
+            'B': ProductPrice('B', 35, '2 for 60', OfferRule(2, 60)),
+            'C': ProductPrice('C', 25, None, None)
+        }
+        offers = [
+            OfferRow(1, 'bundle', None, None, None, 70, json.dumps({'A': 1, 'C': 1})),
+            OfferRow(2, 'bundle', None, None, None, 100, json.dumps({'A': 1, 'B': 2})),
+            OfferRow(3, 'multi_buy', 'C', 4, None, 80, None)
+        ]
+        engine = OfferEngine(offers, products)
+        for a, b, c in itertools.product(range(8), repeat=3):
+            quantities = {'A': a, 'B': b, 'C': c}
+            best = min(
+                70 * x + 100 * y + sum(engine.line_total(products[code], quantity) for code, quantity in
+                                       {'A': a - x - y, 'B': b - 2 * y, 'C': c - x}.items())
+                for x in range(a + 1) for y in range(a - x + 1) if 2 * y <= b and x <= c
+            )
+            self.assertEqual(engine.cart_total(quantities, products), best, quantities)
+
+    def test_validate_offer(self):
+        self.assertEqual(validate_offer({'kind': 'bundle', 'items': {'B': 1, 'A': 2}, 'price': 90})['items'], '{"A":2,"B":1}')
+        for bad in [
+            {'kind': 'multi_buy', 'code': 'A', 'quantity': 0, 'price': 10},
+            {'kind': 'multi_buy', 'code': 'A', 'quantity': 10000, 'price': 1},
+            {'kind': 'buy_get', 'code': 'A', 'quantity': 60, 'free_quantity': 60},
+            {'kind': 'multi_buy', 'code': 'A', 'quantity': 2},
+            {'kind': 'buy_get', 'code': 'A', 'quantity': 2},
+            {'kind': 'bundle', 'items': {'A': 1}, 'price': 10},
+            {'kind': 'coupon'},
+            []
+        ]:
+            with self.assertRaises(ValueError):
+                validate_offer(bad)
+
+class OfferApiTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add_all([Product('A', 50, '3 for 140'), Product('B', 35, '2 for 60'), Product('C', 25)])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def subtotal(self, items):
+        return self.client.post('/api/subtotal', json=items).get_json()['subtotal']
+
+    def test_offers_change_prices(self):
+        response = self.client.post('/api/offers', json=[
+            {'kind': 'multi_buy', 'code': 'C', 'quantity': 5, 'price': 100},
+            {'kind': 'bundle', 'items': {'A': 1, 'B': 1}, 'price': 70}
+        ])
+        self.assertEqual(response.status_code, 201)
+        ids = response.get_json()['ids']
+        self.assertEqual(len(self.client.get('/api/offers').get_json()), 2)
+
+        # duplicate lines are merged before tiers apply
+        self.assertEqual(self.subtotal([{"code": "C", "quantity": 3}, {"code": "C", "quantity": 3}]), 125)
+        self.assertEqual(self.subtotal([{"code": "A", "quantity": 1}, {"code": "B", "quantity": 1}]), 70)
+        self.assertEqual(self.subtotal([{"code": "A", "quantity": 3}, {"code": "B", "quantity": 1}]), 70 + 2 * 50)
+        batch = self.client.post('/api/subtotal/batch', json={
+            'offers': [{"code": "A", "quantity": 1}, {"code": "B", "quantity": 1}],
+            'plain': [{"code": "A", "quantity": 3}]
+        }).get_json()
+        self.assertEqual(batch['subtotals'], {'offers': 70, 'plain': 140})
+
+        self.assertEqual(self.client.delete(f'/api/offers/{ids[1]}').status_code, 200)
+        self.assertEqual(self.client.delete(f'/api/offers/{ids[1]}').status_code, 404)
+        self.assertEqual(self.subtotal([{"code": "A", "quantity": 1}, {"code": "B", "quantity": 1}]), 85)
+
+    def test_unrelated_offer_leaves_split_lines_unchanged(self):
+        cart = [{"code": "A", "quantity": 2}, {"code": "A", "quantity": 1}, {"code": "B", "quantity": 1}]
+        self.app.config['PRICING_VECTOR_MIN_LINES'] = 1
+        prices = [self.subtotal(cart)]
+        self.app.config['PRICING_VECTOR_MIN_LINES'] = 10 ** 6
+        prices.append(self.subtotal(cart))
+        self.client.post('/api/offers', json=[{'kind': 'multi_buy', 'code': 'B', 'quantity': 4, 'price': 100}])
+        prices.append(self.subtotal(cart))
+        self.assertEqual(prices, [140 + 35] * 3)
+
+    def test_invalid_offers_rejected(self):
+        response = self.client.post('/api/offers', json=[
+            {'kind': 'buy_get', 'code': 'A', 'quantity': 2, 'free_quantity': 1},
+            {'kind': 'bundle', 'items': {'A': 1, 'Z': 1}, 'price': 10}
+        ])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json()['missing_codes'], ['Z'])
+        self.assertEqual(self.client.post('/api/offers', json=[{'kind': 'multi_buy', 'code': 'A'}]).status_code, 400)
+        self.assertEqual(self.client.post('/api/offers', json=[{'kind': 'multi_buy', 'code': 'A', 'quantity': 10000, 'price': 1}])
+                         .status_code, 400)
+        self.assertEqual(self.client.post('/api/offers', json=[{'kind': 'multi_buy', 'code': 'A' * 11, 'quantity': 2, 'price': 1}])
+                         .status_code, 400)
+        self.assertEqual(self.client.post('/api/offers', json=[{'kind': 'bundle', 'items': {'A': 1, 'B' * 11: 1}, 'price': 1}])
+                         .status_code, 400)
+        self.assertEqual(self.client.patch('/api/pricing/A', json={'special_price': '10000 for 1'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/offers').get_json(), [])
+
+    def test_offer_id_conflict(self):
+        # e.g. a Postgres sequence behind ids inserted by hand
+        with patch.object(db.session, 'flush', side_effect=IntegrityError('INSERT INTO offers', {}, Exception())):
+            response = self.client.post('/api/offers', json=[{'kind': 'multi_buy', 'code': 'A', 'quantity': 2, 'price': 90}])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.get('/api/offers').get_json(), [])
+
+    def test_cart_bundle_discount(self):
+        self.assertEqual(self.client.put('/api/offers/9', json={'kind': 'bundle', 'items': {'A': 1, 'C': 1}, 'price': 60})
+                         .status_code, 404)
+        offer_id = self.client.post('/api/offers', json=[{'kind': 'bundle', 'items': {'A': 1, 'C': 1}, 'price': 70}]).get_json()['ids'][0]
+        self.client.put(f'/api/offers/{offer_id}', json={'kind': 'bundle', 'items': {'A': 1, 'C': 1}, 'price': 60})
+        self.assertEqual([offer['price'] for offer in self.client.get('/api/offers').get_json()], [60])
+        cart = self.client.post('/api/carts', json={'items': [{"code": "A", "quantity": 1}]}).get_json()
+        self.assertEqual(cart['subtotal'], 50)
+        cart = self.client.post(f"/api/carts/{cart['cart_id']}/items", json={"code": "C", "quantity": 1}).get_json()
+        self.assertEqual(cart['subtotal'], 60)
+        self.assertEqual(cart['bundle_discount'], 15)
+        self.assertEqual(self.client.post('/api/quote', json=[{"code": "A", "quantity": 1}, {"code": "C", "quantity": 1}])
+                         .get_json()['subtotal'], 60)
+
+if __name__ == '__main__':
+    unittest.main()
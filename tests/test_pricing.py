@@ -0,0 +1,417 @@
+import sys
+import os
+
+# add the root directory to the sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import random
+import tempfile
+import time
+import unittest
+from sqlalchemy import event
+from app import create_app
+from config import TestConfig
+from model import Product, PricingVersion, db
+from pricing import (
+    CartError, OfferRule, PackedProducts, PricingCache, PricingSnapshot, ProductPrice, QuantityTables, cart_codes, item_total,
+    parse_offer, price_cart
+)
+import pricing_vector
+
+class OfferRuleTestCase(unittest.TestCase):
+
+    def test_parse_offer(self):
+        self.assertEqual(parse_offer('3 for 140'), OfferRule(3, 140))
+        self.assertIsNone(parse_offer(None))
+        self.assertIsNone(parse_offer(''))
+        for bad in ['3for140', '3 for 140 each', '0 for 10', 'two for 5', 42]:
+            with self.assertRaises(ValueError):
+                parse_offer(bad)
+
+    def test_quantity_tables_carry_over_during_concurrent_adds(self):
+        products = {code: ProductPrice(code, 10, None, None) for code in 'ABCDEF'}
+        tables = QuantityTables(5, 10)
+        tables.add(products['A'])
+        tables.add(products['B'])
+        class Reloaded(dict):
+            # A request thread pricing a new product while the reload iterates
+            def get(self, code, default=None):
+                tables.add(products[chr(ord(code) + 2)])
+                return super().get(code, default)
+        carried = tables.carry_over(Reloaded(products))
+        self.assertEqual(sorted(carried.tables), ['A', 'B'])
+        self.assertEqual(sorted(tables.tables), ['A', 'B', 'C', 'D'])
+
+    def test_item_total(self):
+        product = ProductPrice('A', 50, '3 for 140', OfferRule(3, 140))
+        self.assertEqual(item_total(product, 7), 2 * 140 + 50)
+        self.assertEqual(item_total(product._replace(offer=None), 7), 350)
+
+class PackedProductsTestCase(unittest.TestCase):
+
+    products = [
+        ProductPrice('B', 35, '2 for 60', OfferRule(2, 60)),
+        ProductPrice('A', 50, '3 for 140', OfferRule(3, 140)),
+        ProductPrice('CAFÉ', 25, None, None),
+        ProductPrice('AB', 10, 'half price', None)
+    ]
+
+    def test_lookup_and_order(self):
+        packed = PackedProducts.build(3, self.products)
+        self.assertEqual(packed.version, 3)
+        self.assertEqual(len(packed), 4)
+        self.assertEqual(list(packed), ['A', 'AB', 'B', 'CAFÉ'])
+        for product in self.products:
+            self.assertEqual(packed[product.code], product)
+        self.assertEqual(list(packed.values()), sorted(self.products))
+        for missing in ('', 'Z', 'AA', 'TOO-LONG-CODE', 7):
+            self.assertNotIn(missing, packed)
+        self.assertEqual(packed.bisect_right('AB'), 2)
+        self.assertEqual(len(PackedProducts.build(1, [])), 0)
+
+    def test_file_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'pricing.snapshot')
+            PackedProducts.build(3, self.products).save(path)
+            mapped = PackedProducts.open(path)
+            self.assertEqual(dict(mapped), {product.code: product for product in self.products})
+            mapped.release()
+
+            with open(path, 'wb') as f:
+                f.write(b'not a snapshot' * 4)
+            with self.assertRaises(ValueError):
+                PackedProducts.open(path)
+
+@unittest.skipUnless(pricing_vector.available(), 'numpy is not installed')
+class VectorPricingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(7)
+        products = []
+        for i in range(200):
+            offer = OfferRule(rng.randint(1, 6), rng.randint(1, 500)) if i % 2 else None
+            products.append(ProductPrice(f'P{i}', rng.randint(1, 100), None, offer))
+        self.snapshot = PricingSnapshot(1, products)
+        self.vector = pricing_vector.VectorPricing.for_snapshot(self.snapshot)
+        self.rng = rng
+
+    def random_cart(self, lines):
+        return [{'code': f'P{self.rng.randrange(200)}', 'quantity': self.rng.randint(1, 50)} for _ in range(lines)]
+
+    def test_matches_scalar_oracle(self):
+        for lines in (1, 10, 1000):
+            items = self.random_cart(lines)
+            codes = cart_codes(items)
+            self.assertEqual(self.vector.price_cart(items, codes), price_cart(items, codes, self.snapshot.products))
+
+    def test_price_carts(self):
+        carts = {f'c{i}': self.random_cart(i) for i in range(5)}
+        carts['missing'] = [{'code': 'NOPE', 'quantity': 1}]
+        subtotals, errors = self.vector.price_carts({cart_id: (items, cart_codes(items)) for cart_id, items in carts.items()})
+        self.assertEqual(subtotals['c0'], 0)
+        for cart_id in ('c1', 'c2', 'c3', 'c4'):
+            self.assertEqual(subtotals[cart_id], price_cart(carts[cart_id], cart_codes(carts[cart_id]), self.snapshot.products))
+        self.assertEqual(errors['missing']['missing_codes'], ['NOPE'])
+        with self.assertRaises(CartError):
+            self.vector.price_cart(carts['missing'], ['NOPE'])
+
+class PricingCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add_all([Product('A', 50, '3 for 140'), Product('B', 35, '2 for 60')])
+        db.session.commit()
+        self.cache = self.app.extensions['pricing_cache']
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count_queries(self, fn):
+        queries = []
+        listener = lambda *args: queries.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            fn()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        return len(queries)
+
+    def test_subtotal_served_from_snapshot(self):
+        cart = [{"code": "A", "quantity": 3}, {"code": "B", "quantity": 1}]
+        self.assertEqual(self.client.post('/api/subtotal', json=cart).get_json()['subtotal'], 175)
+
+        # steady state: no SQL at all on the hot path
+        queries = self.count_queries(lambda: self.client.post('/api/subtotal', json=cart))
+        self.assertEqual(queries, 0)
+        self.assertEqual(self.cache.stats()['reloads'], 1)
+        self.assertGreaterEqual(self.cache.stats()['hits'], 1)
+
+    def test_write_bumps_version_and_reloads(self):
+        self.client.get('/api/pricing')
+        self.assertEqual(PricingVersion.current(), 0)
+
+        response = self.client.patch('/api/pricing/A', json={"unit_price": 60, "special_price": None})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PricingVersion.current(), 1)
+
+        response = self.client.post('/api/subtotal', json=[{"code": "A", "quantity": 3}])
+        self.assertEqual(response.get_json()['subtotal'], 180)
+        stats = self.client.get('/api/pricing/cache').get_json()
+        self.assertEqual(stats['reloads'], 2)
+        self.assertEqual(stats['version'], 1)
+
+    def test_other_worker_write_picked_up_on_revalidation(self):
+        self.client.get('/api/pricing')
+        # simulate a write committed by another process
+        db.session.get(Product, 'B').unit_price = 40
+        PricingVersion.bump()
+        db.session.commit()
+
+        # still within the check interval: the old snapshot is served
+        data = self.client.get('/api/pricing').get_json()
+        self.assertEqual({p['code']: p['unit_price'] for p in data}['B'], 35)
+
+        self.cache._next_check = 0.0  # check interval elapsed
+        data = self.client.get('/api/pricing').get_json()
+        self.assertEqual({p['code']: p['unit_price'] for p in data}['B'], 40)
+
+    def test_min_version_honoured_after_waiting_for_reload(self):
+        self.client.get('/api/pricing')
+        db.session.get(Product, 'B').unit_price = 40
+        PricingVersion.bump()
+        db.session.commit()
+
+        cache = self.cache
+        class RacingLock:
+            # Another thread reloads a snapshot still at version 0 while this one waits for the lock
+            def __init__(self, lock):
+                self.lock = lock
+            def __enter__(self):
+                stale = PricingSnapshot(0, [ProductPrice('B', 35, None, None)])
+                stale.quantity_tables = cache._snapshot.quantity_tables
+                cache._snapshot = stale
+                cache._next_check = time.monotonic() + 60
+                return self.lock.__enter__()
+            def __exit__(self, *exc):
+                return self.lock.__exit__(*exc)
+        cache._lock = RacingLock(cache._lock)
+
+        snapshot = cache.snapshot(min_version=1)
+        self.assertEqual(snapshot.version, 1)
+        self.assertEqual(snapshot.products['B'].unit_price, 40)
+
+    def test_quantity_tables_rebuilt_for_changed_products(self):
+        cart = [{"code": "A", "quantity": 4}, {"code": "B", "quantity": 40}]
+        self.assertEqual(self.client.post('/api/subtotal', json=cart).get_json()['subtotal'], 190 + 1200)
+        tables = self.cache.snapshot().quantity_tables
+        self.assertEqual(sorted(tables.tables), ['A', 'B'])
+        self.assertEqual(tables.tables['A'][4], 190)
+
+        self.client.patch('/api/pricing/B', json={"unit_price": 40})
+        self.assertEqual(self.client.post('/api/subtotal', json=cart).get_json()['subtotal'], 190 + 1200)
+        self.client.patch('/api/pricing/B', json={"special_price": None})
+        self.assertEqual(self.client.post('/api/subtotal', json=cart).get_json()['subtotal'], 190 + 1600)
+        tables = self.cache.snapshot().quantity_tables
+        # A's table carried over; only B was built again, once per change
+        self.assertEqual(tables.builds, 4)
+        self.assertEqual(self.cache.stats()['quantity_tables'], 2)
+
+    def test_snapshot_file_shared_between_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.cache.directory = directory
+            self.client.get('/api/pricing')
+            self.assertTrue(self.cache.stats()['mapped'])
+            self.assertEqual(os.listdir(directory), ['pricing-0.snapshot'])
+
+            # another worker maps the existing file instead of reading the products table (only version and offers)
+            other_worker = PricingCache(directory=directory)
+            self.assertEqual(self.count_queries(other_worker.snapshot), 2)
+            self.assertEqual(other_worker.snapshot().products['A'].unit_price, 50)
+
+            self.client.patch('/api/pricing/A', json={"unit_price": 60})
+            self.client.get('/api/pricing')
+            self.assertEqual(os.listdir(directory), ['pricing-1.snapshot'])
+            other_worker._next_check = 0.0
+            self.assertEqual(other_worker.snapshot().products['A'].unit_price, 60)
+
+    def test_malformed_offer_rejected_on_write(self):
+        response = self.client.put('/api/pricing', json=[{"code": "C", "unit_price": 20, "special_price": "3 for"}])
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch('/api/pricing/A', json={"special_price": "buy 3"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(db.session.get(Product, 'A').special_price, '3 for 140')
+        self.assertEqual(PricingVersion.current(), 0)
+
+    def test_put_upserts_in_bulk(self):
+        response = self.client.put('/api/pricing', json=[
+            {"code": "A", "unit_price": 55, "special_price": None},
+            {"code": "C", "unit_price": 20, "special_price": "2 for 35"},
+            {"code": "C", "unit_price": 25}
+        ])
+        self.assertEqual(response.status_code, 200)
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Product, 'A').to_dict(), {'code': 'A', 'unit_price': 55, 'special_price': None})
+        # the last row for a duplicated code wins
+        self.assertEqual(db.session.get(Product, 'C').to_dict(), {'code': 'C', 'unit_price': 25, 'special_price': None})
+        self.assertEqual(Product.query.count(), 3)
+
+    def test_post_streams_ndjson(self):
+        body = '{"code": "X", "unit_price": 10, "special_price": "2 for 15"}\n\n{"code": "Y", "unit_price": 5}\n'
+        response = self.client.post('/api/pricing', data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()['count'], 2)
+        self.assertEqual(sorted(p.code for p in Product.query.all()), ['X', 'Y'])
+
+    def test_post_streams_csv(self):
+        body = 'code,unit_price,special_price\nX,10,2 for 15\nY,5,\n'
+        response = self.client.post('/api/pricing', data=body, content_type='text/csv')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(db.session.get(Product, 'X').to_dict(), {'code': 'X', 'unit_price': 10, 'special_price': '2 for 15'})
+        self.assertIsNone(db.session.get(Product, 'Y').special_price)
+
+    def test_post_invalid_row_leaves_table_untouched(self):
+        body = 'code,unit_price,special_price\nX,10,\nY,five,\n'
+        response = self.client.post('/api/pricing', data=body, content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/pricing', json=[{"code": "X", "unit_price": 1}, {"code": "X", "unit_price": 2}])
+        self.assertEqual(response.status_code, 400)
+        for unit_price in (-5, 3.7, '-5', '3.7', True):
+            for method in (self.client.post, self.client.put):
+                self.assertEqual(method('/api/pricing', json=[{"code": "X", "unit_price": unit_price}]).status_code, 400, unit_price)
+        self.assertEqual(self.client.post('/api/pricing', data='code,unit_price\nX,-5\n', content_type='text/csv').status_code, 400)
+        # products.code is VARCHAR(10)
+        for method in (self.client.post, self.client.put):
+            self.assertEqual(method('/api/pricing', json=[{"code": "X" * 11, "unit_price": 1}]).status_code, 400)
+        self.assertEqual(self.client.post('/api/pricing', data=f'code,unit_price\n{"X" * 11},1\n', content_type='text/csv')
+                         .status_code, 400)
+        self.assertEqual(sorted(p.code for p in Product.query.all()), ['A', 'B'])
+        self.assertEqual(PricingVersion.current(), 0)
+
+    def test_get_pricing_conditional(self):
+        response = self.client.get('/api/pricing')
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get('/api/pricing', headers={'If-None-Match': etag}).status_code, 304)
+
+        self.client.patch('/api/pricing/A', json={"unit_price": 45})
+        response = self.client.get('/api/pricing', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_get_pricing_keyset_pagination(self):
+        self.client.put('/api/pricing', json=[{"code": "C", "unit_price": 20}])
+        for cache_enabled in (True, False):
+            self.app.config['PRICING_CACHE_ENABLED'] = cache_enabled
+            response = self.client.get('/api/pricing?limit=2')
+            self.assertEqual([p['code'] for p in response.get_json()], ['A', 'B'])
+            self.assertIn('after=B', response.headers['Link'])
+
+            response = self.client.get('/api/pricing?after=B&limit=2')
+            self.assertEqual([p['code'] for p in response.get_json()], ['C'])
+            self.assertNotIn('Link', response.headers)
+        self.assertEqual(self.client.get('/api/pricing?limit=0').status_code, 400)
+
+    def test_get_pricing_changed_since(self):
+        self.client.put('/api/pricing', json=[{"code": "C", "unit_price": 20}])
+        version = PricingVersion.current()
+        self.client.patch('/api/pricing/A', json={"unit_price": 55})
+        response = self.client.get(f'/api/pricing?changed_since={version}')
+        self.assertEqual(response.get_json(), [{'code': 'A', 'unit_price': 55, 'special_price': '3 for 140'}])
+        response = self.client.get('/api/pricing?changed_since=0&limit=1')
+        self.assertIn('changed_since=0', response.headers['Link'])
+        self.assertEqual([p['code'] for p in self.client.get('/api/pricing?changed_since=0&after=A').get_json()], ['C'])
+        self.assertEqual(self.client.get('/api/pricing?changed_since=-1').status_code, 400)
+
+    def test_offer_columns_kept_with_special_price(self):
+        def offer_columns(code):
+            product = db.session.get(Product, code)
+            db.session.refresh(product)
+            return product.offer_qty, product.offer_price
+        self.assertEqual(offer_columns('A'), (3, 140))
+        self.client.patch('/api/pricing/A', json={"special_price": "4 for 150"})
+        self.assertEqual(offer_columns('A'), (4, 150))
+        self.client.patch('/api/pricing/A', json={"special_price": None})
+        self.assertEqual(offer_columns('A'), (None, None))
+        self.client.put('/api/pricing', json=[{"code": "B", "unit_price": 35, "special_price": "5 for 100"}])
+        self.assertEqual(offer_columns('B'), (5, 100))
+        self.client.post('/api/pricing', data='code,unit_price,special_price\nX,10,2 for 15\n', content_type='text/csv')
+        self.assertEqual(offer_columns('X'), (2, 15))
+
+        # Pricing reads the typed columns, not the string
+        db.session.execute(db.update(Product).where(Product.code == 'X').values(special_price='junk'))
+        PricingVersion.bump()
+        db.session.commit()
+        self.cache.invalidate()
+        self.assertEqual(self.client.post('/api/subtotal', json=[{"code": "X", "quantity": 2}]).get_json(), {'subtotal': 15})
+
+    def test_get_pricing_streamed(self):
+        self.app.config['PRICING_STREAM_BATCH_SIZE'] = 1
+        for cache_enabled in (True, False):
+            self.app.config['PRICING_CACHE_ENABLED'] = cache_enabled
+            response = self.client.get('/api/pricing?stream=true')
+            self.assertEqual(response.get_json(), [
+                {'code': 'A', 'unit_price': 50, 'special_price': '3 for 140'},
+                {'code': 'B', 'unit_price': 35, 'special_price': '2 for 60'}
+            ])
+            self.assertEqual(self.client.get('/api/pricing?stream=true&after=A').get_json()[0]['code'], 'B')
+
+        # The snapshot stream builds one product at a time
+        rows = self.cache.snapshot().stream()
+        self.assertEqual(next(rows).code, 'A')
+        self.assertEqual([product.code for product in rows], ['B'])
+
+    def test_subtotal_batch(self):
+        self.app.config['PRICING_CACHE_ENABLED'] = False
+        carts = {
+            "c1": [{"code": "A", "quantity": 3}],
+            "c2": [{"code": "B", "quantity": 2}, {"code": "A", "quantity": 1}],
+            "c3": [{"code": "Z", "quantity": 1}],
+            "c4": [{"code": "A"}]
+        }
+        responses = []
+        queries = self.count_queries(lambda: responses.append(self.client.post('/api/subtotal/batch', json=carts)))
+
+        response = responses[0]
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['subtotals'], {"c1": 140, "c2": 110})
+        self.assertEqual(data['errors']['c3']['missing_codes'], ['Z'])
+        self.assertIn('Missing code or quantity', data['errors']['c4']['error'])
+        # the union of codes is resolved with a single lookup, plus one read of the offers table
+        self.assertEqual(queries, 2)
+        self.assertEqual(self.client.post('/api/subtotal/batch', json=[]).status_code, 400)
+
+    @unittest.skipUnless(pricing_vector.available(), 'numpy is not installed')
+    def test_subtotal_vectorized(self):
+        self.app.config['PRICING_VECTOR_MIN_LINES'] = 1
+        cart = [{"code": "A", "quantity": 3}, {"code": "B", "quantity": 1}]
+        self.assertEqual(self.client.post('/api/subtotal', json=cart).get_json()['subtotal'], 175)
+        data = self.client.post('/api/subtotal/batch', json={"c1": cart, "c2": [{"code": "X", "quantity": 1}]}).get_json()
+        self.assertEqual(data['subtotals'], {"c1": 175})
+        self.assertEqual(data['errors']['c2']['missing_codes'], ['X'])
+
+    @unittest.skipUnless(pricing_vector.available(), 'numpy is not installed')
+    def test_subtotal_beyond_int64_matches_scalar(self):
+        cart = [{"code": "B", "quantity": 1}] * 999 + [{"code": "A", "quantity": 10 ** 17}]
+        huge = [{"code": "A", "quantity": 2 ** 63}]
+        subtotals = {}
+        for min_lines in (1, 10 ** 6):
+            self.app.config['PRICING_VECTOR_MIN_LINES'] = min_lines
+            subtotals[min_lines] = (
+                self.client.post('/api/subtotal', json=cart).get_json(),
+                self.client.post('/api/subtotal/batch', json={"c1": cart, "c2": huge}).get_json()
+            )
+        self.assertEqual(subtotals[1], subtotals[10 ** 6])
+        # The 999 B lines are priced as one line of 999
+        expected = 10 ** 17 // 3 * 140 + 10 ** 17 % 3 * 50 + 999 // 2 * 60 + 35
+        self.assertEqual(subtotals[1][0], {'subtotal': expected})
+        self.assertEqual(subtotals[1][1]['subtotals']['c1'], expected)
+        self.assertFalse(self.app.extensions['pricing_cache'].snapshot().vector.fits([huge]))
+
+if __name__ == '__main__':
+    unittest.main()
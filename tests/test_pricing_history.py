@@ -0,0 +1,88 @@
+import sys
+import os
+
+# add the root directory to the sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from app import create_app
+from config import TestConfig
+from model import db
+
+class PricingHistoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        # version 1
+        self.client.put('/api/pricing', json=[
+            {"code": "A", "unit_price": 50, "special_price": "3 for 140"},
+            {"code": "B", "unit_price": 35, "special_price": "2 for 60"}
+        ])
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def changes(self, since=0, **args):
+        return self.client.get('/api/pricing/changes', query_string=dict(args, since=since)).get_json()
+
+    def test_changes_since(self):
+        self.client.patch('/api/pricing/A', json={"unit_price": 55})
+        self.client.delete('/api/pricing', json=["B"])
+        self.client.post('/api/offers', json=[{'kind': 'multi_buy', 'code': 'A', 'quantity': 2, 'price': 100}])
+
+        data = self.changes()
+        self.assertFalse(data['has_more'])
+        self.assertEqual([(c['version'], c['op'], c.get('code'), c.get('offer_id')) for c in data['changes']], [
+            (1, 'upsert', 'A', None), (1, 'upsert', 'B', None), (2, 'upsert', 'A', None), (3, 'delete', 'B', None),
+            (4, 'upsert', None, 1)
+        ])
+        self.assertEqual(data['changes'][2]['unit_price'], 55)
+        self.assertEqual(data['changes'][4]['offer']['price'], 100)
+
+        page = self.changes(limit=2)
+        self.assertTrue(page['has_more'])
+        rest = self.changes(page['next_since'])
+        self.assertEqual(len(rest['changes']), 3)
+        caught_up = self.changes(rest['next_since'])
+        self.assertEqual((caught_up['changes'], caught_up['next_since']), ([], rest['next_since']))
+        self.assertEqual(self.client.get('/api/pricing/changes?since=-1').status_code, 400)
+        self.assertEqual(self.client.get('/api/pricing/changes?since=abc').status_code, 400)
+        self.assertEqual(self.client.get('/api/pricing/changes?limit=abc').status_code, 400)
+
+    def test_replace_logs_only_differences(self):
+        since = self.changes()['next_since']
+        self.client.post('/api/pricing', json=[
+            {"code": "A", "unit_price": 50, "special_price": "3 for 140"},
+            {"code": "C", "unit_price": 25}
+        ])
+        changes = self.changes(since)['changes']
+        self.assertEqual(sorted((c['op'], c['code']) for c in changes), [('delete', 'B'), ('upsert', 'C')])
+
+    def test_subtotal_as_of_version(self):
+        cart = [{"code": "A", "quantity": 3}, {"code": "B", "quantity": 1}]
+        self.client.patch('/api/pricing/A', json={"special_price": None})
+        self.client.post('/api/offers', json=[{'kind': 'bundle', 'items': {'A': 1, 'B': 1}, 'price': 60}])
+        self.client.delete('/api/pricing', json=["B"])
+
+        def subtotal(as_of):
+            return self.client.post(f'/api/subtotal?as_of={as_of}', json=cart)
+
+        self.assertEqual(subtotal(1).get_json(), {'subtotal': 140 + 35, 'version': 1})
+        self.assertEqual(subtotal(2).get_json()['subtotal'], 150 + 35)
+        self.assertEqual(subtotal(3).get_json()['subtotal'], 60 + 100)
+        self.assertEqual(subtotal(4).get_json()['missing_codes'], ['B'])
+        self.assertEqual(subtotal(5).status_code, 404)
+        self.assertEqual(subtotal(0).status_code, 410)
+        self.assertEqual(subtotal('x').status_code, 400)
+
+        batch = self.client.post('/api/subtotal/batch?as_of=1', json={'c1': cart}).get_json()
+        self.assertEqual(batch, {'subtotals': {'c1': 175}, 'errors': {}, 'version': 1})
+
+if __name__ == '__main__':
+    unittest.main()
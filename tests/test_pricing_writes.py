@@ -0,0 +1,128 @@
+import sys
+import os
+
+# add the root directory to the sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import io
+import threading
+import time
+import unittest
+from app import create_app
+from config import TestConfig
+from model import Offer, PricingVersion, Product, db
+from write_coalescer import WriteCoalescer
+
+class CoalescingConfig(TestConfig):
+    # Long enough for every test thread to join the first batch
+    PRICING_PATCH_WINDOW = 0.2
+
+class WriteCoalescerTestCase(unittest.TestCase):
+
+    def test_queued_writes_share_a_batch(self):
+        batches = []
+        def apply(items):
+            batches.append(items)
+            time.sleep(0.05)
+            return [item * 10 for item in items]
+        coalescer = WriteCoalescer(apply)
+        results = {}
+        threads = [threading.Thread(target=lambda i=i: results.update({i: coalescer.submit(i)})) for i in range(6)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.005)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {i: i * 10 for i in range(6)})
+        # The first write goes alone; the rest queued behind its commit
+        self.assertEqual(batches[0], [0])
+        self.assertLess(len(batches), 6)
+        self.assertEqual(coalescer.stats(), {'batches': len(batches), 'writes': 6})
+
+    def test_errors_reach_every_writer_in_the_batch(self):
+        def apply(items):
+            raise RuntimeError('boom')
+        coalescer = WriteCoalescer(apply, max_batch=1)
+        with self.assertRaises(RuntimeError):
+            coalescer.submit(1)
+        self.assertEqual(coalescer.stats(), {'batches': 1, 'writes': 1})
+
+class PricingWritesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(CoalescingConfig)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add_all([Product(code, 10 + i) for i, code in enumerate('ABCDE')])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_if_match(self):
+        etag = self.client.get('/api/pricing/A').headers['ETag']
+        self.assertEqual(self.client.get('/api/pricing/A', headers={'If-None-Match': etag}).status_code, 304)
+        response = self.client.patch('/api/pricing/A', json={"unit_price": 60}, headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        # A second writer holding the old ETag does not overwrite the first
+        response = self.client.patch('/api/pricing/A', json={"unit_price": 70}, headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(self.client.get('/api/pricing/A').get_json()['unit_price'], 60)
+        self.assertEqual(self.client.get('/api/pricing/Z').status_code, 404)
+
+        table_etag = self.client.get('/api/pricing').headers['ETag']
+        self.client.patch('/api/pricing/B', json={"unit_price": 5})
+        response = self.client.put('/api/pricing', json=[{"code": "B", "unit_price": 50}], headers={'If-Match': table_etag})
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(db.session.get(Product, 'B').unit_price, 5)
+        response = self.client.put('/api/pricing', json=[{"code": "B", "unit_price": 50}], headers={'If-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(db.session.get(Product, 'B').version, PricingVersion.current())
+
+    def test_idempotency_key(self):
+        offer = [{'kind': 'multi_buy', 'code': 'A', 'quantity': 2, 'price': 15}]
+        first = self.client.post('/api/offers', json=offer, headers={'Idempotency-Key': 'k1'})
+        retry = self.client.post('/api/offers', json=offer, headers={'Idempotency-Key': 'k1'})
+        self.assertEqual((retry.status_code, retry.get_json()), (201, first.get_json()))
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(Offer.query.count(), 1)
+        self.assertEqual(self.client.post('/api/offers', json=offer * 2, headers={'Idempotency-Key': 'k1'}).status_code, 422)
+
+        # A failed request does not use up its key
+        self.assertEqual(self.client.patch('/api/pricing/A', json={"unit_price": -1}, headers={'Idempotency-Key': 'k2'}).status_code, 400)
+        response = self.client.patch('/api/pricing/A', json={"unit_price": 60}, headers={'Idempotency-Key': 'k2'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.patch('/api/pricing/A', json={"unit_price": 60}, headers={'Idempotency-Key': 'k2'})
+                         .headers['ETag'], response.headers['ETag'])
+
+        # Streamed uploads are matched by length, so a chunked one cannot carry a key
+        body = b'code,unit_price\nA,70\n'
+        response = self.client.post('/api/pricing', input_stream=io.BytesIO(body), content_type='text/csv',
+                                    headers={'Idempotency-Key': 'k3', 'Transfer-Encoding': 'chunked'})
+        self.assertEqual(response.status_code, 411)
+        response = self.client.post('/api/pricing', data=body, content_type='text/csv', headers={'Idempotency-Key': 'k3'})
+        self.assertEqual(response.status_code, 201)
+
+    def test_concurrent_patches_are_coalesced(self):
+        version = PricingVersion.current()
+        responses = {}
+        def patch(code, price):
+            responses[code] = self.client.patch(f'/api/pricing/{code}', json={"unit_price": price}).status_code
+        threads = [threading.Thread(target=patch, args=(code, 100 + i)) for i, code in enumerate('ABCDEZ')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(responses, {'A': 200, 'B': 200, 'C': 200, 'D': 200, 'E': 200, 'Z': 404})
+        self.assertEqual(self.app.extensions['patch_coalescer'].stats(), {'batches': 1, 'writes': 6})
+        self.assertEqual(PricingVersion.current(), version + 1)
+        db.session.expire_all()
+        self.assertEqual([product.unit_price for product in Product.query.order_by(Product.code)], [100, 101, 102, 103, 104])
+
+if __name__ == '__main__':
+    unittest.main()
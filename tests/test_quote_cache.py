@@ -0,0 +1,126 @@
+import sys
+import os
+
+# add the root directory to the sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from unittest.mock import patch
+from app import create_app
+from config import TestConfig
+from model import PricingVersion, Product, db
+from quote_cache import QuoteCache, normalize_cart, quote_key
+
+class DictBackend:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl):
+        self.values[key] = value
+
+class QuoteCacheTestCase(unittest.TestCase):
+
+    def test_normalized_carts_share_a_key(self):
+        a = normalize_cart([{'code': 'B', 'quantity': 1}, {'code': 'A', 'quantity': 2}, {'code': 'A', 'quantity': 1}])
+        b = normalize_cart([{'code': 'A', 'quantity': 3}, {'code': 'B', 'quantity': 1}])
+        self.assertEqual(a, [('A', 3), ('B', 1)])
+        self.assertEqual(quote_key(a, 1), quote_key(b, 1))
+        self.assertNotEqual(quote_key(a, 1), quote_key(a, 2))
+
+    def test_lru_eviction_by_entries(self):
+        cache = QuoteCache(max_entries=2)
+        cache.set('a', {'subtotal': 1})
+        cache.set('b', {'subtotal': 2})
+        cache.get('a')
+        cache.set('c', {'subtotal': 3})
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), {'subtotal': 1})
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_eviction_by_bytes(self):
+        cache = QuoteCache(max_bytes=300)
+        cache.set('a', {'subtotal': 1})
+        cache.set('b', {'subtotal': 2})
+        self.assertEqual(cache.stats()['entries'], 1)
+        self.assertLessEqual(cache.stats()['bytes'], 300)
+
+    def test_ttl_expiry(self):
+        cache = QuoteCache(ttl=10)
+        with patch('quote_cache.time.monotonic', return_value=100.0):
+            cache.set('a', {'subtotal': 1})
+        with patch('quote_cache.time.monotonic', return_value=111.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_shared_backend(self):
+        backend = DictBackend()
+        QuoteCache(backend=backend).set('a', {'subtotal': 1})
+        other_worker = QuoteCache(backend=backend)
+        self.assertEqual(other_worker.get('a'), {'subtotal': 1})
+        self.assertEqual(other_worker.stats()['shared_hits'], 1)
+        self.assertEqual(other_worker.get('a'), {'subtotal': 1})
+        self.assertEqual(other_worker.stats()['hits'], 1)
+
+class QuoteEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add_all([Product('A', 50, '3 for 140'), Product('B', 35, None)])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_quote_is_memoized_per_pricing_version(self):
+        response = self.client.post('/api/quote', json=[{"code": "A", "quantity": 2}, {"code": "B", "quantity": 1}, {"code": "A", "quantity": 1}])
+        self.assertEqual(response.get_json(), {'subtotal': 175, 'version': 0, 'cached': False})
+
+        response = self.client.post('/api/quote', json=[{"code": "B", "quantity": 1}, {"code": "A", "quantity": 3}])
+        self.assertEqual(response.get_json(), {'subtotal': 175, 'version': 0, 'cached': True})
+
+        self.client.patch('/api/pricing/B', json={"unit_price": 40})
+        response = self.client.post('/api/quote', json=[{"code": "A", "quantity": 3}, {"code": "B", "quantity": 1}])
+        self.assertEqual(response.get_json(), {'subtotal': 180, 'version': 1, 'cached': False})
+
+        stats = self.client.get('/api/quote/cache').get_json()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+        self.assertEqual(self.client.post('/api/quote', json=[{"code": "Z", "quantity": 1}]).status_code, 404)
+
+    def test_quote_not_cached_across_a_concurrent_write(self):
+        self.app.config['PRICING_CACHE_ENABLED'] = False
+        cart = [{"code": "B", "quantity": 1}]
+        current = PricingVersion.current
+        writes = []
+        def current_then_write():
+            version = current()
+            if not writes:
+                # Another request commits between the version read and the pricing read
+                writes.append(version)
+                db.session.get(Product, 'B').unit_price = 40
+                PricingVersion.bump()
+                db.session.commit()
+            return version
+
+        with patch.object(PricingVersion, 'current', side_effect=current_then_write):
+            self.assertEqual(self.client.post('/api/quote', json=cart).get_json()['subtotal'], 40)
+        self.assertIsNone(self.app.extensions['quote_cache'].get(quote_key(normalize_cart(cart), 0)))
+        self.assertEqual(self.client.post('/api/quote', json=cart).get_json(), {'subtotal': 40, 'version': 1, 'cached': False})
+
+    def test_quote_matches_subtotal(self):
+        for cart in ([{"code": "A", "quantity": 2}, {"code": "B", "quantity": 1}, {"code": "A", "quantity": 1}],
+                     [{"code": "A", "quantity": 4}, {"code": "A", "quantity": 4}]):
+            subtotal = self.client.post('/api/subtotal', json=cart).get_json()['subtotal']
+            for _ in range(2):
+                self.assertEqual(self.client.post('/api/quote', json=cart).get_json()['subtotal'], subtotal)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import sys
+import os
+
+# add the root directory to the sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import shutil
+import tempfile
+import unittest
+from app import create_app
+from config import TestConfig
+from model import PricingVersion, Product, db
+
+class ReplicasTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Two SQLite files stand in for the primary and a replica; replication is done by hand
+        self.directory = tempfile.mkdtemp()
+        class ReplicaConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f'sqlite:///{self.directory}/primary.db'
+            SQLALCHEMY_REPLICA_URIS = [f'sqlite:///{self.directory}/replica.db']
+            REPLICA_CHECK_INTERVAL = 0
+        self.app = create_app(ReplicaConfig)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.replica = db.engines['replica_0']
+        db.create_all()
+        db.metadata.create_all(self.replica)
+        db.session.add(Product('A', 50))
+        db.session.commit()
+        self.replicate()
+
+    def tearDown(self):
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def replicate(self):
+        with db.engines[None].connect() as primary, self.replica.begin() as replica:
+            for table in db.metadata.sorted_tables:
+                rows = [row._asdict() for row in primary.execute(table.select())]
+                replica.execute(table.delete())
+                if rows:
+                    replica.execute(table.insert(), rows)
+
+    def test_reads_go_to_the_replica_and_writes_to_the_primary(self):
+        response = self.client.patch('/api/pricing/A', json={"unit_price": 60})
+        self.assertEqual(response.status_code, 200)
+        version = int(response.headers['Pricing-Version'])
+        self.assertEqual(PricingVersion.current(), version)
+        # The replica has not replayed the write yet
+        self.assertEqual(self.client.get('/api/pricing/A').get_json()['unit_price'], 50)
+        self.assertEqual(self.app.extensions['replica_pool'].stats()['replicas']['replica_0']['reads'], 1)
+
+        # Read-your-writes: a replica behind the client's version is skipped for the primary
+        headers = {'Min-Pricing-Version': str(version)}
+        self.assertEqual(self.client.get('/api/pricing/A', headers=headers).get_json()['unit_price'], 60)
+        self.assertEqual(self.client.post('/api/subtotal', json=[{"code": "A", "quantity": 2}], headers=headers).get_json(),
+                         {"subtotal": 120})
+        self.assertEqual(self.app.extensions['replica_pool'].stats()['primary_reads'], 2)
+
+        self.replicate()
+        self.assertEqual(self.client.get('/api/pricing/A', headers=headers).get_json()['unit_price'], 60)
+        self.assertEqual(self.app.extensions['replica_pool'].stats()['replicas']['replica_0']['reads'], 2)
+
+    def test_unreachable_replica_is_skipped(self):
+        self.replica.dispose()
+        os.remove(f'{self.directory}/replica.db')
+        os.mkdir(f'{self.directory}/replica.db')
+        with self.assertLogs('replicas', 'WARNING'):
+            response = self.client.get('/api/pricing/A')
+        self.assertEqual(response.get_json()['unit_price'], 50)
+        stats = self.app.extensions['replica_pool'].stats()
+        self.assertEqual(stats['primary_reads'], 1)
+        self.assertFalse(stats['replicas']['replica_0']['healthy'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import sys
+import os
+
+# add the root directory to the sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import tempfile
+import unittest
+from app import create_app
+from config import TestConfig
+from model import Offer, PricingVersion, Product, db
+
+class RepriceCommandTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add_all([Product('A', 50, '3 for 140'), Product('B', 35, '2 for 60'), Product('C', 25)])
+        db.session.add(PricingVersion(id=1, version=7))
+        db.session.commit()
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def reprice(self, name, content, *args):
+        input_path = os.path.join(self.tmpdir.name, name)
+        output_path = os.path.join(self.tmpdir.name, 'results.ndjson')
+        with open(input_path, 'w') as f:
+            f.write(content)
+        result = self.app.test_cli_runner().invoke(args=['reprice', input_path, output_path, *args])
+        if result.exit_code != 0:
+            return result, None
+        with open(output_path) as f:
+            return result, [json.loads(line) for line in f]
+
+    def test_ndjson_orders_across_workers(self):
+        orders = [{'order_id': i, 'items': [{'code': 'A', 'quantity': i % 5 + 1}, {'code': 'B', 'quantity': 2}]} for i in range(50)]
+        orders.append({'order_id': 'bad', 'items': [{'code': 'Z', 'quantity': 1}]})
+        content = ''.join(json.dumps(order) + '\n' for order in orders)
+        result, lines = self.reprice('orders.ndjson', content, '--workers', '2', '--chunk-size', '7')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('51 orders (1 errors) at pricing version 7', result.output)
+        # Results keep input order
+        self.assertEqual([line['order_id'] for line in lines], [order['order_id'] for order in orders])
+        self.assertEqual(lines[2], {'order_id': 2, 'subtotal': 140 + 60})
+        self.assertEqual(lines[4], {'order_id': 4, 'subtotal': 140 + 100 + 60})
+        self.assertEqual(lines[-1]['missing_codes'], ['Z'])
+
+    def test_csv_orders(self):
+        content = 'order_id,code,quantity\no1,A,3\no1,C,1\no2,B,x\no3,C,2\n'
+        result, lines = self.reprice('orders.csv', content, '--workers', '1')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(lines[0], {'order_id': 'o1', 'subtotal': 165})
+        self.assertIn('error', lines[1])
+        self.assertEqual(lines[2], {'order_id': 'o3', 'subtotal': 50})
+
+    def test_offers_in_pool_processes(self):
+        db.session.add(Offer(kind='bundle', items='{"A":1,"C":1}', price=60))
+        db.session.commit()
+        content = '{"order_id": 1, "items": [{"code": "A", "quantity": 1}, {"code": "C", "quantity": 2}]}\n'
+        result, lines = self.reprice('orders.ndjson', content, '--workers', '2')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(lines, [{'order_id': 1, 'subtotal': 60 + 25}])
+
+    def test_malformed_input(self):
+        result, _ = self.reprice('orders.ndjson', '{"order_id": 1, "items": []}\nnot json\n', '--workers', '2')
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn('line 2', result.output)
+        result, _ = self.reprice('orders.csv', 'order_id,code,quantity\n1,A,2\n2,A\n')
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn('line 3', result.output)
+        self.assertIsInstance(result.exception, SystemExit)
+
+if __name__ == '__main__':
+    unittest.main()
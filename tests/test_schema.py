@@ -0,0 +1,34 @@
+import sys
+import os
+
+# add the root directory to the sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import sqlite3
+import unittest
+from sqlalchemy.dialects import postgresql
+from model import db
+
+DUMP = os.path.join(os.path.dirname(__file__), '..', 'docker', 'postgres', 'dump.sql')
+# Postgres shorthands used in the dump, and the names SQLAlchemy compiles the model's types to
+TYPE_ALIASES = {'SERIAL': 'INTEGER', 'BIGSERIAL': 'BIGINT', 'TIMESTAMP WITHOUT TIME ZONE': 'TIMESTAMP'}
+
+class DumpSchemaTestCase(unittest.TestCase):
+    """docker/postgres/dump.sql builds the docker-compose database, so it must match the models (the migration head)."""
+
+    def test_dump_matches_models(self):
+        connection = sqlite3.connect(':memory:')
+        with open(DUMP) as f:
+            # SQLite keeps each column's declared type as written, which is all this compares
+            connection.executescript(f.read())
+        for table in db.metadata.sorted_tables:
+            dumped = {name: TYPE_ALIASES.get(declared, declared) for _, name, declared, *_ in
+                      connection.execute(f'PRAGMA table_info({table.name})')}
+            expected = {}
+            for column in table.columns:
+                declared = column.type.compile(dialect=postgresql.dialect())
+                expected[column.name] = TYPE_ALIASES.get(declared, declared)
+            self.assertEqual(dumped, expected, table.name)
+
+if __name__ == '__main__':
+    unittest.main()
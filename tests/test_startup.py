@@ -0,0 +1,62 @@
+import sys
+import os
+
+# add the root directory to the sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import subprocess
+import tempfile
+import unittest
+from app import create_app
+from config import ProductionConfig, TestConfig
+from model import Product, db
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+class StartupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.config = type('StartupConfig', (ProductionConfig,), {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{self.db_path}'
+        })
+
+    def tearDown(self):
+        os.remove(self.db_path)
+
+    def test_import_defers_optional_tooling(self):
+        result = subprocess.run(
+            [sys.executable, '-c', "import app, sys; print([m for m in ('flask_migrate', 'alembic', 'numpy') if m in sys.modules])"],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        )
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_production_profile_preloads_snapshot(self):
+        app = create_app(type('SeedConfig', (TestConfig,), {'SQLALCHEMY_DATABASE_URI': self.config.SQLALCHEMY_DATABASE_URI}))
+        with app.app_context():
+            db.create_all()
+            db.session.add_all([Product('A', 50, '3 for 140'), Product('B', 35)])
+            db.session.commit()
+            db.engine.dispose()
+
+        app = create_app(self.config)
+        self.assertEqual(app.extensions['pricing_cache'].stats()['products'], 2)
+        response = app.test_client().post('/api/subtotal', json=[{"code": "A", "quantity": 3}])
+        self.assertEqual(response.get_json(), {'subtotal': 140})
+
+    def test_preload_without_tables(self):
+        with self.assertLogs(level='WARNING'):
+            app = create_app(self.config)
+        self.assertEqual(app.extensions['pricing_cache'].stats()['products'], 0)
+
+    def test_db_commands_load_on_demand(self):
+        app = create_app(self.config)
+        self.assertNotIn('migrate', app.extensions)
+        result = app.test_cli_runner().invoke(args=['db', '--help'])
+        self.assertIn('upgrade', result.output)
+        self.assertIn('migrate', app.extensions)
+
+if __name__ == '__main__':
+    unittest.main()
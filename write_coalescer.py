@@ -0,0 +1,82 @@
+import threading
+import time
+
+
+class _Entry:
+    __slots__ = ('item', 'done', 'result', 'error')
+
+    def __init__(self, item):
+        self.item = item
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class WriteCoalescer:
+    """Group commit for writes submitted by concurrent request threads.
+
+    The first caller to find no batch in progress becomes the leader: it waits up
+    to `window` seconds for more submissions, then passes up to `max_batch` queued
+    items to `apply` in one call, in arrival order. Writes that arrive while a
+    batch is being applied queue up and go out together in the next one, so under
+    load many writes share a transaction while a lone write waits only `window`.
+    `apply` runs in the leader's thread and returns one result per item; if it
+    raises, every caller in the batch gets the exception.
+    """
+
+    def __init__(self, apply, window=0.0, max_batch=100):
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._apply = apply
+        self._queue = []
+        self._busy = False
+        self._cond = threading.Condition()
+        self.batches = 0
+        self.writes = 0
+
+    def submit(self, item):
+        entry = _Entry(item)
+        with self._cond:
+            self._queue.append(entry)
+            while not entry.done and (self._busy or self._queue[0] is not entry):
+                self._cond.wait()
+            if not entry.done:
+                self._busy = True
+        if entry.done:
+            return self._outcome(entry)
+        batch = []
+        try:
+            if self.window:
+                time.sleep(self.window)
+            with self._cond:
+                batch = self._queue[:self.max_batch]
+                del self._queue[:self.max_batch]
+            try:
+                results = self._apply([queued.item for queued in batch])
+            except Exception as e:
+                for queued in batch:
+                    queued.error = e
+            else:
+                for queued, result in zip(batch, results):
+                    queued.result = result
+        finally:
+            with self._cond:
+                if not batch:
+                    # Interrupted before taking the batch; hand the queue to the next caller
+                    self._queue.remove(entry)
+                for queued in batch:
+                    queued.done = True
+                self._busy = False
+                self.batches += bool(batch)
+                self.writes += len(batch)
+                self._cond.notify_all()
+        return self._outcome(entry)
+
+    def stats(self):
+        return {'batches': self.batches, 'writes': self.writes}
+
+    @staticmethod
+    def _outcome(entry):
+        if entry.error is not None:
+            raise entry.error
+        return entry.result